@@ -0,0 +1,9 @@
+"""Benchmarks of Circus.
+
+Each module is a script run from the root of the repository, e.g.::
+
+    $ python -m benchmarks.streams --writers 10 --output streams.json
+
+and writes its results as JSON so runs on different versions can be
+compared.
+"""
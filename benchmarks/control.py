@@ -0,0 +1,183 @@
+"""Measures how long the Arbiter takes to start, scale, reload and
+respawn processes.
+
+A real Arbiter runs in the loop, like in circusd, with watchers running a
+stub command loaded from a configuration file. Each operation is repeated
+and the benchmark reports the percentiles of its duration:
+
+- cold start and stop of all the watchers,
+- incr and decr of one watcher by a large count,
+- graceful and non-graceful reload of all the watchers,
+- reloadconfig with some of the watchers changed,
+- respawn of a process killed with SIGKILL.
+"""
+import os
+import random
+import shutil
+import signal
+import tempfile
+import time
+
+from tornado import gen
+
+from circus.arbiter import Arbiter
+from circus.util import tornado_sleep
+
+from benchmarks.support import (get_parser, get_endpoint, percentiles,
+                                in_ms, run, report)
+
+
+_CONFIG = """\
+[circus]
+endpoint = %(endpoint)s
+pubsub_endpoint = %(pubsub_endpoint)s
+check_delay = %(check_delay)s
+"""
+
+_WATCHER = """
+[watcher:%(name)s]
+cmd = %(cmd)s
+numprocesses = %(numprocesses)d
+graceful_timeout = %(graceful_timeout)s
+priority = %(priority)d
+"""
+
+
+def write_config(filename, args, endpoints, changed=0):
+    """Writes the configuration of the arbiter, where the priority of the
+    *changed* first watchers is changed, so reloadconfig restarts them."""
+    config = [_CONFIG % {'endpoint': endpoints[0],
+                         'pubsub_endpoint': endpoints[1],
+                         'check_delay': args.check_delay}]
+    for i in range(args.watchers):
+        config.append(_WATCHER % {'name': 'bench%d' % i, 'cmd': args.cmd,
+                                  'numprocesses': args.processes,
+                                  'graceful_timeout': args.graceful_timeout,
+                                  'priority': int(i < changed)})
+    with open(filename, 'w') as f:
+        f.write(''.join(config))
+
+
+@gen.coroutine
+def wait_for(predicate, timeout=30):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            raise RuntimeError('Timed out')
+        yield tornado_sleep(.001)
+
+
+@gen.coroutine
+def wait_idle(arbiter):
+    """Waits for the command the arbiter is running, like manage_watchers,
+    as the commands are exclusive."""
+    yield wait_for(lambda: arbiter._exclusive_running_command is None)
+
+
+@gen.coroutine
+def timed(arbiter, func, *args, **kw):
+    yield wait_idle(arbiter)
+    start = time.time()
+    yield func(*args, **kw)
+    raise gen.Return(time.time() - start)
+
+
+@gen.coroutine
+def respawn(watcher):
+    """Kills a process of *watcher* and returns how long it took to get a
+    new one."""
+    pid = random.choice(list(watcher.processes))
+    start = time.time()
+    os.kill(pid, signal.SIGKILL)
+    yield wait_for(lambda: (pid not in watcher.processes and
+                            len(watcher.processes) == watcher.numprocesses))
+    raise gen.Return(time.time() - start)
+
+
+@gen.coroutine
+def bench(loop, args):
+    tmpdir = tempfile.mkdtemp()
+    config = os.path.join(tmpdir, 'circus.ini')
+    endpoints = get_endpoint(), get_endpoint()
+    write_config(config, args, endpoints)
+    arbiter = Arbiter.load_from_config(config, loop=loop)
+    durations = dict((name, []) for name in (
+        'cold_start', 'stop', 'incr', 'decr', 'reload', 'reload_graceful',
+        'reloadconfig', 'respawn'))
+    try:
+        yield arbiter.start()
+        yield wait_idle(arbiter)
+        yield arbiter.stop_watchers()
+
+        for i in range(args.repeat):
+            duration = yield timed(arbiter, arbiter.start_watchers)
+            durations['cold_start'].append(duration)
+            duration = yield timed(arbiter, arbiter.stop_watchers)
+            durations['stop'].append(duration)
+        yield wait_idle(arbiter)
+        yield arbiter.start_watchers()
+
+        watcher = arbiter.get_watcher('bench0')
+        for i in range(args.repeat):
+            duration = yield timed(arbiter, watcher.incr, args.scale)
+            durations['incr'].append(duration)
+            duration = yield timed(arbiter, watcher.decr, args.scale)
+            durations['decr'].append(duration)
+
+        for i in range(args.repeat):
+            duration = yield timed(arbiter, arbiter.reload, graceful=True)
+            durations['reload_graceful'].append(duration)
+            duration = yield timed(arbiter, arbiter.reload, graceful=False)
+            durations['reload'].append(duration)
+
+        for i in range(args.repeat):
+            # every other time, the watchers get back their configuration
+            write_config(config, args, endpoints,
+                         0 if i % 2 else args.changed)
+            duration = yield timed(arbiter, arbiter.reload_from_config)
+            durations['reloadconfig'].append(duration)
+
+        for i in range(args.repeat):
+            watcher = arbiter.get_watcher('bench%d' % (i % args.watchers))
+            duration = yield respawn(watcher)
+            durations['respawn'].append(duration)
+    finally:
+        yield wait_idle(arbiter)
+        yield arbiter.stop()
+        shutil.rmtree(tmpdir)
+
+    raise gen.Return(dict(('%s_ms' % name, in_ms(percentiles(values)))
+                          for name, values in durations.items()))
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument('--watchers', type=int, default=10,
+                        help='Number of watchers')
+    parser.add_argument('--processes', type=int, default=5,
+                        help='Number of processes in each watcher')
+    parser.add_argument('--cmd', default='sleep 3600',
+                        help='The command of the watchers')
+    parser.add_argument('--scale', type=int, default=50,
+                        help='Number of processes added by incr and removed '
+                             'by decr')
+    parser.add_argument('--changed', type=int, default=2,
+                        help='Number of watchers changed by reloadconfig')
+    parser.add_argument('--check-delay', type=float, default=1.,
+                        help='The check_delay of the arbiter, which drives '
+                             'the respawns')
+    parser.add_argument('--graceful-timeout', type=int, default=1,
+                        help='The graceful_timeout of the watchers')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Number of times each operation is measured')
+    args = parser.parse_args()
+    args.changed = min(args.changed, args.watchers)
+
+    results = run(bench, args)
+    options = dict(vars(args))
+    del options['output']
+    report('control', options, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""Measures how much load the controller of circusd takes.
+
+circusd runs with a few watchers, and client processes send it a mix of
+commands through its ROUTER socket, from many concurrent CircusClient
+(each in a thread) or AsyncCircusClient (all in the loop of the process)
+instances. The benchmark reports the throughput, the latency percentiles
+and the rates of ConflictError and other errors, for each command and in
+total, along with the CPU used by circusd.
+"""
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import psutil
+
+from benchmarks.support import (get_parser, get_endpoint, percentiles,
+                                in_ms, report)
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CONFIG = """\
+[circus]
+endpoint = %(endpoint)s
+pubsub_endpoint = %(pubsub_endpoint)s
+check_delay = %(check_delay)s
+"""
+
+_WATCHER = """
+[watcher:%(name)s]
+cmd = sleep 3600
+numprocesses = %(numprocesses)d
+graceful_timeout = 1
+"""
+
+_COMMANDS = ('list', 'status', 'stats', 'get', 'incr', 'decr')
+
+
+def get_mix(value):
+    """Parses a mix like *list:4,incr:1* into a list of command names, each
+    repeated as many times as its weight."""
+    mix = []
+    for item in value.split(','):
+        name, weight = (item.split(':') + ['1'])[:2]
+        if name not in _COMMANDS:
+            raise ValueError('Unknown command %r' % name)
+        mix.extend([name] * int(weight))
+    return mix
+
+
+def make_command(name, watcher, waiting):
+    if name == 'list':
+        return {'command': 'list', 'properties': {}}
+    if name == 'get':
+        return {'command': 'get',
+                'properties': {'name': watcher, 'keys': ['numprocesses']}}
+    if name in ('incr', 'decr'):
+        return {'command': name,
+                'properties': {'name': watcher, 'nb': 1, 'waiting': waiting}}
+    return {'command': name, 'properties': {'name': watcher}}
+
+
+class Results(object):
+    """The outcome of the commands sent by one client process."""
+
+    def __init__(self):
+        self.latencies = dict((name, []) for name in _COMMANDS)
+        self.conflicts = dict((name, 0) for name in _COMMANDS)
+        self.errors = dict((name, 0) for name in _COMMANDS)
+
+    def add(self, name, latency, res):
+        self.latencies[name].append(latency)
+        if res.get('status') != 'error':
+            return
+        reason = res.get('reason', '')
+        if 'already running' in reason or 'restarting' in reason:
+            self.conflicts[name] += 1
+        else:
+            self.errors[name] += 1
+
+    def merge(self, other):
+        for name in _COMMANDS:
+            self.latencies[name].extend(other.latencies[name])
+            self.conflicts[name] += other.conflicts[name]
+            self.errors[name] += other.errors[name]
+
+
+def _commands(args):
+    mix = get_mix(args.mix)
+    watchers = ['bench%d' % i for i in range(args.watchers)]
+    while True:
+        name = random.choice(mix)
+        yield name, make_command(name, random.choice(watchers),
+                                 args.waiting)
+
+
+def run_sync_client(args, start, results, lock):
+    from circus.client import CircusClient
+    from circus.exc import CallError
+
+    client = CircusClient(endpoint=args.endpoint, timeout=args.timeout)
+    local = Results()
+    try:
+        while time.time() < start:
+            time.sleep(.001)
+        for name, command in _commands(args):
+            if time.time() > start + args.duration:
+                break
+            sent = time.time()
+            try:
+                res = client.call(command)
+            except CallError as e:
+                res = {'status': 'error', 'reason': str(e)}
+            local.add(name, time.time() - sent, res)
+    finally:
+        client.stop()
+    with lock:
+        results.merge(local)
+
+
+def run_sync_clients(args, start):
+    results = Results()
+    lock = threading.Lock()
+    threads = [threading.Thread(target=run_sync_client,
+                                args=(args, start, results, lock))
+               for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def run_async_clients(args, start):
+    from tornado import gen
+    from zmq.eventloop import ioloop
+    from circus.client import AsyncCircusClient
+    from circus.util import tornado_sleep
+
+    ioloop.install()
+    loop = ioloop.IOLoop.instance()
+    results = Results()
+
+    @gen.coroutine
+    def run_client():
+        client = AsyncCircusClient(endpoint=args.endpoint)
+        try:
+            yield tornado_sleep(max(0, start - time.time()))
+            for name, command in _commands(args):
+                if time.time() > start + args.duration:
+                    break
+                sent = time.time()
+                res = yield client.call(command)
+                results.add(name, time.time() - sent, res)
+        finally:
+            client.stop()
+
+    @gen.coroutine
+    def run_clients():
+        yield [run_client() for _ in range(args.clients)]
+
+    loop.run_sync(run_clients)
+    return results
+
+
+def run_clients(job):
+    args, start = job
+    if args.client == 'async':
+        return run_async_clients(args, start)
+    return run_sync_clients(args, start)
+
+
+def wait_for_circusd(endpoint, timeout=30):
+    from circus.client import CircusClient
+    from circus.exc import CallError
+
+    client = CircusClient(endpoint=endpoint, timeout=1.)
+    deadline = time.time() + timeout
+    try:
+        while True:
+            try:
+                client.send_message('list')
+                return
+            except CallError:
+                if time.time() > deadline:
+                    raise
+    finally:
+        client.stop()
+
+
+def stop_circusd(circusd, attempts=10):
+    # quit conflicts with the commands still running, so it's retried
+    for _ in range(attempts):
+        circusd.terminate()
+        deadline = time.time() + 1
+        while time.time() < deadline:
+            if circusd.poll() is not None:
+                return
+            time.sleep(.01)
+    circusd.kill()
+    circusd.wait()
+
+
+def summarize(latencies, conflicts, errors, elapsed):
+    count = len(latencies)
+    return {'count': count,
+            'per_sec': round(count / elapsed, 1),
+            'latency_ms': in_ms(percentiles(latencies)),
+            'conflict_rate': round(float(conflicts) / count, 4)
+            if count else None,
+            'error_rate': round(float(errors) / count, 4) if count else None}
+
+
+def bench(args):
+    # the client processes are forked before any zmq context exists
+    pool = multiprocessing.Pool(args.processes)
+    tmpdir = tempfile.mkdtemp()
+    config = os.path.join(tmpdir, 'circus.ini')
+    args.endpoint = get_endpoint()
+    with open(config, 'w') as f:
+        f.write(_CONFIG % {'endpoint': args.endpoint,
+                           'pubsub_endpoint': get_endpoint(),
+                           'check_delay': args.check_delay})
+        for i in range(args.watchers):
+            f.write(_WATCHER % {'name': 'bench%d' % i,
+                                'numprocesses': args.numprocesses})
+
+    circusd = subprocess.Popen([sys.executable, '-m', 'circus.circusd',
+                                '--log-level', 'warning', config], cwd=_ROOT)
+    try:
+        wait_for_circusd(args.endpoint)
+        process = psutil.Process(circusd.pid)
+
+        start = time.time() + 1
+        jobs = pool.map_async(run_clients, [(args, start)] * args.processes)
+        time.sleep(max(0, start - time.time()))
+        cpu = process.cpu_times()
+        time.sleep(args.duration)
+        used = sum(process.cpu_times()) - sum(cpu)
+        outcomes = jobs.get()
+    finally:
+        pool.close()
+        stop_circusd(circusd)
+        shutil.rmtree(tmpdir)
+
+    results = Results()
+    for outcome in outcomes:
+        results.merge(outcome)
+
+    elapsed = args.duration
+    commands = {}
+    for name in _COMMANDS:
+        if results.latencies[name]:
+            commands[name] = summarize(results.latencies[name],
+                                       results.conflicts[name],
+                                       results.errors[name], elapsed)
+    total = summarize(sum(results.latencies.values(), []),
+                      sum(results.conflicts.values()),
+                      sum(results.errors.values()), elapsed)
+    total['circusd_cpu_percent'] = round(100. * used / elapsed, 1)
+    return {'total': total, 'commands': commands}
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument('--client', default='sync',
+                        choices=['sync', 'async'],
+                        help='CircusClient in threads, or AsyncCircusClient')
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Number of client processes')
+    parser.add_argument('--clients', type=int, default=10,
+                        help='Number of clients in each process')
+    parser.add_argument('--mix', type=str,
+                        default='list:4,status:4,stats:1,get:2,incr:1,decr:1',
+                        help='The commands sent, with their weights')
+    parser.add_argument('--waiting', action='store_true', default=False,
+                        help='Wait for incr and decr to be done before '
+                             'answering')
+    parser.add_argument('--watchers', type=int, default=5,
+                        help='Number of watchers')
+    parser.add_argument('--numprocesses', type=int, default=2,
+                        help='Number of processes in each watcher')
+    parser.add_argument('--check-delay', type=float, default=1.,
+                        help='The check_delay of circusd')
+    parser.add_argument('--timeout', type=float, default=5.,
+                        help='Timeout of the CircusClient calls')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds of measures')
+    args = parser.parse_args()
+    get_mix(args.mix)
+
+    results = bench(args)
+    options = dict(vars(args))
+    del options['output']
+    del options['endpoint']
+    report('controller', options, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""Measures the output path of Circus: pipes, redirectors and streams.
+
+Synthetic writers run in a real Arbiter and write timestamped lines, which
+go through the redirector to the stream under test. The benchmark reports
+the bytes and lines per second that reached the stream, the latency of the
+lines, the CPU used by the arbiter and how late its loop runs.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from tornado import gen
+
+from circus.stream import (FileStream, WatchedFileStream,
+                           FancyStdoutStream)
+from circus.util import tornado_sleep
+from circus.watcher import Watcher
+
+from benchmarks.support import (get_parser, make_arbiter, percentiles,
+                                in_ms, LoopLag, CPUTime, run, report)
+
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class NullStream(object):
+    def __init__(self, **kwargs):
+        pass
+
+    def __call__(self, data):
+        pass
+
+    def close(self):
+        pass
+
+
+class MeasuringStream(object):
+    """Counts what goes through to *stream*, and the latency of the first
+    and last complete lines of each chunk.
+
+    When *stream* allows it, the output is spliced to its file: only the
+    bytes spliced are counted then."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.measuring = False
+        self.bytes = self.lines = self.spliced_bytes = 0
+        self.latencies = []
+
+    def __getattr__(self, name):
+        # the redirector splices when the stream has splice_fileno
+        if name in ('splice_fileno', 'splice_room'):
+            return getattr(self.stream, name)
+        raise AttributeError(name)
+
+    def spliced(self, size):
+        if self.measuring:
+            self.spliced_bytes += size
+        spliced = getattr(self.stream, 'spliced', None)
+        if spliced is not None:
+            spliced(size)
+
+    def __call__(self, data):
+        if self.measuring:
+            now = time.time()
+            chunk = data['data']
+            self.bytes += len(chunk)
+            self.lines += chunk.count(b'\n')
+
+            # the chunk may start in the middle of a line
+            first = chunk.find(b'\n') + 1
+            last = chunk.rfind(b'\n', 0, len(chunk) - 1) + 1
+            for start in set((first, last)):
+                if 0 < start < len(chunk):
+                    self._add_latency(chunk[start:start + 20], now)
+        self.stream(data)
+
+    def _add_latency(self, stamp, now):
+        try:
+            self.latencies.append(now - float(stamp.split(b' ')[0]))
+        except ValueError:
+            pass
+
+    def close(self):
+        self.stream.close()
+
+
+def get_stream(kind, tmpdir):
+    filename = os.path.join(tmpdir, 'out.log')
+    if kind == 'file':
+        return FileStream(filename)
+    if kind == 'watched':
+        return WatchedFileStream(filename)
+    if kind == 'fancy':
+        stream = FancyStdoutStream(color='green')
+        stream.out = open(os.devnull, 'w')
+        return stream
+    return NullStream()
+
+
+@gen.coroutine
+def bench(loop, args):
+    tmpdir = tempfile.mkdtemp()
+    streams = []
+    watchers = []
+    for i in range(args.watchers):
+        stream = MeasuringStream(get_stream(args.stream,
+                                            tempfile.mkdtemp(dir=tmpdir)))
+        streams.append(stream)
+        cmd_args = ['-m', 'benchmarks.writer', '--rate', str(args.rate),
+                    '--size', str(args.size)]
+        watchers.append(Watcher(
+            'writer%d' % i, sys.executable, args=cmd_args,
+            numprocesses=args.writers, working_dir=_ROOT, copy_env=True,
+            graceful_timeout=1, loop=loop,
+            stdout_stream={'stream': stream,
+                           'line_buffered': args.line_buffered}))
+
+    arbiter = make_arbiter(watchers, loop, fair_output=args.fair_output)
+    lag = LoopLag(loop)
+    cpu = CPUTime()
+    try:
+        yield arbiter.start()
+        yield tornado_sleep(args.warmup)
+
+        for stream in streams:
+            stream.measuring = True
+        lag.start()
+        cpu.start()
+        start = time.time()
+        yield tornado_sleep(args.duration)
+        elapsed = time.time() - start
+        cpu_percent = cpu.percent()
+        lag.stop()
+        for stream in streams:
+            stream.measuring = False
+    finally:
+        yield arbiter.stop()
+        shutil.rmtree(tmpdir)
+
+    spliced = sum(stream.spliced_bytes for stream in streams)
+    size = sum(stream.bytes for stream in streams) + spliced
+    # the writers write lines of --size bytes
+    lines = sum(stream.lines for stream in streams) + spliced // args.size
+    latencies = []
+    for stream in streams:
+        latencies.extend(stream.latencies)
+    raise gen.Return({
+        'bytes': size,
+        'spliced_bytes': spliced,
+        'bytes_per_sec': int(size / elapsed),
+        'lines_per_sec': int(lines / elapsed),
+        'latency_ms': in_ms(percentiles(latencies)),
+        'cpu_percent': cpu_percent,
+        'loop_lag_ms': in_ms(percentiles(lag.lags))})
+
+
+def main():
+    parser = get_parser(__doc__)
+    parser.add_argument('--watchers', type=int, default=1,
+                        help='Number of watchers')
+    parser.add_argument('--writers', type=int, default=4,
+                        help='Number of writers in each watcher')
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Lines per second of each writer, 0 to write '
+                             'as fast as possible')
+    parser.add_argument('--size', type=int, default=100,
+                        help='Size of the lines in bytes')
+    parser.add_argument('--stream', default='file',
+                        choices=['file', 'watched', 'fancy', 'null'],
+                        help='The stream the output goes to')
+    parser.add_argument('--line-buffered', action='store_true',
+                        default=False, help='Frame the output on lines')
+    parser.add_argument('--fair-output', action='store_true',
+                        default=False,
+                        help='Read the pipes of the watchers in turns')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds of measures')
+    parser.add_argument('--warmup', type=float, default=1,
+                        help='Seconds to wait for the writers to start')
+    args = parser.parse_args()
+
+    results = run(bench, args)
+    options = dict(vars(args))
+    del options['output']
+    report('streams', options, results, args.output)
+
+
+if __name__ == '__main__':
+    main()
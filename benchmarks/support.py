@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import platform
+import socket
+import sys
+import time
+
+from zmq.eventloop import ioloop
+
+import circus
+from circus.arbiter import Arbiter
+
+
+def get_endpoint():
+    """Returns a tcp endpoint on a free port of localhost."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return 'tcp://127.0.0.1:%d' % sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def make_arbiter(watchers, loop, **kw):
+    """Returns an Arbiter running in *loop*, on free endpoints."""
+    kw.setdefault('check_delay', -1)
+    return Arbiter(watchers, get_endpoint(), get_endpoint(), loop=loop, **kw)
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Returns the percentiles of *values* and their max, as a mapping."""
+    values = sorted(values)
+    if not values:
+        return dict(('p%d' % point, None) for point in points + ('max',))
+    res = {'max': values[-1]}
+    for point in points:
+        index = min(len(values) - 1, int(len(values) * point / 100.))
+        res['p%d' % point] = values[index]
+    return res
+
+
+def in_ms(stats):
+    """Converts a mapping of durations in seconds to milliseconds."""
+    return dict((key, None if value is None else round(value * 1000, 3))
+                for key, value in stats.items())
+
+
+class LoopLag(object):
+    """Measures how late the callbacks of *loop* run, by scheduling one
+    every *interval* seconds."""
+
+    def __init__(self, loop, interval=.01):
+        self.loop = loop
+        self.interval = interval
+        self.lags = []
+        self._timeout = None
+        self._deadline = None
+
+    def start(self):
+        self._deadline = time.time() + self.interval
+        self._timeout = self.loop.add_timeout(self._deadline, self._tick)
+
+    def _tick(self):
+        now = time.time()
+        self.lags.append(max(0, now - self._deadline))
+        self._deadline = now + self.interval
+        self._timeout = self.loop.add_timeout(self._deadline, self._tick)
+
+    def stop(self):
+        if self._timeout is not None:
+            self.loop.remove_timeout(self._timeout)
+            self._timeout = None
+
+
+class CPUTime(object):
+    """Measures the CPU time used by this process."""
+
+    def start(self):
+        self._times = os.times()
+        self._start = time.time()
+
+    def percent(self):
+        """Returns the CPU used since start, in percent of one core."""
+        times = os.times()
+        used = (times[0] - self._times[0]) + (times[1] - self._times[1])
+        return round(100. * used / (time.time() - self._start), 1)
+
+
+def get_parser(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--output', default=None,
+                        help='The file to write the results to, as JSON '
+                             '(default: stdout)')
+    return parser
+
+
+def run(func, *args, **kw):
+    """Runs the coroutine *func* in the loop, like circusd does, and
+    returns its result."""
+    ioloop.install()
+    loop = ioloop.IOLoop.instance()
+    return loop.run_sync(lambda: func(loop, *args, **kw))
+
+
+def report(name, options, results, output=None):
+    """Writes the results of a benchmark, along with what it ran on."""
+    data = {'benchmark': name,
+            'circus': circus.__version__,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'time': time.time(),
+            'options': options,
+            'results': results}
+    dump = json.dumps(data, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+    if output is None:
+        sys.stdout.write(dump + '\n')
+    else:
+        with open(output, 'w') as f:
+            f.write(dump + '\n')
@@ -0,0 +1,49 @@
+"""Synthetic process writing timestamped lines on its stdout.
+
+Each line starts with the time it was written at, so the benchmarks can
+tell how long it took to reach the stream.
+"""
+import argparse
+import os
+import time
+
+# lines are written in batches, every tick when the rate is limited
+_TICK = .01
+_BATCH = 64
+
+
+def make_line(size):
+    line = '%.6f ' % time.time()
+    return (line + 'x' * max(0, size - len(line) - 1) + '\n').encode('ascii')
+
+
+def write(lines):
+    data = b''.join(lines)
+    while data:
+        data = data[os.write(1, data):]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=0,
+                        help='Lines per second, 0 to write as fast as the '
+                             'pipe allows')
+    parser.add_argument('--size', type=int, default=100,
+                        help='Size of the lines in bytes')
+    args = parser.parse_args()
+
+    start = time.time()
+    written = 0
+    while True:
+        if not args.rate:
+            write([make_line(args.size) for _ in range(_BATCH)])
+            continue
+        due = int((time.time() - start) * args.rate) - written
+        if due > 0:
+            write([make_line(args.size) for _ in range(due)])
+            written += due
+        time.sleep(_TICK)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ import sys
 from time import sleep
 import select
 import socket
+import tempfile
 from tornado import gen
 import time
 
@@ -22,6 +23,8 @@ from circus.util import DictDiffer, synchronized, tornado_sleep
 from circus.config import get_config
 from circus.plugins import get_plugin_cmd
 from circus.sockets import CircusSocket, CircusSockets
+from circus.stream import shipper, OutputScheduler
+from circus.stats.streamer import ArbiterStatsStreamer
 
 
 _ENV_EXCEPTIONS = ('__CF_USER_TEXT_ENCODING', 'PS1', 'COMP_WORDBREAKS',
@@ -41,6 +44,45 @@ class Arbiter(object):
     - **stats_endpoint** -- the stats endpoint.
     - **statsd_close_outputs** -- if True sends the circusd-stats stdout/stderr
       to /dev/null (default: False)
+    - **stats_batch** -- if set to *watcher* or *cycle*, circusd-stats
+      publishes the stats of each watcher, or of all the watchers, in a
+      single message (default: None)
+    - **stats_encoding** -- the encoding of the stats published by
+      circusd-stats: *json* or *msgpack* (default: json)
+    - **stats_keyframe_interval** -- if set, circusd-stats publishes the
+      full stats once every this number of cycles only, and their changes
+      in between (default: 0)
+    - **stats_history_endpoint** -- if set, circusd-stats keeps the history
+      of the stats in memory, and answers the *history* queries on this
+      endpoint (default: None)
+    - **stats_shm** -- if set, circusd-stats writes the latest stats in
+      this file, e.g. in /dev/shm, for
+      :class:`circus.stats.shm.StatsSegmentReader` (default: None)
+    - **stats_inprocess** -- if True, the stats are collected by a thread
+      of circusd, from its own table of processes, instead of a
+      circusd-stats process (default: False)
+    - **stats_process_tree** -- if True, the stats of the watchers include
+      the descendants of their processes (default: False)
+    - **stats_mem_accounting** -- the memory of the processes in the stats:
+      *rss*, or *pss* or *uss* read in /proc/<pid>/smaps_rollup
+      (default: rss)
+    - **stats_mem_interval** -- the seconds between two reads of the PSS or
+      USS of a process (default: 10)
+    - **log_shipper** -- If True, the output of the processes is streamed
+      by a circusd-logger process instead of circusd (default: False)
+    - **log_shipper_endpoint** -- the unix socket path circusd-logger
+      connects to. (default: a file in the temporary directory)
+    - **log_shipper_max_mem** -- if set, circusd-logger is respawned when
+      its memory gets over this value, e.g. 200M (default: None)
+    - **output_endpoint** -- if set, the output of the watchers with
+      *publish_output* is published on this endpoint (default: None)
+    - **output_hwm** -- the number of messages queued for each subscriber
+      of **output_endpoint** before the new ones are dropped (default: 1000)
+    - **fair_output** -- If True, the pipes of all the watchers are read in
+      turns, according to the *output_weight* of each watcher, so a
+      watcher flooding its output doesn't delay the others (default: False)
+    - **output_quantum** -- with **fair_output**, the number of bytes read
+      for each unit of weight of a watcher in each turn (default: 65536)
     - **multicast_endpoint** -- the multicast endpoint for circusd cluster
       auto-discovery (default: udp://237.219.251.97:12027)
       Multicast addr should be between 224.0.0.0 to 239.255.255.255 and the
@@ -86,7 +128,14 @@ class Arbiter(object):
                  httpd_close_outputs=False, debug=False, debug_gc=False,
                  ssh_server=None, proc_name='circusd', pidfile=None,
                  loglevel=None, logoutput=None, fqdn_prefix=None, umask=None,
-                 endpoint_owner=None):
+                 endpoint_owner=None, log_shipper=False,
+                 log_shipper_endpoint=None, log_shipper_max_mem=None,
+                 output_endpoint=None, output_hwm=1000, fair_output=False,
+                 output_quantum=65536, stats_batch=None,
+                 stats_encoding='json', stats_keyframe_interval=0,
+                 stats_history_endpoint=None, stats_shm=None,
+                 stats_inprocess=False, stats_process_tree=False,
+                 stats_mem_accounting='rss', stats_mem_interval=10.):
 
         self.watchers = watchers
         self.endpoint = endpoint
@@ -97,6 +146,9 @@ class Arbiter(object):
         self.proc_name = proc_name
         self.ssh_server = ssh_server
         self.evpub_socket = None
+        self.output_endpoint = output_endpoint
+        self.output_hwm = output_hwm
+        self.output_socket = None
         self.pidfile = pidfile
         self.loglevel = loglevel
         self.logoutput = logoutput
@@ -124,6 +176,12 @@ class Arbiter(object):
 
         # initialize zmq context
         self._init_context(context)
+
+        # the pipes of all the watchers are read in turns when set
+        self.output_scheduler = None
+        if fair_output:
+            self.output_scheduler = OutputScheduler(loop=self.loop,
+                                                    quantum=output_quantum)
         self.pid = os.getpid()
         self._watchers_names = {}
         self._stopping = False
@@ -142,13 +200,38 @@ class Arbiter(object):
         # initializing circusd-stats as a watcher when configured
         self.statsd = statsd
         self.stats_endpoint = stats_endpoint
-
-        if self.statsd:
+        self.stats_streamer = None
+        self._stats_options = None
+
+        if self.statsd and stats_inprocess:
+            self._stats_options = dict(
+                batch=stats_batch, encoding=stats_encoding,
+                keyframe_interval=stats_keyframe_interval,
+                history_endpoint=stats_history_endpoint, shm_path=stats_shm,
+                process_tree=stats_process_tree,
+                mem_accounting=stats_mem_accounting,
+                mem_interval=stats_mem_interval)
+        elif self.statsd:
             cmd = "%s -c 'from circus import stats; stats.main()'" % \
                 sys.executable
             cmd += ' --endpoint %s' % self.endpoint
             cmd += ' --pubsub %s' % self.pubsub_endpoint
             cmd += ' --statspoint %s' % self.stats_endpoint
+            if stats_batch is not None:
+                cmd += ' --batch %s' % stats_batch
+            if stats_encoding != 'json':
+                cmd += ' --encoding %s' % stats_encoding
+            if stats_keyframe_interval:
+                cmd += ' --keyframe-interval %d' % stats_keyframe_interval
+            if stats_history_endpoint is not None:
+                cmd += ' --history %s' % stats_history_endpoint
+            if stats_shm is not None:
+                cmd += ' --shm %s' % stats_shm
+            if stats_process_tree:
+                cmd += ' --process-tree'
+            if stats_mem_accounting != 'rss':
+                cmd += ' --mem-accounting %s' % stats_mem_accounting
+                cmd += ' --mem-interval %s' % stats_mem_interval
             if ssh_server is not None:
                 cmd += ' --ssh %s' % ssh_server
             if debug:
@@ -165,8 +248,40 @@ class Arbiter(object):
                                     close_child_stderr=statsd_close_outputs,
                                     close_child_stdout=statsd_close_outputs)
 
+            stats_watcher.is_internal = True
             self.watchers.append(stats_watcher)
 
+        # initializing circusd-logger as a watcher when configured
+        self.shipper = None
+        if log_shipper and not shipper.is_supported():
+            logger.warning('The log shipper needs Python 3.3+, the output '
+                           'of the processes stays in circusd')
+        elif log_shipper:
+            if log_shipper_endpoint is None:
+                log_shipper_endpoint = os.path.join(
+                    tempfile.gettempdir(), 'circusd-logger-%d.sock' % self.pid)
+            self.shipper = shipper.OutputShipper(log_shipper_endpoint,
+                                                 loop=self.loop)
+
+            cmd = "%s -c 'from circus.stream import shipper; " \
+                  "shipper.main()'" % sys.executable
+            cmd += ' --endpoint %s' % log_shipper_endpoint
+            if log_shipper_max_mem:
+                cmd += ' --max-mem %s' % log_shipper_max_mem
+            if debug:
+                cmd += ' --log-level DEBUG'
+            elif self.loglevel:
+                cmd += ' --log-level ' + self.loglevel
+            if self.logoutput:
+                cmd += ' --log-output ' + self.logoutput
+            logger_watcher = Watcher('circusd-logger', cmd, singleton=True,
+                                     stdout_stream=self.stdout_stream,
+                                     stderr_stream=self.stderr_stream,
+                                     copy_env=True, copy_path=True)
+
+            logger_watcher.is_internal = True
+            self.watchers.append(logger_watcher)
+
         # adding the httpd
         if httpd:
             # adding the socket
@@ -192,6 +307,7 @@ class Arbiter(object):
                                     copy_env=True, copy_path=True,
                                     close_child_stderr=httpd_close_outputs,
                                     close_child_stdout=httpd_close_outputs)
+            httpd_watcher.is_internal = True
             self.watchers.append(httpd_watcher)
 
         # adding each plugin as a watcher
@@ -217,6 +333,7 @@ class Arbiter(object):
                     plugin_cfg['name'] = fqn
 
                 plugin_watcher = Watcher.load_from_config(plugin_cfg)
+                plugin_watcher.is_internal = True
                 self.watchers.append(plugin_watcher)
 
         self.sockets = CircusSockets(sockets)
@@ -284,7 +401,7 @@ class Arbiter(object):
             return
 
         ignore_sn = set(['circushttpd'])
-        ignore_wn = set(['circushttpd', 'circusd-stats'])
+        ignore_wn = set(['circushttpd', 'circusd-stats', 'circusd-logger'])
 
         # Gather socket names.
         current_sn = set([i.name for i in self.sockets.values()]) - ignore_sn
@@ -447,7 +564,26 @@ class Arbiter(object):
                       logoutput=cfg.get('logoutput', None),
                       fqdn_prefix=cfg.get('fqdn_prefix', None),
                       umask=cfg['umask'],
-                      endpoint_owner=cfg.get('endpoint_owner', None))
+                      endpoint_owner=cfg.get('endpoint_owner', None),
+                      log_shipper=cfg.get('log_shipper', False),
+                      log_shipper_endpoint=cfg.get('log_shipper_endpoint'),
+                      log_shipper_max_mem=cfg.get('log_shipper_max_mem'),
+                      output_endpoint=cfg.get('output_endpoint'),
+                      output_hwm=cfg.get('output_hwm', 1000),
+                      fair_output=cfg.get('fair_output', False),
+                      output_quantum=cfg.get('output_quantum', 65536),
+                      stats_batch=cfg.get('stats_batch'),
+                      stats_encoding=cfg.get('stats_encoding', 'json'),
+                      stats_keyframe_interval=cfg.get(
+                          'stats_keyframe_interval', 0),
+                      stats_history_endpoint=cfg.get(
+                          'stats_history_endpoint'),
+                      stats_shm=cfg.get('stats_shm'),
+                      stats_inprocess=cfg.get('stats_inprocess', False),
+                      stats_process_tree=cfg.get('stats_process_tree', False),
+                      stats_mem_accounting=cfg.get('stats_mem_accounting',
+                                                   'rss'),
+                      stats_mem_interval=cfg.get('stats_mem_interval', 10.))
 
         # store the cfg which will be used, so it can be used later
         # for checking if the cfg has been changed
@@ -473,11 +609,23 @@ class Arbiter(object):
         self.evpub_socket.bind(self.pubsub_endpoint)
         self.evpub_socket.linger = 0
 
+        # output pub socket, the slow subscribers lose messages rather than
+        # making circusd queue them
+        if self.output_endpoint is not None:
+            self.output_socket = self.context.socket(zmq.PUB)
+            self.output_socket.sndhwm = self.output_hwm
+            self.output_socket.linger = 0
+            self.output_socket.bind(self.output_endpoint)
+
         # initialize sockets
         if len(self.sockets) > 0:
             self.sockets.bind_and_listen_all()
             logger.info("sockets started")
 
+        # the pipes of the processes are sent to circusd-logger
+        if self.shipper is not None:
+            self.shipper.start()
+
         # initialize watchers
         for watcher in self.iter_watchers():
             self._watchers_names[watcher.name.lower()] = watcher
@@ -510,6 +658,13 @@ class Arbiter(object):
         # start controller
         self.ctrl.start()
         self._restarting = False
+
+        # collect the stats in a thread, when circusd-stats isn't used
+        if self._stats_options is not None and self.stats_streamer is None:
+            self.stats_streamer = ArbiterStatsStreamer(
+                self, self.stats_endpoint, **self._stats_options)
+            self.stats_streamer.start_thread()
+
         try:
             # initialize processes
             logger.debug('Initializing watchers')
@@ -532,10 +687,19 @@ class Arbiter(object):
     def stop_controller_and_close_sockets(self):
         self.ctrl.stop()
         self.evpub_socket.close()
+        if self.output_socket is not None:
+            self.output_socket.close()
 
         if len(self.sockets) > 0:
             self.sockets.close_all()
 
+        if self.shipper is not None:
+            self.shipper.stop()
+
+        if self.stats_streamer is not None:
+            self.stats_streamer.stop_thread()
+            self.stats_streamer = None
+
         self._running = False
 
     def start_io_loop(self):
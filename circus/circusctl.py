@@ -151,6 +151,10 @@ class ControllerApp(object):
                     args.endpoint = DEFAULT_ENDPOINT_DEALER
 
             msg = cmd.message(*args.args, **opts)
+            if opts.get('follow') and hasattr(cmd, 'follow_topics'):
+                return self.handle_follow(cmd, self.globalopts, msg,
+                                          args.endpoint, int(args.timeout),
+                                          args.ssh, args.ssh_keyfile)
             handler = getattr(self, "handle_%s" % cmd.msg_type)
             return handler(cmd, self.globalopts, msg, args.endpoint,
                            int(args.timeout), args.ssh, args.ssh_keyfile)
@@ -162,6 +166,41 @@ class ControllerApp(object):
             print("%s: %s" % (topic, msg))
         return 0
 
+    def handle_follow(self, cmd, opts, msg, endpoint, timeout, ssh_server,
+                      ssh_keyfile):
+        if endpoint is not None:
+            client = CircusClient(endpoint=endpoint, timeout=timeout,
+                                  ssh_server=ssh_server,
+                                  ssh_keyfile=ssh_keyfile)
+        else:
+            client = self.client
+
+        try:
+            resp = client.call(msg)
+        except CallError as e:
+            sys.stderr.write(str(e))
+            return 1
+        finally:
+            if endpoint is not None:
+                client.stop()
+
+        print(cmd.console_msg(resp))
+        if resp.get('status') != 'ok':
+            return 1
+        if 'pubsub_endpoint' not in resp:
+            sys.stderr.write('The output is not published, set the '
+                             'follow_output option of the watcher\n')
+            return 1
+
+        consumer = CircusConsumer(cmd.follow_topics(msg),
+                                  endpoint=resp['pubsub_endpoint'],
+                                  ssh_server=ssh_server)
+        for topic, event in consumer:
+            line = cmd.console_event(msg, json.loads(event.decode("utf-8")))
+            if line is not None:
+                print(line)
+        return 0
+
     def _console(self, client, cmd, opts, msg):
         if opts['json']:
             return prettify(client.call(msg), prettify=opts['prettify'])
@@ -369,13 +408,16 @@ def parse_arguments(args, commands):
             subparser.add_argument('args', nargs="*",
                                    help=argparse.SUPPRESS)
             for option in klass.options:
-                __, name, default, desc = option
+                short, name, default, desc = option
                 if isinstance(default, bool):
                     action = 'store_true'
                 else:
                     action = 'store'
 
-                subparser.add_argument('--' + name, action=action,
+                flags = ['--' + name]
+                if len(short) == 1:
+                    flags.insert(0, '-' + short)
+                subparser.add_argument(*flags, action=action,
                                        default=default, help=desc)
 
     args = parser.parse_args(args)
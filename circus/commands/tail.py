@@ -0,0 +1,109 @@
+from circus.exc import MessageError, ArgumentError
+from circus.commands.base import Command
+
+
+class Tail(Command):
+    """\
+       Get the last lines of output
+       ============================
+
+       When a watcher has an **output_ring_size**, circus keeps the last
+       bytes of output of its processes in memory. This command returns
+       the last lines of it, for the whole watcher or for one process.
+
+       ZMQ Message
+       -----------
+
+       ::
+
+            {
+                "command": "tail",
+                "properties": {
+                    "name": <name>,
+                    "process": <processid>,
+                    "lines": <number of lines>
+                }
+            }
+
+       The "process" property is optional, and "lines" defaults to 10.
+
+       The response returns the lines with the pid of the process and the
+       name of the stream they come from and, when the watcher has
+       **follow_output** set, the pubsub endpoint on which the new output
+       is published::
+
+            {
+                "status": "ok",
+                "lines": [
+                    {"pid": 4561, "name": "stderr", "line": "Traceback..."}
+                ],
+                "pubsub_endpoint": "tcp://127.0.0.1:5556",
+                "time": 1332265655.897085
+            }
+
+       The new output is published with the *watcher.<name>.output* topic.
+
+       Command Line
+       ------------
+
+       ::
+
+            $ circusctl tail [--lines <n>] [--follow] <name> [<processid>]
+
+       With --follow, the command keeps printing the output as it comes,
+       if the watcher has **follow_output** set.
+
+        """
+
+    name = "tail"
+    properties = ['name']
+    options = [('n', 'lines', 10, "Number of lines to display"),
+               ('f', 'follow', False, "Keep printing the new output")]
+
+    def message(self, *args, **opts):
+        if len(args) not in (1, 2):
+            raise ArgumentError("message invalid")
+
+        props = {'name': args[0], 'lines': int(opts.get('lines', 10))}
+        if len(args) == 2:
+            props['process'] = int(args[1])
+        return self.make_message(**props)
+
+    def execute(self, arbiter, props):
+        watcher = self._get_watcher(arbiter, props['name'])
+        try:
+            lines = watcher.tail(props.get('lines', 10), props.get('process'))
+        except KeyError:
+            raise MessageError("process %r not found in %r" % (
+                props['process'], props['name']))
+        except ValueError as e:
+            raise MessageError(str(e))
+        res = {"lines": lines}
+        if watcher.follow_output:
+            res["pubsub_endpoint"] = arbiter.pubsub_endpoint
+        return res
+
+    def follow_topics(self, msg):
+        """Returns the pubsub topics to follow the output."""
+        name = msg['properties']['name'].lower().replace(" ", "_")
+        return ['watcher.%s.output' % name]
+
+    def console_event(self, msg, event):
+        """Formats an output event, or returns None to skip it."""
+        pid = msg['properties'].get('process')
+        if pid is not None and event['process_pid'] != pid:
+            return None
+        lines = event['data'].rstrip('\n').split('\n')
+        return "\n".join(self.console_line({'pid': event['process_pid'],
+                                            'name': event['name'],
+                                            'line': line})
+                         for line in lines)
+
+    def console_msg(self, msg):
+        if msg.get('status') == "ok":
+            return "\n".join(self.console_line(line)
+                             for line in msg['lines'])
+        return self.console_error(msg)
+
+    def console_line(self, line):
+        return "%s %s | %s" % (line['pid'], line['name'], line['line'])
@@ -145,6 +145,20 @@ def get_config(config_file):
                                         DEFAULT_ENDPOINT_MULTICAST)
     config['stats_endpoint'] = dget('circus', 'stats_endpoint', None)
     config['statsd'] = dget('circus', 'statsd', False, bool)
+    config['stats_batch'] = dget('circus', 'stats_batch', None, str)
+    config['stats_encoding'] = dget('circus', 'stats_encoding', 'json', str)
+    config['stats_keyframe_interval'] = dget('circus',
+                                             'stats_keyframe_interval', 0, int)
+    config['stats_history_endpoint'] = dget('circus', 'stats_history_endpoint',
+                                            None)
+    config['stats_shm'] = dget('circus', 'stats_shm', None)
+    config['stats_inprocess'] = dget('circus', 'stats_inprocess', False, bool)
+    config['stats_process_tree'] = dget('circus', 'stats_process_tree', False,
+                                        bool)
+    config['stats_mem_accounting'] = dget('circus', 'stats_mem_accounting',
+                                          'rss', str)
+    config['stats_mem_interval'] = dget('circus', 'stats_mem_interval', 10.,
+                                        float)
     config['umask'] = dget('circus', 'umask', None)
     if config['umask']:
         config['umask'] = int(config['umask'], 8)
@@ -157,6 +171,17 @@ def get_config(config_file):
                       DeprecationWarning)
         config['statsd'] = True
 
+    config['log_shipper'] = dget('circus', 'log_shipper', False, bool)
+    config['log_shipper_endpoint'] = dget('circus', 'log_shipper_endpoint',
+                                          None, str)
+    config['log_shipper_max_mem'] = dget('circus', 'log_shipper_max_mem',
+                                         None, str)
+
+    config['output_endpoint'] = dget('circus', 'output_endpoint', None, str)
+    config['output_hwm'] = dget('circus', 'output_hwm', 1000, int)
+    config['fair_output'] = dget('circus', 'fair_output', False, bool)
+    config['output_quantum'] = dget('circus', 'output_quantum', 65536, int)
+
     config['warmup_delay'] = dget('circus', 'warmup_delay', 0, int)
     config['httpd'] = dget('circus', 'httpd', False, bool)
     config['httpd_host'] = dget('circus', 'httpd_host', 'localhost', str)
@@ -208,7 +233,8 @@ def get_config(config_file):
                 # default bool to False
                 elif opt in ('shell', 'send_hup', 'stop_children',
                              'close_child_stderr', 'use_sockets', 'singleton',
-                             'copy_env', 'copy_path', 'close_child_stdout'):
+                             'copy_env', 'copy_path', 'close_child_stdout',
+                             'publish_output', 'follow_output'):
                     watcher[opt] = dget(section, opt, False, bool)
                 elif opt == 'stop_signal':
                     watcher['stop_signal'] = to_signum(val)
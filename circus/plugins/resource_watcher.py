@@ -1,6 +1,7 @@
 import warnings
 from circus.plugins.statsd import BaseObserver
 from circus.util import human2bytes
+from circus.stats.memory import MemoryAccounting, check_mode
 from collections import defaultdict
 import six
 import signal
@@ -64,6 +65,14 @@ class ResourceWatcher(BaseObserver):
         if not self.per_process and self.action not in ['reload', 'restart']:
             raise NotImplementedError("You can't send a signal to a watcher.")
 
+        # Memory accounting: rss, or pss/uss read in /proc
+        mem_accounting = config.get("mem_accounting", 'rss').lower()
+        check_mode(mem_accounting)
+        self.memory = None
+        if mem_accounting != 'rss':
+            self.memory = MemoryAccounting(
+                mem_accounting, float(config.get("mem_interval", 10)))
+
         self._monitors = {}
 
     def look_after(self):
@@ -105,6 +114,15 @@ class ResourceWatcher(BaseObserver):
             else:
                 stats[item]['mem_abs'] = human2bytes(stats[item]['mem_info1'])
 
+        # Replace the RSS by the PSS or USS, which don't count the shared
+        # pages once per process
+        if self.memory is not None:
+            for item in stats:
+                value = self.memory.get_bytes(int(item))
+                if value is not None:
+                    stats[item]['mem_abs'] = value
+                    stats[item]['mem'] = self.memory.get_percent(value)
+
         # Compute watcher stats if not in per_process mode
         if not self.per_process:
             stats[self.watcher] = defaultdict(lambda: 'N/A')
@@ -155,6 +155,12 @@ class Process(object):
 
     - **pipe_stderr**: if True, will open a PIPE on stderr. default: True.
 
+    - **stdout_fd**: if given, a file descriptor used as the stdout of the
+      process instead of a PIPE. default: None.
+
+    - **stderr_fd**: if given, a file descriptor used as the stderr of the
+      process instead of a PIPE. default: None.
+
     - **close_child_stdout**: If True, redirects the child process' stdout
       to /dev/null after the fork. default: False.
 
@@ -165,7 +171,8 @@ class Process(object):
                  uid=None, gid=None, env=None, rlimits=None, executable=None,
                  use_fds=False, watcher=None, spawn=True,
                  pipe_stdout=True, pipe_stderr=True,
-                 close_child_stdout=False, close_child_stderr=False):
+                 close_child_stdout=False, close_child_stderr=False,
+                 stdout_fd=None, stderr_fd=None):
 
         self.wid = wid
         self.cmd = cmd
@@ -181,9 +188,13 @@ class Process(object):
         self.watcher = watcher
         self.pipe_stdout = pipe_stdout
         self.pipe_stderr = pipe_stderr
+        self.stdout_fd = stdout_fd
+        self.stderr_fd = stderr_fd
         self.close_child_stdout = close_child_stdout
         self.close_child_stderr = close_child_stderr
         self.stopping = False
+        # the recent output, recorded by the watcher
+        self.output_ring = None
         # sockets created before fork, should be let go after.
         self._sockets = []
 
@@ -271,10 +282,14 @@ class Process(object):
                 os.setuid(self.uid)
 
         extra = {}
-        if self.pipe_stdout:
+        if self.stdout_fd is not None:
+            extra['stdout'] = self.stdout_fd
+        elif self.pipe_stdout:
             extra['stdout'] = PIPE
 
-        if self.pipe_stderr:
+        if self.stderr_fd is not None:
+            extra['stderr'] = self.stderr_fd
+        elif self.pipe_stderr:
             extra['stderr'] = PIPE
 
         self._worker = Popen(args, cwd=self.working_dir,
@@ -13,6 +13,9 @@ import sys
 import argparse
 
 from circus.stats.streamer import StatsStreamer
+from circus.stats.publisher import BATCH_MODES
+from circus.stats.encoding import ENCODINGS
+from circus.stats.memory import MODES
 from circus.util import configure_logger
 from circus import logger
 from circus import util
@@ -35,6 +38,38 @@ def main():
                         help='The ZeroMQ pub/sub socket to send data to',
                         default=util.DEFAULT_ENDPOINT_STATS)
 
+    parser.add_argument('--batch', default=None, choices=BATCH_MODES,
+                        help='Publish the stats of each watcher, or of all '
+                             'the watchers, in a single message')
+
+    parser.add_argument('--encoding', default='json', choices=ENCODINGS,
+                        help='The encoding of the stats')
+
+    parser.add_argument('--keyframe-interval', type=int, default=0,
+                        help='Publish the full stats once every this number '
+                             'of cycles only, and their changes in between')
+
+    parser.add_argument('--history', default=None,
+                        help='The ZeroMQ socket answering the queries on the '
+                             'history of the stats (default: no history)')
+
+    parser.add_argument('--shm', default=None,
+                        help='The file, e.g. in /dev/shm, where the latest '
+                             'stats are written (default: no file)')
+
+    parser.add_argument('--process-tree', action='store_true',
+                        default=False,
+                        help='Include the descendants of the processes in '
+                             'the stats of the watchers')
+
+    parser.add_argument('--mem-accounting', default='rss', choices=MODES,
+                        help='The memory of the processes: their RSS, or '
+                             'their PSS or USS read in /proc')
+
+    parser.add_argument('--mem-interval', type=float, default=10.,
+                        help='The seconds between two reads of the PSS or '
+                             'USS of a process')
+
     parser.add_argument('--log-level', dest='loglevel', default='info',
                         help="log level")
 
@@ -57,7 +92,13 @@ def main():
     configure_logger(logger, args.loglevel, args.logoutput)
 
     stats = StatsStreamer(args.endpoint, args.pubsub, args.statspoint,
-                          args.ssh)
+                          args.ssh, batch=args.batch, encoding=args.encoding,
+                          keyframe_interval=args.keyframe_interval,
+                          history_endpoint=args.history,
+                          shm_path=args.shm,
+                          process_tree=args.process_tree,
+                          mem_accounting=args.mem_accounting,
+                          mem_interval=args.mem_interval)
     try:
         stats.start()
     finally:
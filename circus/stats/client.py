@@ -8,21 +8,60 @@ import time
 import logging
 
 import zmq
-import zmq.utils.jsonapi as json
 
 from circus.consumer import CircusConsumer
 from circus import __version__
 from circus.util import DEFAULT_ENDPOINT_STATS
 from circus.py3compat import s
+from circus.stats.encoding import decode
 
 
 class StatsClient(CircusConsumer):
     def __init__(self, endpoint=DEFAULT_ENDPOINT_STATS, ssh_server=None,
                  context=None):
-        CircusConsumer.__init__(self, ['stat.'], context, endpoint, ssh_server)
+        CircusConsumer.__init__(self, ['stat.', 'stats'], context, endpoint,
+                                ssh_server)
+        # the last full stats, by watcher and subtopic
+        self._state = defaultdict(dict)
+
+    def _rebuild(self, watcher, subtopic, stat):
+        """Returns the full stat, rebuilt from the previous one if *stat* is
+        a delta, or None if the previous one is unknown."""
+        state = self._state[watcher]
+        if 'delta' in stat:
+            if subtopic not in state:
+                # waiting for the next keyframe
+                return None
+            full = dict(state[subtopic])
+            for field in stat.pop('delta'):
+                full.pop(field, None)
+            full.update(stat)
+            stat = full
+        state[subtopic] = stat
+
+        if subtopic is None and isinstance(stat.get('pid'), list):
+            # forgetting the processes which are gone
+            pids = set(str(pid) for pid in stat['pid'])
+            for gone in [key for key in state
+                         if key is not None and key not in pids]:
+                del state[gone]
+        return stat
+
+    def _iter_batch(self, watcher, stats):
+        for stat in stats:
+            subtopic = stat.get('subtopic')
+            if subtopic is not None:
+                subtopic = str(subtopic)
+            stat = self._rebuild(watcher, subtopic, stat)
+            if stat is not None:
+                yield watcher, subtopic, stat
 
     def iter_messages(self):
-        """ Yields tuples of (watcher, subtopic, stat)"""
+        """ Yields tuples of (watcher, subtopic, stat)
+
+        The batches published by circusd-stats are split in the same
+        tuples, the stats are decoded whatever their encoding, and the
+        deltas are merged in the previous stats."""
         recv = self.pubsub_socket.recv_multipart
         with self:
             while True:
@@ -49,12 +88,26 @@ class StatsClient(CircusConsumer):
                         continue
 
                 topic = s(topic).split('.')
-                if len(topic) == 3:
+                if topic[0] == 'stats':
+                    stats = decode(stat)
+                    if len(topic) == 1:
+                        # all the watchers
+                        for watcher, batch in stats.items():
+                            for res in self._iter_batch(watcher, batch):
+                                yield res
+                    else:
+                        for res in self._iter_batch(topic[1], stats):
+                            yield res
+                elif len(topic) == 3:
                     __, watcher, subtopic = topic
-                    yield watcher, subtopic, json.loads(stat)
+                    stat = self._rebuild(watcher, subtopic, decode(stat))
+                    if stat is not None:
+                        yield watcher, subtopic, stat
                 elif len(topic) == 2:
                     __, watcher = topic
-                    yield watcher, None, json.loads(stat)
+                    stat = self._rebuild(watcher, None, decode(stat))
+                    if stat is not None:
+                        yield watcher, None, stat
 
 
 def _paint(stdscr, watchers=None, old_h=None, old_w=None):
@@ -104,31 +157,36 @@ def _paint(stdscr, watchers=None, old_h=None, old_w=None):
 
         if name == 'sockets':
             addstr(line, 3, 'ADDRESS')
-            addstr(line, 28, 'HITS')
+            addstr(line, 28, 'QUEUED')
 
             line += 1
 
             fds = []
 
-            total = 0
+            total = None
             for stats in watchers[name].values():
                 if 'addresses' in stats:
-                    total = stats['reads']
+                    total = stats
                     continue
 
-                reads = stats['reads']
+                queued = stats['queued']
                 address = stats['address']
-                fds.append((reads, address))
+                fds.append((queued, address))
 
             fds.sort()
             fds.reverse()
 
-            for reads, address in fds:
+            for queued, address in fds:
                 addstr(line, 2, str(address))
-                addstr(line, 29, '%3d' % reads)
+                addstr(line, 29, '%3d' % queued)
                 line += 1
 
-            addstr(line, 29, '%3d (sum)' % total)
+            if total is not None:
+                addstr(line, 29, '%3d (sum)' % total['queued'])
+                line += 1
+                addstr(line, 2, 'connections: %s, overflows: %s (host)'
+                       % (total['host_passive_opens'],
+                          total['host_listen_overflows']))
             line += 2
 
         else:
@@ -1,7 +1,7 @@
 import errno
-from collections import defaultdict
-from select import select
+from select import select, error as select_error
 import socket
+import struct
 
 from circus import util
 from circus import logger
@@ -16,12 +16,19 @@ class BaseStatsCollector(ioloop.PeriodicCallback):
         self.streamer = streamer
         self.name = name
 
+    def _publish(self, stats):
+        history = getattr(self.streamer, 'history', None)
+        if history is not None:
+            history.add_many(stats)
+        segment = getattr(self.streamer, 'segment', None)
+        if segment is not None:
+            segment.update(stats)
+        self.streamer.publisher.publish_many(stats)
+
     def _callback(self):
         logger.debug('Publishing stats about {0}'.format(self.name))
-        for stats in self.collect_stats():
-            if stats is None:
-                continue
-            self.streamer.publisher.publish(self.name, stats)
+        self._publish([(self.name, stats) for stats in self.collect_stats()
+                       if stats is not None])
 
     def collect_stats(self):
         # should be implemented in subclasses
@@ -58,125 +65,231 @@ class WatcherStatsCollector(BaseStatsCollector):
         else:
             res['age'] = max(ages)
 
+        res['suppressed'] = sum(stat.get('suppressed', 0) for stat in stats)
+
+        # the PSS add up, and the USS give what would be freed
+        for field in ('pss', 'uss'):
+            values = [stat[field] for stat in stats if field in stat]
+            if values:
+                res[field] = sum(values)
         return res
 
+    def _add_descendants(self, res, tree):
+        """Replaces the cpu and the memory of the aggregate *res* by the
+        ones of the process trees of its pids, read in *tree*."""
+        pids = res['pid']
+        if not pids:
+            return
+        memory = getattr(self.streamer, 'memory', None)
+        stats = tree.get_stats(pids, memory)
+        # still the average, of the trees of the processes
+        res['cpu'] = stats['cpu'] / len(pids)
+        if memory is not None:
+            res['mem'] = memory.get_percent(stats['mem'])
+            res[memory.mode] = stats['mem']
+        elif tree.total_mem:
+            res['mem'] = round(100. * stats['mem'] / tree.total_mem, 1)
+        res['processes'] = stats['processes']
+
+    def _get_info(self, name, pid):
+        """Returns the stats of *pid*, in the watcher *name*, or None if
+        the process is gone."""
+        circus_name = None
+        if name == 'circus':
+            circus_name = self.streamer.circus_pids.get(pid)
+
+        try:
+            info = util.get_info(pid)
+        except util.NoSuchProcess:
+            # the process is gone !
+            return None
+        except Exception as e:
+            logger.exception('Failed to get info for %d. %s' % (pid, str(e)))
+            return None
+
+        memory = getattr(self.streamer, 'memory', None)
+        if memory is not None:
+            values = memory.get(pid)
+            if values is not None:
+                info['pss'] = values['pss']
+                info['uss'] = values['uss']
+                info['mem'] = memory.get_percent(values[memory.mode])
+
+        info['subtopic'] = pid
+        info['name'] = circus_name
+        if pid in self.streamer.suppressed:
+            info['suppressed'] = self.streamer.suppressed[pid]
+        return info
+
     def collect_stats(self):
         aggregate = {}
 
         # sending by pids
         for pid in self.streamer.get_pids(self.name):
-            name = None
-
-            if self.name == 'circus':
-                if pid in self.streamer.circus_pids:
-                    name = self.streamer.circus_pids[pid]
-
-            try:
-                info = util.get_info(pid)
+            info = self._get_info(self.name, pid)
+            if info is not None:
                 aggregate[pid] = info
-                info['subtopic'] = pid
-                info['name'] = name
                 yield info
-            except util.NoSuchProcess:
-                # the process is gone !
-                pass
-            except Exception as e:
-                logger.exception('Failed to get info for %d. %s' % (pid,
-                                                                    str(e)))
 
         # now sending the aggregation
         yield self._aggregate(aggregate)
 
 
-# RESOLUTION is a value in seconds that will be used
-# to determine the poller timeout of the sockets stats collector
-#
-# The PeriodicCallback calls the poller every LOOP_RES ms, and block
-# for RESOLUTION seconds unless a read ready event occurs in the
-# socket.
-#
-# This timer is used to limit the number of polls done on the
-# socket, so the circusd-stats process don't eat all your CPU
-# when you have a high-loaded socket.
-#
-_RESOLUTION = .1
-_LOOP_RES = 10
-
-
-class SocketStatsCollector(BaseStatsCollector):
+class WatchersStatsCollector(WatcherStatsCollector):
+    """Collects the stats of all the watchers, and of circus, on a single
+    timer.
 
-    def __init__(self, streamer, name, callback_time=1., io_loop=None):
-        super(SocketStatsCollector, self).__init__(streamer, name,
-                                                   callback_time, io_loop)
-        self._rstats = defaultdict(int)
-        self.sockets = [sock for sock, address, fd in self.streamer.sockets]
-        self._p = ioloop.PeriodicCallback(self._select, _LOOP_RES,
-                                          io_loop=io_loop)
+    Every cycle takes the stats of all the processes first, then computes
+    the aggregates of the watchers, so their numbers come from the same
+    instant. The watchers without processes are skipped.
 
-    def start(self):
-        self._p.start()
-        super(SocketStatsCollector, self).start()
+    When the streamer has a *process_tree*, the aggregates of the watchers
+    include the descendants of their processes.
+    """
+    def __init__(self, streamer, name='watchers', callback_time=1.,
+                 io_loop=None):
+        super(WatchersStatsCollector, self).__init__(streamer, name,
+                                                     callback_time, io_loop)
 
-    def stop(self):
-        self._p.stop()
-        BaseStatsCollector.stop(self)
+    def _callback(self):
+        logger.debug('Publishing stats about all the watchers')
+        self._publish(list(self.collect_stats()))
 
-    def _select(self):
+    def collect_stats(self):
+        tree = getattr(self.streamer, 'process_tree', None)
+        if tree is not None and not tree.scan():
+            tree = None
+
+        snapshot = []
+        for name in list(self.streamer.get_watchers()) + ['circus']:
+            pids = self.streamer.get_pids(name)
+            if not pids:
+                continue
+            infos = [self._get_info(name, pid) for pid in pids]
+            snapshot.append((name, [info for info in infos
+                                    if info is not None]))
+
+        for name, infos in snapshot:
+            for info in infos:
+                yield name, info
+            res = self._aggregate(dict((info['subtopic'], info)
+                                       for info in infos))
+            # circusd is the parent of all the watchers
+            if tree is not None and name != 'circus':
+                self._add_descendants(res, tree)
+            yield name, res
+
+
+# the start of struct tcp_info: 8 bytes of flags, then tcpi_rto, tcpi_ato,
+# tcpi_snd_mss, tcpi_rcv_mss, tcpi_unacked and tcpi_sacked. For the
+# listening sockets, tcpi_unacked is the number of connections waiting to
+# be accepted, and tcpi_sacked the size of that queue.
+_TCP_INFO = struct.Struct('8B6I')
+_TCP_INFO_OPT = getattr(socket, 'TCP_INFO', None)
+
+
+def _read_counters(path, prefix):
+    """Returns the counters of the *prefix* lines of a /proc/net file, or
+    an empty mapping if it can't be read."""
+    try:
+        with open(path) as f:
+            lines = [line.split() for line in f if line.startswith(prefix)]
+    except IOError:
+        return {}
+    if len(lines) < 2:
+        return {}
+    return dict(zip(lines[0][1:], [int(value) for value in lines[1][1:]]))
+
+
+def get_tcp_counters():
+    """Returns the number of TCP connections opened to the host, and of the
+    ones dropped because the queue of their listening socket was full, or
+    None when the kernel doesn't tell."""
+    opens = _read_counters('/proc/net/snmp', 'Tcp:').get('PassiveOpens')
+    overflows = _read_counters('/proc/net/netstat',
+                               'TcpExt:').get('ListenOverflows')
+    if opens is None or overflows is None:
+        return None
+    return opens, overflows
+
+
+def get_queue(sock):
+    """Returns the number of connections waiting to be accepted on the
+    listening socket *sock*, and the size of its queue.
+
+    The size is None when TCP_INFO is not available, e.g. for the unix
+    sockets or out of Linux, and the number is then 1 if a connection is
+    waiting, 0 otherwise.
+    """
+    if _TCP_INFO_OPT is not None:
         try:
-            rlist, wlist, xlist = select(self.sockets, [], [], .01)
+            info = sock.getsockopt(socket.IPPROTO_TCP, _TCP_INFO_OPT,
+                                   _TCP_INFO.size)
         except socket.error as err:
-            if err.errno == errno.EBADF:
-                return
-            raise
+            if err.args[0] == errno.EBADF:
+                raise
+        else:
+            if len(info) == _TCP_INFO.size:
+                info = _TCP_INFO.unpack(info)
+                return info[12], info[13]
 
-        if len(rlist) == 0:
-            return
+    rlist = select([sock], [], [], 0)[0]
+    return len(rlist), None
 
-        for sock in rlist:
-            try:
-                fileno = sock.fileno()
-            except socket.error as err:
-                if err.errno == errno.EBADF:
-                    continue
-                else:
-                    raise
 
-            self._rstats[fileno] += 1
+class SocketStatsCollector(BaseStatsCollector):
+    """Collects the stats of the sockets, once per cycle.
+
+    Each socket gets *queued*, the connections waiting to be accepted, and
+    *backlog*, the size of its queue, when the kernel tells.
+
+    The total gets the sum of *queued*, and from the counters of the kernel
+    since the previous cycle: *host_passive_opens*, the TCP connections
+    opened, and *host_listen_overflows*, the ones dropped because a queue
+    was full. These counters are for all the listening sockets of the host
+    (or of its network namespace), and are 'N/A' when they can't be read
+    from /proc/net.
+    """
+    def __init__(self, streamer, name, callback_time=1., io_loop=None):
+        super(SocketStatsCollector, self).__init__(streamer, name,
+                                                   callback_time, io_loop)
+        self._counters = get_tcp_counters()
+
+    def _get_deltas(self):
+        counters = get_tcp_counters()
+        previous, self._counters = self._counters, counters
+        if counters is None or previous is None:
+            return 'N/A', 'N/A'
+        return counters[0] - previous[0], counters[1] - previous[1]
 
     def _aggregate(self, aggregate):
         raise NotImplementedError()
 
     def collect_stats(self):
-        # sending hits by sockets
+        # sending the queues of the sockets
         sockets = self.streamer.sockets
 
         if len(sockets) == 0:
             yield None
         else:
-            fds = []
+            total = {'addresses': [], 'queued': 0}
+            (total['host_passive_opens'],
+             total['host_listen_overflows']) = self._get_deltas()
 
             for sock, address, fd in sockets:
                 try:
-                    fileno = sock.fileno()
-                except socket.error as err:
-                    if err.errno == errno.EBADF:
+                    queued, backlog = get_queue(sock)
+                except (socket.error, select_error) as err:
+                    if err.args[0] == errno.EBADF:
                         continue
-                    else:
-                        raise
-
-                fds.append((address, fileno, fd))
-
-            total = {'addresses': [], 'reads': 0}
+                    raise
 
-            # we might lose a few hits here but it's ok
-            for address, monitored_fd, fd in fds:
-                info = {}
-                info['fd'] = info['subtopic'] = fd
-                info['reads'] = self._rstats[monitored_fd]
-                total['reads'] += info['reads']
+                info = {'fd': fd, 'subtopic': fd, 'address': address,
+                        'queued': queued}
+                if backlog is not None:
+                    info['backlog'] = backlog
+                total['queued'] += queued
                 total['addresses'].append(address)
-                info['address'] = address
-                self._rstats[monitored_fd] = 0
                 yield info
 
             yield total
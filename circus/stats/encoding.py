@@ -0,0 +1,93 @@
+"""Encodings of the messages published by circusd-stats.
+
+*json* is the default. *msgpack* needs the msgpack package: the message
+starts with a null byte and the version of the schema, followed by the
+msgpack data, where the known keys of the stats are replaced by their
+index in the table of the version.
+
+Since JSON messages never start with a null byte, the subscribers decode
+both without being told which one is used.
+"""
+import struct
+
+import zmq.utils.jsonapi as json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+ENCODINGS = ('json', 'msgpack')
+
+VERSION = 1
+
+_MARKER = b'\x00'
+_HEADER = struct.Struct('!cB')
+
+# the keys of the stats in version 1, replaced by their index. New keys
+# must be added at the end, and old ones never removed: 'reads' is not
+# published anymore but keeps its index.
+_KEYS = ('pid', 'subtopic', 'name', 'cpu', 'mem', 'mem_info1', 'mem_info2',
+         'ctime', 'username', 'nice', 'cmdline', 'create_time', 'age',
+         'children', 'suppressed', 'fd', 'address', 'addresses', 'reads',
+         'queued', 'backlog', 'host_passive_opens', 'host_listen_overflows',
+         'rss', 'pss', 'uss', 'processes', 'delta')
+_INDEXES = dict((key, index) for index, key in enumerate(_KEYS))
+
+_UNPACK_OPTIONS = {'raw': False}
+if msgpack is not None and msgpack.version >= (0, 6, 1):
+    # msgpack 1.0 refuses the integer map keys by default
+    _UNPACK_OPTIONS['strict_map_key'] = False
+
+
+def _compact(data):
+    if isinstance(data, dict):
+        return dict((_INDEXES.get(key, key), _compact(value))
+                    for key, value in data.items())
+    if isinstance(data, list):
+        return [_compact(value) for value in data]
+    return data
+
+
+def _expand_key(key):
+    # the indexes added by a newer publisher are kept as they are
+    if isinstance(key, int) and 0 <= key < len(_KEYS):
+        return _KEYS[key]
+    return key
+
+
+def _expand(data):
+    if isinstance(data, dict):
+        return dict((_expand_key(key), _expand(value))
+                    for key, value in data.items())
+    if isinstance(data, list):
+        return [_expand(value) for value in data]
+    return data
+
+
+def check_encoding(encoding):
+    if encoding not in ENCODINGS:
+        raise ValueError('Unknown encoding %r' % encoding)
+    if encoding == 'msgpack' and msgpack is None:
+        raise ValueError('The msgpack encoding needs the msgpack package')
+
+
+def encode(data, encoding='json'):
+    """Encodes the stats in *data*."""
+    if encoding == 'json':
+        return json.dumps(data)
+    return (_HEADER.pack(_MARKER, VERSION) +
+            msgpack.packb(_compact(data), use_bin_type=True))
+
+
+def decode(message):
+    """Decodes a message in any of the encodings."""
+    if message[:1] != _MARKER:
+        return json.loads(message)
+    if msgpack is None:
+        raise ValueError('The msgpack encoding needs the msgpack package')
+    version = _HEADER.unpack(message[:_HEADER.size])[1]
+    if version != VERSION:
+        raise ValueError('Unknown version %d of the stats' % version)
+    return _expand(msgpack.unpackb(message[_HEADER.size:], **_UNPACK_OPTIONS))
@@ -0,0 +1,155 @@
+"""History of the stats, kept in memory by circusd-stats.
+
+Each watcher, and each of its processes, gets a series of rings: arrays of
+fixed size where every slot holds the average of the samples taken during
+**step** seconds. The rings are filled at the same time, so the default
+tiers keep 10 minutes of stats at 1 second, and 24 hours at 10 seconds.
+"""
+from array import array
+import numbers
+import time
+
+
+DEFAULT_FIELDS = ('cpu', 'mem', 'queued')
+
+# (step in seconds, number of slots)
+DEFAULT_TIERS = ((1, 600), (10, 8640))
+
+_NAN = float('nan')
+_MAX_COUNT = 65535
+
+
+class Ring(object):
+    """The samples of **fields** of the last **step** * **size** seconds,
+    averaged by slots of **step** seconds."""
+
+    def __init__(self, step, size, fields=DEFAULT_FIELDS):
+        self.step = step
+        self.size = size
+        # the start of the slots, 0 for the slots never filled
+        self.stamps = array('d', [0.]) * size
+        self.counts = array('H', [0]) * size
+        self.values = dict((field, array('f', [_NAN]) * size)
+                           for field in fields)
+
+    def add(self, stat, when):
+        slot = int(when // self.step)
+        index = slot % self.size
+        stamp = float(slot * self.step)
+        if self.stamps[index] != stamp:
+            # starting a new slot, over the oldest one
+            self.stamps[index] = stamp
+            self.counts[index] = 0
+            for values in self.values.values():
+                values[index] = _NAN
+
+        count = self.counts[index]
+        for field, values in self.values.items():
+            value = stat.get(field)
+            if isinstance(value, bool) or \
+                    not isinstance(value, numbers.Number):
+                # 'N/A' or missing
+                continue
+            previous = values[index]
+            if previous != previous:
+                values[index] = value
+            else:
+                values[index] = (previous * count + value) / (count + 1)
+        self.counts[index] = min(count + 1, _MAX_COUNT)
+
+    def covers(self, start, now):
+        return start >= now - self.step * self.size
+
+    def get_range(self, start, end, fields):
+        """Returns the times of the slots between *start* and *end*, and
+        the values of *fields* in these slots."""
+        last = min(int(end // self.step), int(max(self.stamps) // self.step))
+        first = max(int(start // self.step), last - self.size + 1)
+        res = dict((field, []) for field in fields)
+        res['times'] = times = []
+        for slot in range(first, last + 1):
+            index = slot % self.size
+            if self.stamps[index] != slot * self.step:
+                continue
+            times.append(self.stamps[index])
+            for field in fields:
+                value = self.values[field][index]
+                res[field].append(None if value != value else value)
+        res['step'] = self.step
+        return res
+
+
+class StatsHistory(object):
+    """Keeps the history of the stats of the watchers and their processes.
+
+    The processes only get the first **pid_tiers** tiers, as there are many
+    more of them than watchers.
+    """
+    def __init__(self, fields=DEFAULT_FIELDS, tiers=DEFAULT_TIERS,
+                 pid_tiers=1):
+        self.fields = tuple(fields)
+        self.tiers = tuple(tiers)
+        self.pid_tiers = pid_tiers
+        self._series = {}
+
+    def _get_rings(self, name, subtopic):
+        key = name, subtopic
+        rings = self._series.get(key)
+        if rings is None:
+            tiers = self.tiers if subtopic is None else \
+                self.tiers[:self.pid_tiers]
+            rings = [Ring(step, size, self.fields) for step, size in tiers]
+            self._series[key] = rings
+        return rings
+
+    def add_many(self, stats, when=None):
+        """Adds the *(name, stat)* pairs of a collection cycle."""
+        if when is None:
+            when = time.time()
+        for name, stat in stats:
+            for ring in self._get_rings(name, stat.get('subtopic')):
+                ring.add(stat, when)
+
+    def forget(self, name, subtopic=None):
+        """Drops the history of the process *subtopic* of *name*, or of all
+        the processes and of the watcher itself if *subtopic* is None."""
+        if subtopic is not None:
+            self._series.pop((name, subtopic), None)
+            return
+        for key in list(self._series):
+            if key[0] == name:
+                del self._series[key]
+
+    def query(self, name, subtopic=None, start=None, end=None, step=None,
+              fields=None):
+        """Returns the history of *name*, or of its process *subtopic*,
+        between *start* and *end* (by default the last minute).
+
+        The values come from the finest tier with a step of at least *step*
+        which covers *start*, or from the coarsest one."""
+        now = time.time()
+        if end is None:
+            end = now
+        if start is None:
+            start = end - 60
+        if subtopic is not None:
+            subtopic = int(subtopic)
+        if fields is None:
+            fields = self.fields
+        for field in fields:
+            if field not in self.fields:
+                raise ValueError('Unknown field %r' % field)
+
+        rings = self._series.get((name, subtopic))
+        if rings is None:
+            raise KeyError('No history for %s' % name if subtopic is None
+                           else 'No history for %s %s' % (name, subtopic))
+
+        ring = rings[-1]
+        for candidate in rings:
+            if step is not None and candidate.step < step:
+                continue
+            if candidate.covers(start, now):
+                ring = candidate
+                break
+        return ring.get_range(float(start), float(end), fields)
@@ -0,0 +1,116 @@
+"""Memory accounting of the processes, from /proc/<pid>/smaps_rollup.
+
+The RSS of a process counts all its resident pages, so the RSS of forked
+workers counts the pages they share once per worker. The kernel also
+tells, for each process:
+
+- *pss*: the proportional set size, where each shared page is divided
+  between the processes sharing it. The PSS of processes add up.
+- *uss*: the unique set size, the pages private to the process, which
+  would be freed if it stopped.
+
+Reading them walks all the mappings of the process, so
+:class:`MemoryAccounting` keeps them for **interval** seconds. On kernels
+older than 4.14, /proc/<pid>/smaps is read instead, which is slower.
+"""
+import os
+import time
+
+
+MODES = ('rss', 'pss', 'uss')
+
+# the lines of smaps_rollup summed for each value
+_FIELDS = {'Rss:': 'rss', 'Pss:': 'pss',
+           'Private_Clean:': 'uss', 'Private_Dirty:': 'uss'}
+
+
+def get_total_mem(proc='/proc'):
+    """Returns the physical memory of the host in bytes, or None."""
+    try:
+        with open(os.path.join(proc, 'meminfo')) as f:
+            for line in f:
+                if line.startswith('MemTotal:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+
+def read_smaps(pid, proc='/proc'):
+    """Returns the *rss*, *pss* and *uss* of *pid* in bytes.
+
+    Raises an IOError or an OSError if the process is gone, or can't be
+    read."""
+    path = os.path.join(proc, str(pid), 'smaps_rollup')
+    if not os.path.exists(path):
+        path = os.path.join(proc, str(pid), 'smaps')
+
+    res = dict((value, 0) for value in MODES)
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 3 and fields[0] in _FIELDS:
+                res[_FIELDS[fields[0]]] += int(fields[1]) * 1024
+    return res
+
+
+def check_mode(mode):
+    if mode not in MODES:
+        raise ValueError('Unknown memory accounting %r' % mode)
+
+
+class MemoryAccounting(object):
+    """Reads the memory of the processes in the **mode** accounting: one
+    of *rss*, *pss* or *uss*.
+
+    The values of each process are read at most once every **interval**
+    seconds."""
+
+    def __init__(self, mode='pss', interval=10., proc='/proc'):
+        check_mode(mode)
+        self.mode = mode
+        self.interval = interval
+        self.proc = proc
+        self.total_mem = get_total_mem(proc)
+        # (time of the read, values), by pid
+        self._cache = {}
+        self._last_sweep = time.time()
+
+    def _sweep(self, now):
+        # drops the processes which were not asked for a while
+        for pid, (when, values) in list(self._cache.items()):
+            if now - when > 2 * self.interval:
+                del self._cache[pid]
+        self._last_sweep = now
+
+    def get(self, pid):
+        """Returns the *rss*, *pss* and *uss* of *pid* in bytes, or None if
+        they can't be read."""
+        now = time.time()
+        if now - self._last_sweep > self.interval:
+            self._sweep(now)
+
+        cached = self._cache.get(pid)
+        if cached is not None and now - cached[0] < self.interval:
+            return cached[1]
+        try:
+            values = read_smaps(pid, self.proc)
+        except (IOError, OSError, ValueError):
+            self._cache.pop(pid, None)
+            return None
+        self._cache[pid] = now, values
+        return values
+
+    def get_bytes(self, pid):
+        """Returns the memory of *pid* in the accounting mode, or None."""
+        values = self.get(pid)
+        if values is None:
+            return None
+        return values[self.mode]
+
+    def get_percent(self, value):
+        """Returns *value* in bytes as a percentage of the memory of the
+        host, or 'N/A'."""
+        if value is None or not self.total_mem:
+            return 'N/A'
+        return round(100. * value / self.total_mem, 1)
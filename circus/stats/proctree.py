@@ -0,0 +1,144 @@
+"""Process trees of the watchers, from a single scan of /proc.
+
+The workers of some watchers fork their own children (uwsgi, gunicorn,
+shell wrappers), which circusd doesn't know about. At every cycle,
+:class:`ProcessTree` reads the parent and the cpu time of all the processes
+in /proc/<pid>/stat, so the stats of a watcher can include all the
+descendants of its processes without asking psutil about each of them.
+
+The memory of a tree is the resident memory of its processes, where the
+shared pages (files, libraries, shared memory) are counted once, for the
+process with the most of them, as the forked processes share most of them.
+It's an estimate: the shared pages of two processes may differ. With a
+:class:`circus.stats.memory.MemoryAccounting`, the memory of the tree is
+the sum of the PSS (or USS) of its processes instead.
+"""
+from collections import defaultdict
+import os
+import time
+
+from circus import logger
+from circus.stats.memory import get_total_mem
+
+
+def _sysconf(name, default):
+    try:
+        return os.sysconf(name)
+    except (AttributeError, ValueError, OSError):
+        return default
+
+
+_CLK_TCK = _sysconf('SC_CLK_TCK', 100)
+_PAGE_SIZE = _sysconf('SC_PAGE_SIZE', 4096)
+
+
+class ProcessTree(object):
+    """Reads the processes of the host in **proc**, and aggregates the
+    stats of process trees."""
+
+    def __init__(self, proc='/proc'):
+        self.proc = proc
+        # the children, by pid
+        self._children = {}
+        # the cpu time in ticks and the cpu percentage, by pid
+        self._ticks = {}
+        self._cpu = {}
+        self._last = None
+        self._failed = False
+        self.total_mem = get_total_mem(proc)
+
+    def _read_stat(self, pid):
+        with open(os.path.join(self.proc, pid, 'stat'), 'rb') as f:
+            data = f.read()
+        # the command is between parentheses and may hold anything, the
+        # fields after it are the state, the ppid, ..., utime and stime
+        fields = data[data.rindex(b')') + 2:].split()
+        return int(fields[1]), int(fields[11]) + int(fields[12])
+
+    def _read_statm(self, pid):
+        with open(os.path.join(self.proc, str(pid), 'statm'), 'rb') as f:
+            fields = f.read().split()
+        # the resident and the shared pages
+        return int(fields[1]), int(fields[2])
+
+    def scan(self):
+        """Reads all the processes. Returns False if /proc can't be read."""
+        now = time.time()
+        try:
+            names = os.listdir(self.proc)
+        except OSError as e:
+            if not self._failed:
+                logger.warning('Unable to read the process trees in %s: %s',
+                               self.proc, e)
+                self._failed = True
+            return False
+
+        children = defaultdict(list)
+        ticks = {}
+        for name in names:
+            if not name.isdigit():
+                continue
+            try:
+                ppid, used = self._read_stat(name)
+            except (IOError, OSError, ValueError, IndexError):
+                # the process is gone
+                continue
+            pid = int(name)
+            children[ppid].append(pid)
+            ticks[pid] = used
+
+        cpu = {}
+        if self._last is not None and now > self._last:
+            elapsed = now - self._last
+            for pid, used in ticks.items():
+                previous = self._ticks.get(pid)
+                if previous is not None:
+                    cpu[pid] = 100. * (used - previous) / _CLK_TCK / elapsed
+
+        self._children = children
+        self._ticks = ticks
+        self._cpu = cpu
+        self._last = now
+        return True
+
+    def get_descendants(self, pid):
+        """Returns the pids of all the descendants of *pid*."""
+        res = []
+        stack = list(self._children.get(pid, ()))
+        while stack:
+            child = stack.pop()
+            res.append(child)
+            stack.extend(self._children.get(child, ()))
+        return res
+
+    def get_stats(self, pids, memory=None):
+        """Returns the cpu percentage, the memory in bytes and the number of
+        the processes of *pids* and of all their descendants, each process
+        counted once.
+
+        The memory is read with the :class:`MemoryAccounting` *memory* when
+        given."""
+        members = set()
+        for pid in pids:
+            if pid in self._ticks:
+                members.add(pid)
+                members.update(self.get_descendants(pid))
+
+        cpu = sum(self._cpu.get(pid, 0.) for pid in members)
+        if memory is not None:
+            values = [memory.get_bytes(pid) for pid in members]
+            return {'cpu': cpu,
+                    'mem': sum(value for value in values if value is not None),
+                    'processes': len(members)}
+
+        private = shared = 0
+        for pid in members:
+            try:
+                resident, shared_pages = self._read_statm(pid)
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            private += resident - shared_pages
+            shared = max(shared, shared_pages)
+
+        return {'cpu': cpu, 'mem': (private + shared) * _PAGE_SIZE,
+                'processes': len(members)}
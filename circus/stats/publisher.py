@@ -1,35 +1,126 @@
 import zmq
-import zmq.utils.jsonapi as json
 from circus.py3compat import b
 
 from circus import logger
+from circus.stats.encoding import encode, check_encoding
+
+
+BATCH_MODES = ('watcher', 'cycle')
 
 
 class StatsPublisher(object):
-    def __init__(self, stats_endpoint='tcp://127.0.0.1:5557', context=None):
+    """Publishes the stats on a zmq PUB socket.
+
+    By default, each stat is sent in its own message, on the
+    *stat.<name>[.<subtopic>]* topic.
+
+    With **batch**, the stats of a collection cycle are sent together,
+    as a list where each stat keeps its *subtopic*:
+
+    - *watcher*: one message per watcher, on the *stats.<name>* topic.
+    - *cycle*: one message with all the watchers, on the *stats* topic, as a
+      mapping of the name of each watcher to its list.
+
+    The *stats* topics don't match the subscriptions to *stat.*, so the
+    subscribers expecting a stat per message don't get the batches.
+
+    **encoding** is one of the encodings of :mod:`circus.stats.encoding`.
+
+    With **keyframe_interval**, the stats of each watcher are sent in full
+    once every *keyframe_interval* cycles only. In between, only the fields
+    which changed since the last cycle are sent, with a *delta* key listing
+    the fields removed. The *subtopic* is always sent.
+    """
+    def __init__(self, stats_endpoint='tcp://127.0.0.1:5557', context=None,
+                 batch=None, encoding='json', keyframe_interval=0):
+        if batch is not None and batch not in BATCH_MODES:
+            raise ValueError('Unknown batch mode %r' % batch)
+        check_encoding(encoding)
+        self.encoding = encoding
         self.ctx = context or zmq.Context()
         self.destroy_context = context is None
         self.stats_endpoint = stats_endpoint
+        self.batch = batch
+        self.keyframe_interval = keyframe_interval
+        # the last stats sent and the number of cycles, by watcher
+        self._sent = {}
+        self._cycles = {}
         self.socket = self.ctx.socket(zmq.PUB)
         self.socket.bind(self.stats_endpoint)
         self.socket.linger = 0
 
-    def publish(self, name, stat):
+    def _send(self, topic, data):
         try:
-            topic = 'stat.%s' % str(name)
-            if 'subtopic' in stat:
-                topic += '.%d' % stat['subtopic']
-
-            stat = json.dumps(stat)
-            logger.debug('Sending %s' % stat)
-            self.socket.send_multipart([b(topic), stat])
-
+            self.socket.send_multipart([b(topic),
+                                        encode(data, self.encoding)])
         except zmq.ZMQError:
             if self.socket.closed:
                 pass
             else:
                 raise
 
+    def publish(self, name, stat):
+        topic = 'stat.%s' % str(name)
+        if 'subtopic' in stat:
+            topic += '.%d' % stat['subtopic']
+        logger.debug('Sending %s', stat)
+        self._send(topic, stat)
+
+    def _deltas(self, name, stats):
+        """Returns *stats*, where the ones sent in the previous cycle are
+        replaced by their changes, unless it's time for a keyframe."""
+        previous = self._sent.get(name)
+        cycle = self._cycles.get(name, 0)
+        self._cycles[name] = cycle + 1
+        if cycle % self.keyframe_interval == 0:
+            previous = None
+
+        res = []
+        sent = {}
+        for stat in stats:
+            key = stat.get('subtopic')
+            sent[key] = stat
+            old = previous and previous.get(key)
+            if old is None:
+                res.append(stat)
+                continue
+            delta = dict((field, value) for field, value in stat.items()
+                         if field not in old or old[field] != value)
+            delta['delta'] = [field for field in old if field not in stat]
+            if key is not None:
+                delta['subtopic'] = key
+            res.append(delta)
+
+        self._sent[name] = sent
+        return res
+
+    def publish_many(self, stats):
+        """Publishes the *(name, stat)* pairs of a collection cycle."""
+        batches = {}
+        names = []
+        for name, stat in stats:
+            name = str(name)
+            if name not in batches:
+                batches[name] = []
+                names.append(name)
+            batches[name].append(stat)
+
+        if self.keyframe_interval:
+            for name in names:
+                batches[name] = self._deltas(name, batches[name])
+
+        if self.batch is None:
+            for name in names:
+                for stat in batches[name]:
+                    self.publish(name, stat)
+        elif self.batch == 'cycle':
+            if batches:
+                self._send('stats', batches)
+        else:
+            for name in names:
+                self._send('stats.%s' % name, batches[name])
+        logger.debug('Sent the stats of %d watchers', len(names))
+
     def stop(self):
         if self.destroy_context:
             self.ctx.destroy(0)
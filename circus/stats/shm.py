@@ -0,0 +1,178 @@
+"""Latest stats in a memory-mapped file, e.g. in /dev/shm.
+
+circusd-stats rewrites the whole segment at every cycle, and local
+consumers read it without zmq or decoding, as often as they want.
+
+The segment is made of a header followed by fixed-size records, all little
+endian:
+
+- header: magic (8 bytes), version (uint32), capacity in records (uint32),
+  sequence (uint64), number of records (uint32), time of the last update
+  (double).
+- record: name of the watcher (64 bytes, utf-8, padded with null bytes),
+  subtopic (int64: the pid, or the fd for the sockets, 0 for the
+  aggregate), cpu, mem, age (doubles, NaN when unknown), suppressed and
+  queued (uint64).
+
+The sequence is a seqlock: it is odd while the segment is written, so a
+reader retries when it reads an odd sequence, or when the sequence changed
+during its read.
+"""
+import mmap
+import numbers
+import os
+import struct
+import time
+
+from circus import logger
+from circus.py3compat import b
+
+
+MAGIC = b'CIRCSHM\x00'
+VERSION = 1
+
+_HEADER = struct.Struct('<8sIIQId')
+_SEQ = struct.Struct('<Q')
+_SEQ_OFFSET = 16
+# the number of records and the time
+_STATE = struct.Struct('<Id')
+_STATE_OFFSET = _SEQ_OFFSET + _SEQ.size
+_RECORD = struct.Struct('<64sqdddQQ')
+_NAN = float('nan')
+
+
+def _is_number(value):
+    return not isinstance(value, bool) and isinstance(value, numbers.Number)
+
+
+def _number(value):
+    return float(value) if _is_number(value) else _NAN
+
+
+def _count(value):
+    return int(value) if _is_number(value) else 0
+
+
+class StatsSegment(object):
+    """Writes the latest stats of the watchers in the file **path**, with
+    room for **capacity** records."""
+
+    def __init__(self, path, capacity=4096):
+        self.path = path
+        self.capacity = capacity
+        self.size = _HEADER.size + _RECORD.size * capacity
+        # the packed records, by watcher
+        self._records = {}
+        self._seq = 0
+        self._truncated = False
+
+        with open(path, 'w+b') as f:
+            f.truncate(self.size)
+            self._mmap = mmap.mmap(f.fileno(), self.size)
+        self._mmap[:_HEADER.size] = _HEADER.pack(
+            MAGIC, VERSION, self.capacity, self._seq, 0, 0.)
+
+    def _write_seq(self):
+        self._mmap[_SEQ_OFFSET:_SEQ_OFFSET + _SEQ.size] = _SEQ.pack(self._seq)
+
+    def _pack(self, name, stat):
+        # not cut in the middle of a character
+        name = b(name)[:64].decode('utf-8', 'ignore').encode('utf-8')
+        return _RECORD.pack(name, _count(stat.get('subtopic')),
+                            _number(stat.get('cpu')),
+                            _number(stat.get('mem')),
+                            _number(stat.get('age')),
+                            _count(stat.get('suppressed')),
+                            _count(stat.get('queued')))
+
+    def update(self, stats):
+        """Replaces the records of the watchers in the *(name, stat)* pairs
+        of a collection cycle, and rewrites the segment."""
+        records = {}
+        for name, stat in stats:
+            records.setdefault(name, []).append(self._pack(name, stat))
+        self._records.update(records)
+        self._write()
+
+    def forget(self, name):
+        """Removes the records of the watcher *name*."""
+        if self._records.pop(name, None) is not None:
+            self._write()
+
+    def _write(self):
+        data = b''.join(b''.join(records)
+                        for records in self._records.values())
+        count = len(data) // _RECORD.size
+        if count > self.capacity:
+            if not self._truncated:
+                logger.warning('The stats segment %s is full, %d records '
+                               'dropped', self.path, count - self.capacity)
+                self._truncated = True
+            count = self.capacity
+            data = data[:count * _RECORD.size]
+
+        # odd while writing
+        self._seq += 1
+        self._write_seq()
+        self._mmap[_HEADER.size:_HEADER.size + len(data)] = data
+        self._mmap[_STATE_OFFSET:_STATE_OFFSET + _STATE.size] = _STATE.pack(
+            count, time.time())
+        self._seq += 1
+        self._write_seq()
+
+    def close(self):
+        self._mmap.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class StatsSegmentReader(object):
+    """Reads the stats written by a :class:`StatsSegment` in **path**."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version = _HEADER.unpack(self._mmap[:_HEADER.size])[:2]
+        if magic != MAGIC:
+            raise ValueError('%s is not a stats segment' % path)
+        if version != VERSION:
+            raise ValueError('Unknown version %d of the stats segment'
+                             % version)
+
+    def _read_seq(self):
+        return _SEQ.unpack(self._mmap[_SEQ_OFFSET:_SEQ_OFFSET + _SEQ.size])[0]
+
+    def read(self, retries=1000):
+        """Returns the time of the last update, and the list of the
+        records as mappings.
+
+        Raises a RuntimeError if the segment is written during *retries*
+        reads."""
+        for _ in range(retries):
+            seq = self._read_seq()
+            if seq % 2:
+                continue
+            count, when = _STATE.unpack(
+                self._mmap[_STATE_OFFSET:_STATE_OFFSET + _STATE.size])
+            data = self._mmap[_HEADER.size:_HEADER.size +
+                              count * _RECORD.size]
+            if self._read_seq() == seq:
+                break
+        else:
+            raise RuntimeError('The stats segment keeps changing')
+
+        records = []
+        for offset in range(0, len(data), _RECORD.size):
+            name, subtopic, cpu, mem, age, suppressed, queued = \
+                _RECORD.unpack_from(data, offset)
+            records.append({'name': name.rstrip(b'\x00').decode('utf-8'),
+                            'subtopic': subtopic or None, 'cpu': cpu,
+                            'mem': mem, 'age': age,
+                            'suppressed': suppressed, 'queued': queued})
+        return when, records
+
+    def close(self):
+        self._mmap.close()
@@ -10,15 +10,38 @@ from zmq.eventloop import ioloop, zmqstream
 
 from circus.commands import get_commands
 from circus.client import CircusClient
-from circus.stats.collector import WatcherStatsCollector, SocketStatsCollector
+from circus.stats.collector import (WatchersStatsCollector,
+                                    SocketStatsCollector)
 from circus.stats.publisher import StatsPublisher
+from circus.stats.history import StatsHistory
+from circus.stats.shm import StatsSegment
+from circus.stats.proctree import ProcessTree
+from circus.stats.memory import MemoryAccounting, check_mode
+from circus.commands.base import ok, error
+from circus.commands import errors
 from circus import logger
+from circus.fixed_threading import Thread
 from circus.py3compat import s
 
 
+# the processes of circus, collected as the 'circus' watcher
+_CIRCUS_WATCHERS = ('circusd', 'circushttpd', 'circusd-stats',
+                    'circusd-logger')
+# the watchers of circus whose single process is found with 'list'
+_CIRCUS_SINGLETONS = ('circushttpd', 'circusd-logger')
+
+
 class StatsStreamer(object):
+    history = None
+    segment = None
+    process_tree = None
+    memory = None
+
     def __init__(self, endpoint, pubsub_endoint, stats_endpoint,
-                 ssh_server=None, delay=1., loop=None):
+                 ssh_server=None, delay=1., loop=None, batch=None,
+                 encoding='json', keyframe_interval=0, history_endpoint=None,
+                 shm_path=None, process_tree=False, mem_accounting='rss',
+                 mem_interval=10.):
         self.topic = b'watcher.'
         self.delay = delay
         self.ctx = zmq.Context()
@@ -32,15 +55,42 @@ class StatsStreamer(object):
         self.client = CircusClient(context=self.ctx, endpoint=endpoint,
                                    ssh_server=ssh_server)
         self.cmds = get_commands()
-        self.publisher = StatsPublisher(stats_endpoint, self.ctx)
+        self._init_outputs(stats_endpoint, batch, encoding, keyframe_interval,
+                           history_endpoint, shm_path)
+        self._init_collect(process_tree, mem_accounting, mem_interval)
         self._initialize()
 
+    def _init_collect(self, process_tree, mem_accounting, mem_interval):
+        check_mode(mem_accounting)
+        if process_tree:
+            self.process_tree = ProcessTree()
+        if mem_accounting != 'rss':
+            self.memory = MemoryAccounting(mem_accounting, mem_interval)
+
+    def _init_outputs(self, stats_endpoint, batch, encoding,
+                      keyframe_interval, history_endpoint, shm_path):
+        self.publisher = StatsPublisher(stats_endpoint, self.ctx,
+                                        batch=batch, encoding=encoding,
+                                        keyframe_interval=keyframe_interval)
+        if history_endpoint is not None:
+            self.history = StatsHistory()
+            self.history_socket = self.ctx.socket(zmq.ROUTER)
+            self.history_socket.linger = 0
+            self.history_socket.bind(history_endpoint)
+            self.history_stream = zmqstream.ZMQStream(self.history_socket,
+                                                      self.loop)
+            self.history_stream.on_recv(self.handle_history)
+        if shm_path is not None:
+            self.segment = StatsSegment(shm_path)
+
     def _initialize(self):
         self._pids = defaultdict(list)
         self._callbacks = dict()
         self.running = False  # should the streamer be running?
         self.stopped = False  # did the collect started yet?
         self.circus_pids = {}
+        # the bytes of output dropped by the rate limits, by pid
+        self.suppressed = defaultdict(int)
         self.sockets = []
         self.get_watchers = self._pids.keys
 
@@ -54,28 +104,31 @@ class StatsStreamer(object):
     def get_circus_pids(self):
         watchers = self.client.send_message('list').get('watchers', [])
 
-        # getting the circusd, circusd-stats and circushttpd pids
+        # getting the circusd, circusd-stats, circushttpd and
+        # circusd-logger pids
         res = self.client.send_message('dstats')
         pids = {os.getpid(): 'circusd-stats'}
 
         if 'info' in res:
             pids[res['info']['pid']] = 'circusd'
 
-        if 'circushttpd' in watchers:
-            httpd_pids = self.client.send_message('list', name='circushttpd')
+        for name in _CIRCUS_SINGLETONS:
+            if name not in watchers:
+                continue
+            watcher_pids = self.client.send_message('list', name=name)
 
-            if 'pids' in httpd_pids:
-                httpd_pids = httpd_pids['pids']
-                if len(httpd_pids) == 1:
-                    pids[httpd_pids[0]] = 'circushttpd'
+            if 'pids' in watcher_pids:
+                watcher_pids = watcher_pids['pids']
+                if len(watcher_pids) == 1:
+                    pids[watcher_pids[0]] = name
 
         return pids
 
-    def _add_callback(self, name, start=True, kind='watcher'):
+    def _add_callback(self, name, start=True, kind='watchers'):
         logger.debug('Callback added for %s' % name)
 
-        if kind == 'watcher':
-            klass = WatcherStatsCollector
+        if kind == 'watchers':
+            klass = WatchersStatsCollector
         elif kind == 'socket':
             klass = SocketStatsCollector
         else:
@@ -92,7 +145,7 @@ class StatsStreamer(object):
         res = self.client.send_message('list')
 
         for watcher in res['watchers']:
-            if watcher in ('circusd', 'circushttpd', 'circusd-stats'):
+            if watcher in _CIRCUS_WATCHERS:
                 # this is dealt by the special 'circus' collector
                 continue
 
@@ -103,10 +156,12 @@ class StatsStreamer(object):
 
         # getting the circus pids
         self.circus_pids = self.get_circus_pids()
-        if 'circus' not in self._callbacks:
-            self._add_callback('circus')
+
+        # a single collector for all the watchers and circus
+        if 'watchers' not in self._callbacks:
+            self._add_callback('watchers')
         else:
-            self._callbacks['circus'].start()
+            self._callbacks['watchers'].start()
 
         # getting the initial list of sockets
         res = self.client.send_message('listsockets')
@@ -125,27 +180,20 @@ class StatsStreamer(object):
         self._add_callback('sockets', kind='socket')
 
     def stop_watcher(self, watcher):
-        for pid in self._pids[watcher]:
+        for pid in list(self._pids[watcher]):
             self.remove_pid(watcher, pid)
 
     def remove_pid(self, watcher, pid):
         if pid in self._pids[watcher]:
             logger.debug('Removing %d from %s' % (pid, watcher))
             self._pids[watcher].remove(pid)
-            if len(self._pids[watcher]) == 0:
-                logger.debug(
-                    'Stopping the periodic callback for {0}' .format(watcher))
-                self._callbacks[watcher].stop()
+            self.suppressed.pop(pid, None)
+            if self.history is not None:
+                self.history.forget(watcher, pid)
+            if self.segment is not None and not self._pids[watcher]:
+                self.segment.forget(watcher)
 
     def _append_pid(self, watcher, pid):
-        if watcher not in self._pids or len(self._pids[watcher]) == 0:
-            logger.debug(
-                'Starting the periodic callback for {0}'.format(watcher))
-            if watcher not in self._callbacks:
-                self._add_callback(watcher)
-            else:
-                self._callbacks[watcher].start()
-
         if pid in self._pids[watcher]:
             return
         self._pids[watcher].append(pid)
@@ -188,7 +236,16 @@ class StatsStreamer(object):
             action = topic.split('.')[-1]
             msg = json.loads(msg)
 
-            if action in ('reap', 'kill'):
+            if watcher in _CIRCUS_WATCHERS:
+                # dealt by the special 'circus' collector
+                if action == 'spawn' and watcher in _CIRCUS_SINGLETONS:
+                    # e.g. circusd-logger was respawned
+                    pids = dict((pid, name) for pid, name
+                                in self.circus_pids.items()
+                                if name != watcher)
+                    pids[msg['process_pid']] = watcher
+                    self.circus_pids = pids
+            elif action in ('reap', 'kill'):
                 # a process was reaped
                 pid = msg['process_pid']
                 self.remove_pid(watcher, pid)
@@ -196,6 +253,9 @@ class StatsStreamer(object):
                 # a process was added
                 pid = msg['process_pid']
                 self._append_pid(watcher, pid)
+            elif action == 'suppressed':
+                # output of a process was dropped
+                self.suppressed[msg['process_pid']] += msg['bytes']
             elif action == 'stop':
                 # the whole watcher was stopped.
                 self.stop_watcher(watcher)
@@ -205,6 +265,25 @@ class StatsStreamer(object):
         except Exception:
             logger.exception('Failed to handle %r' % msg)
 
+    def handle_history(self, data):
+        """called each time a client asks for the history of the stats"""
+        cid, msg = data
+        mid = None
+        try:
+            msg = json.loads(msg)
+            mid = msg.get('id')
+            props = msg.get('properties', {})
+            resp = ok(self.history.query(
+                props['name'], subtopic=props.get('subtopic'),
+                start=props.get('start'), end=props.get('end'),
+                step=props.get('step'), fields=props.get('fields')))
+        except KeyError as e:
+            resp = error(str(e), errno=errors.MESSAGE_ERROR)
+        except (ValueError, TypeError, AttributeError) as e:
+            resp = error(str(e), errno=errors.BAD_MSG_DATA_ERROR)
+        resp['id'] = mid
+        self.history_stream.send_multipart([cid, json.dumps(resp)])
+
     def stop(self):
         # stop all the periodic callbacks running
         for callback in self._callbacks.values():
@@ -213,6 +292,88 @@ class StatsStreamer(object):
         self.loop.stop()
         self.ctx.destroy(0)
         self.publisher.stop()
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
         self.stopped = True
         self.running = False
         logger.info('Stats streamer stopped')
+
+
+class ArbiterStatsStreamer(StatsStreamer):
+    """Collects the stats in a thread of circusd, and publishes them like
+    circusd-stats does.
+
+    The watchers, their pids and the sockets are read from the tables of
+    the **arbiter** at every cycle, instead of being asked to circusd and
+    tracked through its events.
+    """
+    def __init__(self, arbiter, stats_endpoint, delay=1., batch=None,
+                 encoding='json', keyframe_interval=0, history_endpoint=None,
+                 shm_path=None, process_tree=False, mem_accounting='rss',
+                 mem_interval=10.):
+        self.arbiter = arbiter
+        self.delay = delay
+        self.ctx = zmq.Context()
+        # the loop of the thread, not the one of circusd
+        self.loop = ioloop.IOLoop()
+        self.thread = None
+        self._init_outputs(stats_endpoint, batch, encoding, keyframe_interval,
+                           history_endpoint, shm_path)
+        self._init_collect(process_tree, mem_accounting, mem_interval)
+        self._initialize()
+
+    def _initialize(self):
+        super(ArbiterStatsStreamer, self)._initialize()
+        self.get_watchers = self._refresh
+
+    def _refresh(self):
+        """Updates the pids from the arbiter, and returns the names of the
+        watchers."""
+        pids = {}
+        circus_pids = {os.getpid(): 'circusd'}
+        # the lists of the arbiter are copied at once, while holding the GIL
+        for watcher in list(self.arbiter.watchers):
+            processes = list(watcher.processes)
+            if watcher.name in _CIRCUS_SINGLETONS and len(processes) == 1:
+                circus_pids[processes[0]] = watcher.name
+            if watcher.name not in _CIRCUS_WATCHERS:
+                pids[watcher.name] = processes
+        self.circus_pids = circus_pids
+
+        for name in list(self._pids):
+            current = pids.get(name, ())
+            for pid in list(self._pids[name]):
+                if pid not in current:
+                    self.remove_pid(name, pid)
+            if not self._pids[name]:
+                del self._pids[name]
+        for name, current in pids.items():
+            for pid in current:
+                self._append_pid(name, pid)
+        return list(pids)
+
+    def _init(self):
+        self._refresh()
+        self._add_callback('watchers')
+
+        for sock in list(self.arbiter.sockets.values()):
+            if sock.is_unix:
+                address = sock.path
+            else:
+                address = '%s:%s' % (sock.host, sock.port)
+            self.sockets.append((sock, address, sock.fileno()))
+        self._add_callback('sockets', kind='socket')
+
+    def start_thread(self):
+        self.thread = Thread(target=self.start, name='circus-stats')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop_thread(self, timeout=5.):
+        """Stops the loop of the thread, which then stops the streamer."""
+        if self.thread is None:
+            return
+        self.loop.add_callback(self.loop.stop)
+        self.thread.join(timeout)
+        self.thread = None
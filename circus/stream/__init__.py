@@ -7,10 +7,12 @@ try:
 except ImportError:
     from Queue import Queue, Empty  # NOQA
 
-from circus.util import resolve_name
+from circus.util import resolve_name, to_bool, to_size
 from circus.stream.file_stream import FileStream
 from circus.stream.file_stream import WatchedFileStream  # flake8: noqa
+from circus.stream.json_stream import JsonLinesStream  # flake8: noqa
 from circus.stream.redirector import Redirector
+from circus.stream.scheduler import OutputScheduler  # flake8: noqa
 from circus.py3compat import s
 
 
@@ -113,10 +115,25 @@ class FancyStdoutStream(StdoutStream):
                 self.out.flush()
 
 
+# options used by the pipe redirector rather than by the stream class
+_REDIRECTOR_OPTIONS = {'line_buffered': to_bool, 'max_line_length': int,
+                       'max_buffer': int, 'read_budget': int,
+                       'pipe_size': int, 'direct': to_bool,
+                       'max_bytes_per_sec': to_size, 'max_lines_per_sec': int,
+                       'rate_limit': str}
+
+
 def get_stream(conf, reload=False):
     if not conf:
         return conf
 
+    # work on a copy so the options survive a later reload of the stream
+    conf = conf.copy()
+    redirector_options = {}
+    for name, convert in _REDIRECTOR_OPTIONS.items():
+        if name in conf:
+            redirector_options[name] = convert(conf.pop(name))
+
     # we can have 'stream' or 'class' or 'filename'
     if 'class' in conf:
         class_name = conf.pop('class')
@@ -132,14 +149,18 @@ def get_stream(conf, reload=False):
     else:
         raise ValueError("stream configuration invalid")
 
-    return {'stream': inst}
+    res = {'stream': inst}
+    res.update(redirector_options)
+    return res
 
 
-def get_pipe_redirector(redirect, extra_info=None, buffer=1024, loop=None):
+def get_pipe_redirector(redirect, extra_info=None, buffer=1024, loop=None,
+                        scheduler=None, group=None, weight=1):
     """Redirects data received in pipes to the redirect callable.
 
     The data is a mapping with a **data** key containing the data
-    received from the pipe, extended with all values passed in
+    received from the pipe, the **pid** and **wid** of the process and the
+    **name** of the stream, extended with all values passed in
     **extra_info**
 
     Options:
@@ -148,6 +169,29 @@ def get_pipe_redirector(redirect, extra_info=None, buffer=1024, loop=None):
     - **buffer**: the size of the buffer when reading data
     - **loop**: the ioloop to use. If not provided will use the
       global IOLoop
+    - **scheduler**: an :class:`OutputScheduler` reading the pipes of
+      several redirectors in turns. If not provided, each pipe is read as
+      soon as it's readable.
+    - **group**: the name of the group the pipes are scheduled with.
+    - **weight**: the share of reads of the group in the scheduler.
+
+    When **redirect** contains a true **line_buffered** value, data is only
+    sent on line boundaries: each call receives a batch of complete lines.
+    An unterminated line is kept until its end arrives, unless it reaches
+    **max_line_length** (default: 65536) bytes, in which case it is sent
+    as is, whatever its length, without being split.
+
+    On each event the pipe is read until it is empty or **read_budget**
+    bytes (default: 262144) were read. The size of each read starts at
+    **buffer** and grows up to **max_buffer** (default: 65536) as long as
+    the pipe fills them. **pipe_size**, if given, sets the capacity of the
+    pipe (Linux only).
+
+    **max_bytes_per_sec** and **max_lines_per_sec** limit the output of each
+    process. With a **rate_limit** of "drop" (the default), the excess is
+    dropped and a marker line gives the number of bytes suppressed, at most
+    once per second. With "throttle", the reads of the pipe are paused
+    instead, until the process is back under the limits.
     """
     # XXX backend is deprecated
 
@@ -158,4 +202,13 @@ def get_pipe_redirector(redirect, extra_info=None, buffer=1024, loop=None):
     stream = redirect.get('stream')
 
     # finally setup the redirection
-    return Redirector(stream, extra_info, buffer, loop=loop)
+    return Redirector(stream, extra_info, buffer, loop=loop,
+                      line_buffered=redirect.get('line_buffered', False),
+                      max_line_length=redirect.get('max_line_length', 65536),
+                      max_buffer=redirect.get('max_buffer', 65536),
+                      read_budget=redirect.get('read_budget', 262144),
+                      pipe_size=redirect.get('pipe_size'),
+                      max_bytes_per_sec=redirect.get('max_bytes_per_sec', 0),
+                      max_lines_per_sec=redirect.get('max_lines_per_sec', 0),
+                      rate_limit=redirect.get('rate_limit', 'drop'),
+                      scheduler=scheduler, group=group, weight=weight)
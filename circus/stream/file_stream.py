@@ -1,10 +1,26 @@
 import errno
+import gzip
 import os
+import shutil
 import tempfile
-from datetime import datetime
+from collections import deque
+from itertools import count
+from datetime import datetime, timedelta
 from stat import ST_DEV, ST_INO
+from threading import Thread
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue  # NOQA
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 from circus import logger
 from circus.py3compat import s, PY2
+from circus.util import to_bool
 
 
 class _FileStreamBase(object):
@@ -20,14 +36,58 @@ class _FileStreamBase(object):
         self._file = self._open()
         self._time_format = time_format
         self._buffer = []  # XXX - is this really needed?
+        self._splice_fd = None
+        # set once the file is handed to the processes
+        self._direct = False
 
     def _open(self):
         return open(self._filename, 'a+')
 
     def close(self):
+        self._close_splice_fd()
         self._file.close()
 
+    def _close_splice_fd(self):
+        if self._splice_fd is not None:
+            os.close(self._splice_fd)
+            self._splice_fd = None
+
+    def splice_fileno(self):
+        """Returns a file descriptor the redirector can move the output to
+        with splice(), or None if the output has to be passed to __call__
+        because it's transformed.
+        """
+        if self._time_format is not None:
+            return None
+        if self._splice_fd is None:
+            # splice() refuses files opened in append mode
+            self._splice_fd = os.open(self._filename, os.O_WRONLY)
+        os.lseek(self._splice_fd, 0, os.SEEK_END)
+        return self._splice_fd
+
+    def splice_room(self):
+        """Returns how many bytes can be spliced to the file descriptor of
+        :meth:`splice_fileno`, or None if there's no limit.
+        """
+        return None
+
+    def spliced(self, size):
+        """Called once *size* bytes were spliced to the file."""
+
+    def direct_fileno(self):
+        """Returns a file descriptor opened in append mode the processes
+        can write their output to, or None if the output has to go through
+        __call__ because it's transformed.
+        """
+        if self._time_format is not None:
+            return None
+        self._direct = True
+        return self._file.fileno()
+
     def write_data(self, data):
+        self._write(self._format(data))
+
+    def _format(self, data):
         # data to write on file
         file_data = s(data['data'])
 
@@ -38,7 +98,9 @@ class _FileStreamBase(object):
             file_data = prefix + file_data.rstrip('\n')
             file_data = file_data.replace('\n', '\n' + prefix)
             file_data += '\n'
+        return file_data
 
+    def _write(self, file_data):
         # writing into the file
         try:
             self._file.write(file_data)
@@ -52,9 +114,63 @@ class _FileStreamBase(object):
         self._file.flush()
 
 
+class _Rotator(object):
+    """Moves, compresses and deletes the rotated files of a FileStream in a
+    thread, so the loop only has to rename the current file."""
+
+    def __init__(self):
+        self._queue = Queue()
+        self._thread = None
+
+    def submit(self, job, *args):
+        if self._thread is None:
+            self._thread = Thread(target=self._run)
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put((job, args))
+
+    def _run(self):
+        while True:
+            job, args = self._queue.get()
+            if job is None:
+                break
+            try:
+                job(*args)
+            except Exception:
+                logger.exception('Could not rotate the log file')
+
+    def stop(self):
+        """Waits for the pending jobs."""
+        if self._thread is not None:
+            self._queue.put((None, ()))
+            self._thread.join()
+            self._thread = None
+
+
+def _compress(src, dst, compression):
+    with open(src, 'rb') as f_in:
+        if compression == 'gzip':
+            # GzipFile is not a context manager on Python 2.6
+            f_out = gzip.open(dst, 'wb')
+            try:
+                shutil.copyfileobj(f_in, f_out)
+            finally:
+                f_out.close()
+        else:
+            with open(dst, 'wb') as f_out:
+                zstandard.ZstdCompressor().copy_stream(f_in, f_out)
+    os.remove(src)
+
+
 class FileStream(_FileStreamBase):
+    # the suffix of the compressed files
+    _extensions = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+    _intervals = {'hourly': timedelta(hours=1), 'daily': timedelta(days=1)}
+    _segment_format = '%Y%m%d-%H%M%S'
+
     def __init__(self, filename=None, max_bytes=0, backup_count=0,
-                 time_format=None, **kwargs):
+                 time_format=None, rotate_when=None, compress=None,
+                 timestamped=False, **kwargs):
         '''
         File writer handler which writes output to a file, allowing rotation
         behaviour based on Python's ``logging.handlers.RotatingFileHandler``.
@@ -63,8 +179,10 @@ class FileStream(_FileStreamBase):
         values of max_bytes and backup_count to allow the file to rollover at
         a predetermined size.
 
-        Rollover occurs whenever the current log file is nearly max_bytes in
-        length. If backup_count is >= 1, the system will successively create
+        Rollover occurs whenever the current log file reaches max_bytes in
+        length: the output is split so each file holds exactly max_bytes
+        (counted in characters of the decoded output under Python 3).
+        If backup_count is >= 1, the system will successively create
         new files with the same pathname as the base file, but with extensions
         ".1", ".2" etc. appended to it. For example, with a backup_count of 5
         and a base file name of "app.log", you would get "app.log",
@@ -76,6 +194,18 @@ class FileStream(_FileStreamBase):
 
         If max_bytes is zero, rollover never occurs.
 
+        Rollover can also occur every hour or every day, with rotate_when set
+        to "hourly" or "daily", whatever the size of the file.
+
+        If timestamped is True, the rotated files are named after the time of
+        the rollover, like "app.log.20140130-154500", and are never renamed
+        afterwards. The oldest ones are deleted to keep backup_count of
+        them, or all of them if backup_count is 0.
+
+        If compress is "gzip" or "zstd" (which needs the zstandard
+        library), the rotated files are compressed. The renaming of the
+        backups and the compression happen in a thread.
+
         You may also configure the timestamp format as defined by
         datetime.strftime.
 
@@ -91,48 +221,248 @@ class FileStream(_FileStreamBase):
         self._max_bytes = int(max_bytes)
         self._backup_count = int(backup_count)
 
+        if rotate_when is not None and rotate_when not in self._intervals:
+            raise ValueError('rotate_when should be one of %s' %
+                             ', '.join(sorted(self._intervals)))
+        if compress not in self._extensions:
+            raise ValueError('compress should be gzip or zstd')
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError('zstd compression needs the zstandard library')
+
+        self._rotate_when = rotate_when
+        self._compress = compress
+        self._extension = self._extensions[compress]
+        self._timestamped = to_bool(timestamped)
+        # the size of the file, None when it has to be read again
+        self._size = None
+        self._rotator = _Rotator()
+        # True until the rotator emptied the file given to the processes
+        self._copying = False
+        self._pending = count()
+        self._last_stamp, self._stamp_count = None, 0
+        self._rollover_at = self._next_rollover()
+        if self._timestamped:
+            self._segments = self._find_segments()
+
     def __call__(self, data):
-        if self._should_rollover(data['data']):
+        if self._should_rollover(''):
             self._do_rollover()
 
-        self.write_data(data)
+        file_data = self._format(data)
+        if self._max_bytes > 0 and (self._timestamped or self._backup_count):
+            if self._size + len(file_data) > self._max_bytes:
+                # the file may have been truncated meanwhile
+                self._sync_size()
+            # fill the file up to max_bytes exactly, the rest of the data
+            # goes to the next one
+            while self._size + len(file_data) > self._max_bytes:
+                room = max(self._max_bytes - self._size, 0)
+                if room:
+                    self._write(file_data[:room])
+                    file_data = file_data[room:]
+                self._do_rollover()
+                if self._size is None:
+                    self._sync_size()
+        self._write(file_data)
+
+    def _write(self, file_data):
+        super(FileStream, self)._write(file_data)
+        if self._size is not None:
+            self._size += len(file_data)
+
+    def _sync_size(self):
+        self._size = os.fstat(self._file.fileno()).st_size
+
+    def close(self):
+        super(FileStream, self).close()
+        self._rotator.stop()
+
+    def splice_fileno(self):
+        if self._time_format is None and self._should_rollover(''):
+            self._do_rollover()
+        return super(FileStream, self).splice_fileno()
+
+    def splice_room(self):
+        if self._max_bytes > 0 and (self._timestamped or self._backup_count):
+            if self._size is None:
+                self._sync_size()
+            return max(self._max_bytes - self._size, 0)
+        return None
+
+    def spliced(self, size):
+        # the data spliced doesn't go through _write()
+        if self._size is not None:
+            self._size += size
+        if self._should_rollover(''):
+            self._do_rollover()
+
+    def direct_fileno(self):
+        self.rollover_if_needed()
+        return super(FileStream, self).direct_fileno()
+
+    def rollover_if_needed(self):
+        """Rolls the file over if it grew past max_bytes or if its time
+        is up.
+
+        Called periodically when the processes write to the file directly.
+        """
+        if self._time_format is None:
+            # written by someone else since the last check
+            self._size = None
+            if self._should_rollover(''):
+                self._do_rollover()
+
+    def _next_rollover(self):
+        if self._rotate_when is None:
+            return None
+        now = self.now()
+        if self._rotate_when == 'hourly':
+            start = now.replace(minute=0, second=0, microsecond=0)
+        else:
+            start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        return start + self._intervals[self._rotate_when]
+
+    def _find_segments(self):
+        dirname, basename = os.path.split(os.path.abspath(self._filename))
+        prefix = basename + '.'
+        size = len(self.now().strftime(self._segment_format))
+        segments = []
+        for name in os.listdir(dirname):
+            if not name.startswith(prefix):
+                continue
+            stamp = name[len(prefix):len(prefix) + size]
+            try:
+                datetime.strptime(stamp, self._segment_format)
+            except ValueError:
+                continue
+            segments.append(os.path.join(dirname, name))
+
+        def _key(segment):
+            # "app.log.<stamp>" comes before "app.log.<stamp>-1.gz"
+            for ext in self._extensions.values():
+                if ext and segment.endswith(ext):
+                    return segment[:-len(ext)]
+            return segment
+
+        return deque(sorted(segments, key=_key))
+
+    def _rotated_filename(self):
+        """Returns where the current file goes on rollover."""
+        if not self._timestamped:
+            # moved to its final name by the rotator, maybe after the
+            # next rollover
+            return '%s.rotating-%d' % (self._filename, next(self._pending))
+        stamp = self.now().strftime(self._segment_format)
+        if stamp == self._last_stamp:
+            # rollovers within the same second
+            self._stamp_count += 1
+            stamp += '-%d' % self._stamp_count
+        else:
+            self._last_stamp, self._stamp_count = stamp, 0
+        return '%s.%s' % (self._filename, stamp)
 
     def _do_rollover(self):
         """
         Do a rollover, as described in __init__().
         """
-        if self._file:
-            self._file.close()
-            self._file = None
-        if self._backup_count > 0:
-            for i in range(self._backup_count - 1, 0, -1):
-                sfn = "%s.%d" % (self._filename, i)
-                dfn = "%s.%d" % (self._filename, i + 1)
-                if os.path.exists(sfn):
-                    logger.debug("Log rotating %s -> %s" % (sfn, dfn))
-                    if os.path.exists(dfn):
-                        os.remove(dfn)
-                    os.rename(sfn, dfn)
-            dfn = self._filename + ".1"
-            if os.path.exists(dfn):
-                os.remove(dfn)
+        self._close_splice_fd()
+        self._rollover_at = self._next_rollover()
+        if not self._timestamped and self._backup_count == 0:
+            return
+        dfn = self._rotated_filename()
+
+        if self._direct:
+            # the processes keep writing to the file, the rotator copies it
+            # and empties it in place instead of renaming it
+            self._file.flush()
+            self._copying = True
+            self._rotator.submit(self._copy_truncate, dfn)
+        else:
+            if self._file:
+                self._file.close()
+                self._file = None
             os.rename(self._filename, dfn)
-            logger.debug("Log rotating %s -> %s" % (self._filename, dfn))
-        self._file = self._open()
+            self._file = self._open()
+        # the size of the file given to the processes is read again
+        self._size = None if self._direct else 0
+
+        logger.debug("Log rotating %s -> %s" % (self._filename, dfn))
+        if self._timestamped:
+            self._rotator.submit(self._store_segment, dfn)
+        else:
+            self._rotator.submit(self._rotate_backups, dfn)
+
+    def _copy_truncate(self, dfn):
+        # runs in the rotator thread. What the processes write between the
+        # copy and the truncate is lost
+        try:
+            shutil.copyfile(self._filename, dfn)
+            with open(self._filename, 'r+b') as f:
+                f.truncate(0)
+        finally:
+            self._copying = False
+
+    def _store_segment(self, sfn):
+        # runs in the rotator thread
+        if self._compress:
+            _compress(sfn, sfn + self._extension, self._compress)
+            sfn += self._extension
+        self._segments.append(sfn)
+        while 0 < self._backup_count < len(self._segments):
+            old = self._segments.popleft()
+            logger.debug("Log removing %s" % old)
+            if os.path.exists(old):
+                os.remove(old)
+
+    def _rotate_backups(self, sfn):
+        # runs in the rotator thread
+        ext = self._extension
+        for i in range(self._backup_count - 1, 0, -1):
+            src = "%s.%d%s" % (self._filename, i, ext)
+            dst = "%s.%d%s" % (self._filename, i + 1, ext)
+            if os.path.exists(src):
+                logger.debug("Log rotating %s -> %s" % (src, dst))
+                if os.path.exists(dst):
+                    os.remove(dst)
+                os.rename(src, dst)
+        dfn = "%s.1%s" % (self._filename, ext)
+        if os.path.exists(dfn):
+            os.remove(dfn)
+        if self._compress:
+            _compress(sfn, dfn, self._compress)
+        else:
+            os.rename(sfn, dfn)
+        logger.debug("Log rotating %s -> %s" % (sfn, dfn))
 
     def _should_rollover(self, raw_data):
         """
         Determine if rollover should occur.
 
         Basically, see if the supplied raw_data would cause the file to exceed
-        the size limit we have.
+        the size limit we have, or if the rotation interval is over.
+
+        The size of the file is tracked as the data is written, and only
+        read from the file again after an open, a rollover, or when the
+        limit seems reached, in case the file was truncated meanwhile.
         """
+        if self._copying:
+            # the previous rollover isn't done yet
+            return 0
         if self._file is None:                 # delay was set...
             self._file = self._open()
+            self._size = None
         if self._max_bytes > 0:                   # are we rolling over?
-            self._file.seek(0, 2)  # due to non-posix-compliant Windows feature
-            if self._file.tell() + len(raw_data) >= self._max_bytes:
+            if self._size is None:
+                self._sync_size()
+            if self._size + len(raw_data) >= self._max_bytes:
+                self._sync_size()
+                if self._size + len(raw_data) >= self._max_bytes:
+                    return 1
+        if self._rollover_at is not None and self.now() >= self._rollover_at:
+            if os.fstat(self._file.fileno()).st_size > 0:
                 return 1
+            # nothing to rotate, wait for the next interval
+            self._rollover_at = self._next_rollover()
         return 0
 
 
@@ -176,14 +506,29 @@ class WatchedFileStream(_FileStreamBase):
             else:
                 raise
 
-    def __call__(self, data):
+    def _reopen_if_moved(self):
         # stat the filename to see if the file we opened still exists. If the
         # ino or dev doesn't match, we need to open a new file handle
         dev, ino = self._statfilename()
         if dev != self.dev or ino != self.ino:
+            self._close_splice_fd()
             self._file.flush()
             self._file.close()
             self._file = self._open()
             self._statfile()
 
+    def __call__(self, data):
+        self._reopen_if_moved()
         self.write_data(data)
+
+    def splice_fileno(self):
+        if self._time_format is None:
+            self._reopen_if_moved()
+        return super(WatchedFileStream, self).splice_fileno()
+
+    def direct_fileno(self):
+        # the processes already running keep the previous file, the new
+        # ones get the new file
+        if self._time_format is None:
+            self._reopen_if_moved()
+        return super(WatchedFileStream, self).direct_fileno()
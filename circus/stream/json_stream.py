@@ -0,0 +1,283 @@
+import errno
+import os
+import socket
+import time
+from datetime import datetime
+
+from zmq.eventloop import ioloop
+
+try:
+    from ujson import dumps as _dumps
+except ImportError:
+    from json import dumps
+
+    def _dumps(obj):
+        return dumps(obj, separators=(',', ':'))
+
+from circus import logger
+from circus.py3compat import b
+
+
+class JsonLinesStream(object):
+    """
+    Write output from watchers as JSON objects, one per line, to a file or
+    to a local collector.
+
+    Each line of output gives an object with the **time** (seconds since
+    the epoch, or formatted with **time_format**), the **watcher** name,
+    the **pid** and **wid** of the process, the **stream** it comes from
+    and the **message**: ::
+
+      {"time":1391095200.5,"watcher":"foo","pid":4242,"wid":1,
+       "stream":"stdout","message":"Listening on port 8080"}
+
+    The fields shared by the lines of a read are only encoded once, and
+    the lines are written in batches of up to **batch_size** lines: the
+    batch is flushed when full, or at the end of the current loop
+    iteration. The ujson library is used to encode them if it's installed.
+
+    The lines are appended to **filename**, or sent to **address**:
+
+    - unix:///path/to/socket sends datagrams to a unix socket.
+    - tcp://host:port sends them over a TCP connection.
+
+    The socket never blocks circusd: when the collector is not there or
+    can't keep up, the datagrams are dropped, and over TCP the oldest lines
+    are dropped past **max_pending** bytes. The TCP connection is made in
+    the background, and the lines are sent once it's established. The
+    connection is retried every **retry_delay** seconds. The host is
+    resolved once, when the stream is created.
+
+    Use *line_buffered* so a line is never split in two messages.
+
+    Here is an example: ::
+
+      [watcher:foo]
+      cmd = python -m myapp.server
+      stdout_stream.class = JsonLinesStream
+      stdout_stream.address = unix:///var/run/collector.sock
+      stdout_stream.line_buffered = True
+    """
+    # largest datagram sent to a unix socket
+    max_datagram = 65536
+    now = time.time
+
+    def __init__(self, filename=None, address=None, time_format=None,
+                 batch_size=100, max_pending=1048576, retry_delay=1.,
+                 loop=None, **kwargs):
+        if (filename is None) == (address is None):
+            raise ValueError('JsonLinesStream needs a filename or an '
+                             'address')
+        self.filename = filename
+        self.time_format = time_format
+        self.batch_size = int(batch_size)
+        self.max_pending = int(max_pending)
+        self.retry_delay = float(retry_delay)
+        self.loop = loop or ioloop.IOLoop.instance()
+        self.dropped = 0
+        self._batch = []
+        self._flush_scheduled = False
+        # bytes not sent yet to the TCP socket
+        self._pending = b''
+        self._sock = None
+        # True until the TCP connection is established
+        self._connecting = False
+        # True while the loop tells when the TCP socket is writable
+        self._writing = False
+        self._retry_at = 0
+        self._file = None
+
+        if address is None:
+            self._file = open(filename, 'ab')
+            self._kind = 'file'
+        elif address.startswith('unix://'):
+            self._kind, self._address = 'unix', address[len('unix://'):]
+        elif address.startswith('tcp://'):
+            host, port = address[len('tcp://'):].rsplit(':', 1)
+            self._kind, self._address = 'tcp', (host, int(port))
+            # resolved once, the lookup would block the loop at each
+            # connection
+            try:
+                self._addrinfo = socket.getaddrinfo(
+                    host, int(port), 0, socket.SOCK_STREAM)[0]
+            except socket.error as e:
+                raise ValueError('Could not resolve %s: %s' % (host, e))
+        else:
+            raise ValueError('address should start with unix:// or tcp://')
+
+    def _format_time(self):
+        now = self.now()
+        if self.time_format is None:
+            return now
+        return datetime.fromtimestamp(now).strftime(self.time_format)
+
+    def __call__(self, data):
+        text = data['data']
+        if isinstance(text, bytes):
+            # a badly encoded byte must not break the stream
+            text = text.decode('utf-8', 'replace')
+        lines = text.split('\n')
+        if not lines[-1]:
+            lines.pop()
+        if not lines:
+            return
+
+        # the shared fields are encoded once for all the lines
+        common = _dumps({'time': self._format_time(),
+                         'watcher': data.get('watcher'),
+                         'pid': data['pid'],
+                         'wid': data.get('wid'),
+                         'stream': data['name']})
+        prefix = common[:-1] + ',"message":'
+        for line in lines:
+            self._batch.append(prefix + _dumps(line) + '}\n')
+
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.loop.add_callback(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._flush_scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Writes the lines waiting in the batch."""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        if self._kind == 'file':
+            self._file.write(b(''.join(batch)))
+            self._file.flush()
+        elif self._kind == 'unix':
+            self._send_datagrams(batch)
+        else:
+            self._send_stream(b(''.join(batch)))
+
+    def _connect(self):
+        """Returns True if the socket is connected.
+
+        The TCP connection is made in the background: the pending data is
+        sent by :meth:`_handle_write` once it's established."""
+        if self._sock is not None:
+            return not self._connecting
+        if time.time() < self._retry_at:
+            return False
+        try:
+            if self._kind == 'unix':
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sock.connect(self._address)
+                sock.setblocking(0)
+            else:
+                family, kind, proto, _, address = self._addrinfo
+                sock = socket.socket(family, kind, proto)
+                sock.setblocking(0)
+                res = sock.connect_ex(address)
+                if res not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    sock.close()
+                    raise socket.error(res, os.strerror(res))
+        except socket.error as e:
+            logger.debug('Could not connect to %s: %s', self._address, e)
+            self._retry_at = time.time() + self.retry_delay
+            return False
+        self._sock = sock
+        if self._kind == 'unix':
+            return True
+        self._connecting = True
+        self._update_handler()
+        return False
+
+    def _update_handler(self):
+        # the loop watches the socket while it connects or while data
+        # waits to be sent
+        writing = self._connecting or bool(self._pending)
+        if writing == self._writing:
+            return
+        if writing:
+            self.loop.add_handler(self._sock.fileno(), self._handle_write,
+                                  ioloop.IOLoop.WRITE)
+        else:
+            self.loop.remove_handler(self._sock.fileno())
+        self._writing = writing
+
+    def _handle_write(self, fd, events):
+        if self._connecting:
+            res = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if res:
+                logger.debug('Could not connect to %s: %s', self._address,
+                             os.strerror(res))
+                self._disconnect()
+                return
+            self._connecting = False
+        elif not events & ioloop.IOLoop.WRITE:
+            self._disconnect()
+            return
+        self._send_pending()
+
+    def _send_pending(self):
+        try:
+            sent = self._sock.send(self._pending)
+        except socket.error as e:
+            if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self._disconnect()
+                return
+            sent = 0
+        self._pending = self._pending[sent:]
+        self._update_handler()
+
+    def _disconnect(self):
+        if self._sock is not None:
+            if self._writing:
+                self.loop.remove_handler(self._sock.fileno())
+            self._sock.close()
+            self._sock = None
+        self._connecting = self._writing = False
+        self._retry_at = time.time() + self.retry_delay
+
+    def _send_datagrams(self, lines):
+        if not self._connect():
+            self.dropped += len(lines)
+            return
+
+        datagram, count = b'', 0
+        for index, line in enumerate(lines + [None]):
+            if line is not None:
+                line = b(line)
+                if len(datagram) + len(line) <= self.max_datagram:
+                    datagram += line
+                    count += 1
+                    continue
+            if datagram:
+                try:
+                    self._sock.send(datagram)
+                except socket.error as e:
+                    self.dropped += count
+                    if e.args[0] not in (errno.EAGAIN, errno.ENOBUFS,
+                                         errno.EMSGSIZE):
+                        # the collector went away
+                        self._disconnect()
+                        self.dropped += len(lines) - index
+                        return
+            datagram, count = line, 1
+
+    def _send_stream(self, data):
+        data = self._pending + data
+        if len(data) > self.max_pending:
+            # drop the oldest lines
+            start = len(data) - self.max_pending
+            start = data.find(b'\n', start) + 1 or start
+            self.dropped += data.count(b'\n', 0, start)
+            data = data[start:]
+
+        self._pending = data
+        # when the loop watches the socket, the data goes once it's
+        # writable
+        if self._connect() and not self._writing:
+            self._send_pending()
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        self._disconnect()
@@ -1,9 +1,19 @@
 import errno
 import os
 import sys
+import time
 
 from zmq.eventloop import ioloop
 
+from circus.util import set_nonblocking, set_pipe_size, TokenBucket
+from circus.py3compat import b
+
+try:
+    # Python 3.10+, Linux
+    from os import splice
+except ImportError:
+    splice = None
+
 
 class RedirectorHandler(object):
     def __init__(self, redirector, name, process, pipe):
@@ -11,39 +21,310 @@ class RedirectorHandler(object):
         self.name = name
         self.process = process
         self.pipe = pipe
+        self.fd = pipe.fileno()
+        # bytes read after the last newline, when framing on lines
+        self._partial = b''
+        # grows when the pipe keeps filling our reads, shrinks back when
+        # the reads get small
+        self.read_size = redirector.buffer
+        self._can_splice = splice is not None
+        # each process gets its own share of output
+        self.bytes_bucket = self.lines_bucket = None
+        if redirector.max_bytes_per_sec:
+            self.bytes_bucket = TokenBucket(redirector.max_bytes_per_sec)
+        if redirector.max_lines_per_sec:
+            self.lines_bucket = TokenBucket(redirector.max_lines_per_sec)
+        # the bytes dropped since the last marker
+        self.suppressed = 0
+        self._next_marker = 0
+        # True while the reads are paused to throttle the process
+        self.paused = False
 
     def __call__(self, fd, events):
         if not (events & ioloop.IOLoop.READ):
             if events == ioloop.IOLoop.ERROR:
                 self.redirector.remove_redirection(self.pipe)
             return
-        try:
-            data = os.read(fd, self.redirector.buffer)
-            if len(data) == 0:
-                self.redirector.remove_redirection(self.pipe)
-            else:
-                datamap = {'data': data, 'pid': self.process.pid,
-                           'name': self.name}
-                datamap.update(self.redirector.extra_info)
-                self.redirector.redirect(datamap)
-        except IOError as ex:
-            if ex.args[0] != errno.EAGAIN:
-                raise
+
+        if self.redirector.scheduler is not None:
+            # the scheduler decides when the pipe is read
+            self.redirector.scheduler.ready(self)
+            return
+        self.read(self.redirector.read_budget)
+
+    def read(self, budget):
+        """Reads the pipe until it's empty or *budget* bytes were read.
+
+        Returns the number of bytes read, and whether the pipe may still
+        have data to read.
+        """
+        fd = self.fd
+        if self._can_splice:
+            res = self._splice(fd, budget)
+            if res is not None:
+                return res
+
+        # drain the pipe, but give back the hand to the loop once the
+        # budget is spent so the other pipes get their turn
+        chunks = []
+        size = 0
+        eof = drained = False
+        while size < budget:
             try:
-                sys.exc_clear()
-            except Exception:
-                pass
+                data = os.read(fd, self.read_size)
+            except (IOError, OSError) as ex:
+                if ex.args[0] != errno.EAGAIN:
+                    raise
+                try:
+                    sys.exc_clear()
+                except Exception:
+                    pass
+                break
+
+            if len(data) == 0:
+                eof = True
+                break
+
+            chunks.append(data)
+            size += len(data)
+            drained = len(data) < self.read_size
+            self._adapt_read_size(len(data))
+            if drained:
+                break
+
+        delay = 0
+        if chunks:
+            data = b''.join(chunks)
+            if self.redirector.line_buffered:
+                data = self._frame(data)
+            if self.redirector.rate_limit == 'throttle':
+                delay = self._throttle(data)
+            elif data and (self.bytes_bucket or self.lines_bucket):
+                data = self._drop_excess(data)
+            if data:
+                self._send(data)
+
+        if eof:
+            self.redirector.remove_redirection(self.pipe)
+        elif delay > 0:
+            self._pause(delay)
+        return size, size >= budget and not (eof or self.paused)
+
+    def _count_lines(self, data):
+        # a chunk without end of line counts as a line too
+        return data.count(b'\n') + (not data.endswith(b'\n'))
+
+    def _drop_excess(self, data):
+        """Returns what the buckets let through of *data*, and sends a
+        marker when data was dropped, at most once per second."""
+        size = len(data)
+        if self.lines_bucket is not None:
+            lines = self.lines_bucket.take(self._count_lines(data))
+            end = 0
+            for _ in range(lines):
+                end = data.find(b'\n', end) + 1 or len(data)
+            data = data[:end]
+
+        if self.bytes_bucket is not None and data:
+            allowed = self.bytes_bucket.take(len(data))
+            if allowed < len(data):
+                data = data[:allowed]
+                if self.redirector.line_buffered:
+                    # don't let a partial line through
+                    data = data[:data.rfind(b'\n') + 1]
+                    self.bytes_bucket.tokens += allowed - len(data)
+
+        self.suppressed += size - len(data)
+        if self.suppressed and time.time() >= self._next_marker:
+            self._send_marker()
+        return data
+
+    def _send_marker(self):
+        self._send(b('[circus] %d bytes of output suppressed\n' %
+                     self.suppressed))
+        if self.redirector.on_suppress is not None:
+            self.redirector.on_suppress(self.process, self.name,
+                                        self.suppressed)
+        self.suppressed = 0
+        self._next_marker = time.time() + 1
+
+    def _throttle(self, data):
+        """Returns how long the reads have to be paused so the process
+        doesn't go over its rates."""
+        delay = 0
+        if self.bytes_bucket is not None:
+            delay = self.bytes_bucket.spend(len(data))
+        if self.lines_bucket is not None and data:
+            delay = max(delay,
+                        self.lines_bucket.spend(self._count_lines(data)))
+        return delay
+
+    def _pause(self, delay):
+        # the pipe fills up and the process blocks on its writes
+        self.redirector.loop.remove_handler(self.pipe.fileno())
+        self.paused = True
+        self.redirector.loop.add_timeout(time.time() + delay, self._resume)
+
+    def _resume(self):
+        self.paused = False
+        try:
+            fd = self.pipe.fileno()
+        except ValueError:
+            return
+        if self.redirector._active.get(fd) is self:
+            self.redirector.loop.add_handler(fd, self, ioloop.IOLoop.READ)
+
+    def _get_splice_fd(self):
+        if (self.redirector.line_buffered or self.redirector.recorder or
+                self.redirector.rate_limited):
+            return None
+        get_fd = getattr(self.redirector.redirect, 'splice_fileno', None)
+        if get_fd is None:
+            return None
+        return get_fd()
+
+    def _splice(self, fd, budget):
+        """Moves the data from the pipe to the stream file without copying
+        it in Python, when the stream allows it.
+
+        Returns None if the data has to be read instead, or the same as
+        :meth:`read`.
+        """
+        fd_out = self._get_splice_fd()
+        if fd_out is None:
+            return None
+        stream = self.redirector.redirect
+        get_room = getattr(stream, 'splice_room', None)
+        room = get_room() if get_room is not None else None
+        if room == 0:
+            # let the stream roll its file over
+            return None
+
+        total = 0
+        # the bytes spliced to the current file, told to the stream once
+        # it's full or at the end of the turn
+        written = 0
+        try:
+            while total < budget:
+                if room is not None and written >= room:
+                    # the stream rotates its file
+                    self._spliced(written)
+                    written = 0
+                    fd_out = self._get_splice_fd()
+                    room = get_room() if fd_out is not None else 0
+                    if not room:
+                        # the rest will be read on the next turn
+                        return total, True
+
+                wanted = self.read_size
+                if room is not None:
+                    wanted = min(wanted, room - written)
+                try:
+                    size = splice(fd, fd_out, wanted)
+                except OSError as ex:
+                    if ex.args[0] == errno.EAGAIN:
+                        return total, False
+                    if ex.args[0] == errno.EINVAL:
+                        # not supported for this file, stop trying
+                        self._can_splice = False
+                        return (total, True) if total else None
+                    raise
+
+                if size == 0:
+                    self.redirector.remove_redirection(self.pipe)
+                    return total, False
+
+                total += size
+                written += size
+                if wanted == self.read_size:
+                    self._adapt_read_size(size)
+                if size < wanted:
+                    return total, False
+            return total, True
+        finally:
+            self._spliced(written)
+
+    def _spliced(self, size):
+        spliced = getattr(self.redirector.redirect, 'spliced', None)
+        if size and spliced is not None:
+            spliced(size)
+
+    def _adapt_read_size(self, size):
+        if size == self.read_size:
+            self.read_size = min(self.read_size * 2,
+                                 self.redirector.max_buffer)
+        elif size < self.read_size // 4:
+            self.read_size = max(self.read_size // 2,
+                                 self.redirector.buffer)
+
+    def _frame(self, data):
+        """Returns the complete lines found in the partial buffer + *data*.
+
+        Whatever follows the last newline is kept for the next read, unless
+        it grows past **max_line_length**, in which case it is sent as is.
+        """
+        data = self._partial + data
+        eol = data.rfind(b'\n') + 1
+        self._partial = data[eol:]
+        data = data[:eol]
+
+        if len(self._partial) >= self.redirector.max_line_length:
+            data += self._partial
+            self._partial = b''
+        return data
+
+    def _send(self, data):
+        datamap = {'data': data, 'pid': self.process.pid,
+                   'wid': getattr(self.process, 'wid', None),
+                   'name': self.name}
+        datamap.update(self.redirector.extra_info)
+        self.redirector.redirect(datamap)
+        if self.redirector.recorder is not None:
+            self.redirector.recorder(datamap)
+
+    def flush(self):
+        """Sends the pending partial line, if any."""
+        if self._partial:
+            data, self._partial = self._partial, b''
+            self._send(data)
+        if self.suppressed:
+            self._send_marker()
 
 
 class Redirector(object):
     def __init__(self, redirect, extra_info=None,
-                 buffer=4096, loop=None):
+                 buffer=4096, loop=None, line_buffered=False,
+                 max_line_length=65536, max_buffer=65536,
+                 read_budget=262144, pipe_size=None, max_bytes_per_sec=0,
+                 max_lines_per_sec=0, rate_limit='drop', scheduler=None,
+                 group=None, weight=1):
+        if rate_limit not in ('drop', 'throttle'):
+            raise ValueError('rate_limit should be drop or throttle')
         self.running = False
         self.pipes = {}
         self._active = {}
         self.redirect = redirect
         self.extra_info = extra_info
         self.buffer = buffer
+        self.max_buffer = max(max_buffer, buffer)
+        self.read_budget = read_budget
+        self.pipe_size = pipe_size
+        self.line_buffered = line_buffered
+        self.max_line_length = max_line_length
+        # also called with the data sent to the stream, if set
+        self.recorder = None
+        self.max_bytes_per_sec = max_bytes_per_sec
+        self.max_lines_per_sec = max_lines_per_sec
+        self.rate_limit = rate_limit
+        self.rate_limited = bool(max_bytes_per_sec or max_lines_per_sec)
+        # called with the process, the stream name and the number of bytes
+        # dropped by the rate limits, if set
+        self.on_suppress = None
+        # when set, the pipes are read in turns with the pipes of the other
+        # redirectors of the scheduler, see OutputScheduler
+        self.scheduler = scheduler
+        self.group = group
+        self.weight = weight
         if extra_info is None:
             extra_info = {}
         self.extra_info = extra_info
@@ -63,8 +344,10 @@ class Redirector(object):
 
     def _stop_one(self, fd):
         if fd in self._active:
-            self.loop.remove_handler(fd)
-            del self._active[fd]
+            handler = self._active.pop(fd)
+            if not handler.paused:
+                self.loop.remove_handler(fd)
+            handler.flush()
 
     def stop(self):
         for fd in list(self._active.keys()):
@@ -74,6 +357,10 @@ class Redirector(object):
     def add_redirection(self, name, process, pipe):
         fd = pipe.fileno()
         self._stop_one(fd)
+        # the handler drains the pipe until it would block
+        set_nonblocking(fd)
+        if self.pipe_size:
+            set_pipe_size(fd, self.pipe_size)
         self.pipes[fd] = name, process, pipe
         if self.running:
             self._start_one(name, process, pipe)
@@ -0,0 +1,62 @@
+from collections import deque
+
+
+class OutputRing(object):
+    """Keeps the last **max_bytes** bytes of output in memory.
+
+    It is called like a stream, with mappings containing the **data**, the
+    **pid** of the process and the **name** of the stream. When full, the
+    oldest data is dropped.
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = deque()
+
+    def __call__(self, data):
+        chunk = data['data']
+        if len(chunk) > self.max_bytes:
+            chunk = chunk[-self.max_bytes:]
+        self._entries.append((data['pid'], data['name'], chunk))
+        self.size += len(chunk)
+
+        while self.size > self.max_bytes:
+            pid, name, old = self._entries.popleft()
+            excess = self.size - self.max_bytes
+            if len(old) > excess:
+                # keep the end of the oldest chunk
+                self._entries.appendleft((pid, name, old[excess:]))
+                self.size -= excess
+            else:
+                self.size -= len(old)
+
+    def lines(self, count=None, pid=None):
+        """Returns the last *count* lines, as (pid, name, line) tuples.
+
+        The chunks of each process and stream are joined back before being
+        split on end of lines. If *pid* is given, only the lines of this
+        process are returned.
+        """
+        partials = {}
+        lines = []
+        for entry_pid, name, chunk in self._entries:
+            if pid is not None and entry_pid != pid:
+                continue
+            key = entry_pid, name
+            parts = (partials.pop(key, b'') + chunk).split(b'\n')
+            if parts[-1]:
+                partials[key] = parts[-1]
+            for line in parts[:-1]:
+                lines.append((entry_pid, name, line))
+
+        # the lines still waiting for their end
+        for (entry_pid, name), line in partials.items():
+            lines.append((entry_pid, name, line))
+
+        if count:
+            return lines[-count:]
+        return lines
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
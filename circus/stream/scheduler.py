@@ -0,0 +1,78 @@
+from collections import deque
+
+from zmq.eventloop import ioloop
+
+
+class OutputScheduler(object):
+    """Reads the pipes of the redirectors of all the watchers in turns.
+
+    When a pipe is readable, it stops being polled and waits in the queue of
+    its group (its watcher). The groups are served in rounds: in each round,
+    every group with readable pipes reads up to **quantum** bytes times its
+    weight, one pipe after the other. A pipe that still has data goes back
+    in its queue, the others are polled again.
+
+    The loop handles its other events between two rounds, so a watcher
+    flooding its pipes can't delay the output of the others by more than
+    one round.
+    """
+    def __init__(self, loop=None, quantum=65536):
+        self.loop = loop or ioloop.IOLoop.instance()
+        self.quantum = quantum
+        self._queues = {}
+        # the groups with pipes waiting, in the order they are served
+        self._groups = deque()
+        self._scheduled = False
+
+    def _group(self, handler):
+        redirector = handler.redirector
+        if redirector.group is None:
+            return id(redirector)
+        return redirector.group
+
+    def ready(self, handler):
+        """Queues *handler*, whose pipe is readable."""
+        # no more events for this pipe until it's read
+        self.loop.update_handler(handler.fd, ioloop.IOLoop.ERROR)
+        group = self._group(handler)
+        if group not in self._queues:
+            self._queues[group] = deque()
+            self._groups.append(group)
+        self._queues[group].append(handler)
+        self._schedule()
+
+    def _schedule(self):
+        if not self._scheduled:
+            self._scheduled = True
+            self.loop.add_callback(self.run)
+
+    def _is_active(self, handler):
+        return handler.redirector._active.get(handler.fd) is handler
+
+    def run(self):
+        """Runs one round of reads."""
+        self._scheduled = False
+        for _ in range(len(self._groups)):
+            group = self._groups.popleft()
+            queue = self._queues[group]
+            budget = self.quantum * queue[0].redirector.weight
+            while queue and budget > 0:
+                handler = queue.popleft()
+                if not self._is_active(handler):
+                    # the redirection was stopped meanwhile
+                    continue
+                size, more = handler.read(min(budget,
+                                              handler.redirector.read_budget))
+                budget -= size
+                if more:
+                    queue.append(handler)
+                elif self._is_active(handler) and not handler.paused:
+                    self.loop.update_handler(handler.fd, ioloop.IOLoop.READ)
+
+            if queue:
+                self._groups.append(group)
+            else:
+                del self._queues[group]
+
+        if self._groups:
+            self._schedule()
@@ -0,0 +1,497 @@
+"""
+Offloads the processes output to the circusd-logger process.
+
+ * OutputShipper runs in circusd. It listens on a unix socket and sends the
+   pipes of the processes to the connected circusd-logger over SCM_RIGHTS,
+   along with the configuration of their stream.
+ * ShippedRedirector replaces the Redirector of a watcher: it registers the
+   pipes in the OutputShipper instead of reading them.
+ * CircusLogger runs in circusd-logger. It creates the streams and the
+   redirectors for the pipes it receives, and exits when its memory grows
+   past a limit. When the new circusd-logger connects, circusd sends it
+   all the pipes again.
+"""
+import argparse
+import array
+import errno
+import os
+import socket
+import struct
+import sys
+import time
+from collections import deque
+
+import psutil
+import zmq.utils.jsonapi as json
+from zmq.eventloop import ioloop
+
+from circus import logger
+from circus import __version__
+from circus.py3compat import b
+from circus.stream import get_stream
+from circus.stream.redirector import Redirector
+from circus.process import get_memory_info
+from circus.util import (configure_logger, bytes2human, human2bytes,
+                         ObjectDict)
+
+
+# streams that can't be moved to another process
+_LOCAL_STREAMS = ('QueueStream',)
+
+_HEADER = struct.Struct('!I')
+_FD_SIZE = array.array('i').itemsize
+_MAX_FDS = 16
+_RECV_SIZE = 65536
+
+
+def is_supported():
+    """Returns True if fds can be passed between processes."""
+    return hasattr(socket.socket, 'sendmsg')
+
+
+def pack_message(msg, fd=None):
+    """Returns the bytes of the *msg* mapping, which comes with a file
+    descriptor if *fd* is provided."""
+    if fd is not None:
+        msg = dict(msg, fd=True)
+    data = b(json.dumps(msg))
+    return _HEADER.pack(len(data)) + data
+
+
+def send_data(sock, data, fd=None):
+    """Sends *data* on *sock* once, with the *fd* file descriptor if
+    provided, and returns the number of bytes sent.
+
+    The file descriptor is sent along with the first byte."""
+    if fd is None:
+        return sock.send(data)
+    fds = array.array('i', [fd]).tobytes()
+    return sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+
+
+def send_message(sock, msg, fd=None):
+    """Sends the *msg* mapping on the blocking *sock*, with the *fd* file
+    descriptor if provided."""
+    data = pack_message(msg, fd)
+    sent = send_data(sock, data, fd)
+    if sent < len(data):
+        sock.sendall(data[sent:])
+
+
+class MessageReader(object):
+    """Reads the messages sent with :func:`send_message`.
+
+    The file descriptor of a message, if any, is put in its *fd* key.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self._buffer = b''
+        self._fds = []
+
+    def read(self):
+        """Returns the list of the messages received, or None when the
+        other side closed the connection."""
+        data, ancdata, flags, addr = self.sock.recvmsg(
+            _RECV_SIZE, socket.CMSG_SPACE(_MAX_FDS * _FD_SIZE))
+
+        for level, kind, cdata in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds = array.array('i')
+                fds.frombytes(cdata[:len(cdata) - len(cdata) % _FD_SIZE])
+                self._fds.extend(fds)
+
+        if not data:
+            return None
+
+        self._buffer += data
+        messages = []
+        while len(self._buffer) >= _HEADER.size:
+            size = _HEADER.unpack(self._buffer[:_HEADER.size])[0]
+            end = _HEADER.size + size
+            if len(self._buffer) < end:
+                break
+            msg = json.loads(self._buffer[_HEADER.size:end])
+            self._buffer = self._buffer[end:]
+            if msg.get('fd'):
+                msg['fd'] = self._fds.pop(0)
+            messages.append(msg)
+        return messages
+
+
+class ShippedRedirector(object):
+    """Stands for the Redirector of a watcher stream whose output is
+    handled by circusd-logger."""
+
+    def __init__(self, shipper, watcher, name):
+        self.shipper = shipper
+        self.watcher = watcher
+        self.name = name
+        self._redirect = None
+        self.running = False
+
+    @property
+    def conf(self):
+        return getattr(self.watcher, '%s_stream_conf' % self.name)
+
+    @property
+    def redirect(self):
+        return self._redirect
+
+    @redirect.setter
+    def redirect(self, stream):
+        # the stream was reloaded, circusd-logger has to follow
+        self._redirect = stream
+        self.shipper.update(self)
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def add_redirection(self, name, process, pipe):
+        self.shipper.add_pipe(self, process, pipe)
+
+    def remove_redirection(self, pipe):
+        self.shipper.remove_pipe(pipe)
+
+
+class OutputShipper(object):
+    """Sends the pipes of the processes to circusd-logger.
+
+    Options:
+
+    - **endpoint**: the path of the unix socket circusd-logger connects to.
+    - **loop**: the ioloop to use. If not provided will use the
+      global IOLoop
+    """
+    def __init__(self, endpoint, loop=None):
+        self.endpoint = endpoint
+        self.loop = loop or ioloop.IOLoop.instance()
+        self.sock = self.conn = None
+        self.pipes = {}
+        # the (data, fd) not sent yet to circusd-logger. The fds are
+        # duplicated so they stay valid until sent
+        self._outgoing = deque()
+
+    def accepts(self, watcher, conf):
+        """Returns True if the stream configured by *conf* can run in
+        circusd-logger."""
+        if not conf or watcher.is_internal:
+            return False
+        if 'class' in conf:
+            return conf['class'] not in _LOCAL_STREAMS
+        return 'filename' in conf
+
+    def get_redirector(self, watcher, name):
+        return ShippedRedirector(self, watcher, name)
+
+    def start(self):
+        if os.path.exists(self.endpoint):
+            os.remove(self.endpoint)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.endpoint)
+        self.sock.listen(1)
+        self.sock.setblocking(0)
+        self.loop.add_handler(self.sock.fileno(), self._accept,
+                              ioloop.IOLoop.READ)
+
+    def stop(self):
+        self._disconnect()
+        if self.sock is not None:
+            self.loop.remove_handler(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.endpoint):
+                os.remove(self.endpoint)
+
+    def _accept(self, fd, events):
+        try:
+            conn, addr = self.sock.accept()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+
+        # a new circusd-logger replaces the previous one
+        self._disconnect()
+        logger.info('circusd-logger connected, sending %d pipes',
+                    len(self.pipes))
+        self.conn = conn
+        self.conn.setblocking(0)
+        self.loop.add_handler(self.conn.fileno(), self._handle_conn,
+                              ioloop.IOLoop.READ)
+        for fd in list(self.pipes.keys()):
+            self._send_pipe(fd)
+
+    def _handle_conn(self, fd, events):
+        if events & ioloop.IOLoop.WRITE:
+            self._flush()
+        if self.conn is not None and events & ~ioloop.IOLoop.WRITE:
+            # circusd-logger never talks, this is a disconnection
+            self._disconnect()
+
+    def _disconnect(self):
+        while self._outgoing:
+            data, fd = self._outgoing.popleft()
+            if fd is not None:
+                os.close(fd)
+        if self.conn is not None:
+            self.loop.remove_handler(self.conn.fileno())
+            self.conn.close()
+            self.conn = None
+
+    def _send(self, msg, fd=None):
+        if self.conn is None:
+            return
+        if fd is not None:
+            fd = os.dup(fd)
+        self._outgoing.append((pack_message(msg, fd), fd))
+        if len(self._outgoing) == 1:
+            self._flush()
+
+    def _flush(self):
+        """Sends the pending messages until the socket is full, then waits
+        for it to be writable again."""
+        while self._outgoing:
+            data, fd = self._outgoing[0]
+            try:
+                sent = send_data(self.conn, data, fd)
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK,
+                                 errno.EINTR):
+                    break
+                logger.warning('Could not send to circusd-logger: %s', e)
+                self._disconnect()
+                return
+
+            if fd is not None:
+                # circusd-logger got its own copy
+                os.close(fd)
+            if sent < len(data):
+                self._outgoing[0] = data[sent:], None
+                break
+            self._outgoing.popleft()
+
+        events = ioloop.IOLoop.READ
+        if self._outgoing:
+            events |= ioloop.IOLoop.WRITE
+        self.loop.update_handler(self.conn.fileno(), events)
+
+    def _send_pipe(self, fd):
+        redirector, process, pipe = self.pipes[fd]
+        msg = {'watcher': redirector.watcher.name, 'name': redirector.name,
+               'pid': process.pid, 'wid': getattr(process, 'wid', None),
+               'conf': redirector.conf}
+        self._send(msg, fd)
+
+    def update(self, redirector):
+        msg = {'watcher': redirector.watcher.name, 'name': redirector.name,
+               'conf': redirector.conf}
+        self._send(msg)
+
+    def add_pipe(self, redirector, process, pipe):
+        fd = pipe.fileno()
+        self.pipes[fd] = redirector, process, pipe
+        self._send_pipe(fd)
+
+    def remove_pipe(self, pipe):
+        try:
+            fd = pipe.fileno()
+        except ValueError:
+            return
+        # circusd-logger closes its copy when the process exits
+        self.pipes.pop(fd, None)
+
+
+class _LoggerRedirector(Redirector):
+    # the pipes only live in this process, close them once done
+    def remove_redirection(self, pipe):
+        super(_LoggerRedirector, self).remove_redirection(pipe)
+        pipe.close()
+
+
+class _Pipe(object):
+    def __init__(self, fd):
+        self.fd = fd
+
+    def fileno(self):
+        if self.fd is None:
+            raise ValueError('closed pipe')
+        return self.fd
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class CircusLogger(object):
+    """Runs the streams of the processes output, in circusd-logger.
+
+    Options:
+
+    - **endpoint**: the path of the unix socket of circusd.
+    - **max_mem**: if the memory used by the process gets over that many
+      bytes, it exits so circusd respawns a fresh one. (default: None)
+    - **check_delay**: the delay in seconds between two memory checks.
+    - **loop**: the ioloop to use. If not provided will use the
+      global IOLoop
+    """
+    def __init__(self, endpoint, max_mem=None, check_delay=5., loop=None):
+        self.endpoint = endpoint
+        self.max_mem = max_mem
+        self.loop = loop or ioloop.IOLoop.instance()
+        self.sock = self.reader = None
+        self._process = psutil.Process(os.getpid())
+        # (watcher, name) -> (serialized conf, redirector)
+        self.redirectors = {}
+        self._check = ioloop.PeriodicCallback(self.check_memory,
+                                              check_delay * 1000,
+                                              io_loop=self.loop)
+
+    def connect(self, timeout=10.):
+        deadline = time.time() + timeout
+        while True:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                self.sock.connect(self.endpoint)
+                break
+            except socket.error:
+                self.sock.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(.1)
+        self.reader = MessageReader(self.sock)
+        self.loop.add_handler(self.sock.fileno(), self.handle_recv,
+                              ioloop.IOLoop.READ)
+
+    def start(self):
+        self.connect()
+        if self.max_mem:
+            self._check.start()
+        logger.info('circusd-logger started')
+        self.loop.start()
+
+    def stop(self):
+        self._check.stop()
+        for key, (conf, redirector) in list(self.redirectors.items()):
+            redirector.stop()
+            self._close_stream(redirector.redirect)
+        self.redirectors.clear()
+        if self.sock is not None:
+            self.loop.remove_handler(self.sock.fileno())
+            self.sock.close()
+            self.sock = None
+        self.loop.stop()
+
+    def _close_stream(self, stream):
+        if hasattr(stream, 'close'):
+            stream.close()
+
+    def handle_recv(self, fd, events):
+        try:
+            messages = self.reader.read()
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EINTR):
+                return
+            raise
+
+        if messages is None:
+            logger.info('circusd closed the connection')
+            self.stop()
+            return
+
+        for msg in messages:
+            try:
+                self.add_pipe(msg)
+            except Exception:
+                logger.exception('Could not redirect %r', msg)
+                if msg.get('fd'):
+                    os.close(msg['fd'])
+
+    def get_redirector(self, watcher, name, conf):
+        key = watcher, name
+        serialized = json.dumps(conf, sort_keys=True)
+        if key in self.redirectors:
+            old_conf, redirector = self.redirectors[key]
+            if old_conf == serialized:
+                return redirector
+            # the stream was reconfigured in circusd
+            old_stream = redirector.redirect
+            redirector.redirect = get_stream(conf, reload=True)['stream']
+            self._close_stream(old_stream)
+        else:
+            stream = get_stream(conf)
+            redirector = _LoggerRedirector(
+                stream['stream'], {'watcher': watcher}, buffer=1024,
+                loop=self.loop,
+                line_buffered=stream.get('line_buffered', False),
+                max_line_length=stream.get('max_line_length', 65536),
+                max_buffer=stream.get('max_buffer', 65536),
+                read_budget=stream.get('read_budget', 262144),
+                max_bytes_per_sec=stream.get('max_bytes_per_sec', 0),
+                max_lines_per_sec=stream.get('max_lines_per_sec', 0),
+                rate_limit=stream.get('rate_limit', 'drop'))
+            redirector.start()
+        self.redirectors[key] = serialized, redirector
+        return redirector
+
+    def add_pipe(self, msg):
+        redirector = self.get_redirector(msg['watcher'], msg['name'],
+                                         msg['conf'])
+        if 'fd' not in msg:
+            # only an update of the stream configuration
+            return
+        process = ObjectDict(pid=msg['pid'], wid=msg['wid'])
+        redirector.add_redirection(msg['name'], process, _Pipe(msg['fd']))
+
+    def check_memory(self):
+        mem = get_memory_info(self._process)[0]
+        if mem > self.max_mem:
+            logger.info('circusd-logger uses %s, exiting to be respawned',
+                        bytes2human(mem))
+            self.stop()
+
+
+def main():
+    desc = 'Runs the streams of the processes output for Circus'
+    parser = argparse.ArgumentParser(description=desc)
+
+    parser.add_argument('--endpoint', required=True,
+                        help='The circusd unix socket to connect to')
+
+    parser.add_argument('--max-mem', dest='max_mem', default=None,
+                        help='Exit when the memory used gets over this '
+                             'value (e.g. 200M)')
+
+    parser.add_argument('--log-level', dest='loglevel', default='info',
+                        help="log level")
+
+    parser.add_argument('--log-output', dest='logoutput', default='-',
+                        help="log output")
+
+    parser.add_argument('--version', action='store_true',
+                        default=False,
+                        help='Displays Circus version and exits.')
+
+    args = parser.parse_args()
+
+    if args.version:
+        print(__version__)
+        sys.exit(0)
+
+    # configure the logger
+    configure_logger(logger, args.loglevel, args.logoutput)
+
+    max_mem = args.max_mem and human2bytes(args.max_mem) or None
+    circus_logger = CircusLogger(args.endpoint, max_mem=max_mem)
+    try:
+        circus_logger.start()
+    finally:
+        circus_logger.stop()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
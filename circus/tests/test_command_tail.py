@@ -0,0 +1,71 @@
+from circus.tests.support import TestCircus, EasyTestSuite
+from circus.commands.tail import Tail, MessageError
+
+
+_LINES = [{'pid': 12, 'name': 'stdout', 'line': 'foo'},
+          {'pid': 13, 'name': 'stderr', 'line': 'bar'}]
+
+
+class FakeWatcher(object):
+    name = 'one'
+    follow_output = True
+
+    def tail(self, count=10, pid=None):
+        if pid == 'meh':
+            raise KeyError('meh')
+        if pid == 'nope':
+            raise ValueError('no output is kept')
+        return _LINES[-count:]
+
+
+class FakeArbiter(object):
+    pubsub_endpoint = 'tcp://127.0.0.1:5556'
+
+    def get_watcher(self, name):
+        return FakeWatcher()
+
+
+class TailCommandTest(TestCircus):
+
+    def test_message(self):
+        cmd = Tail()
+        msg = cmd.message('one', '12', lines='200')
+        self.assertEqual(msg['properties'],
+                         {'name': 'one', 'process': 12, 'lines': 200})
+
+    def test_console_msg(self):
+        cmd = Tail()
+        res = cmd.console_msg({'status': 'ok', 'lines': _LINES})
+        self.assertEqual(res, '12 stdout | foo\n13 stderr | bar')
+
+    def test_console_event(self):
+        cmd = Tail()
+        msg = cmd.message('One', '12')
+        self.assertEqual(cmd.follow_topics(msg), ['watcher.one.output'])
+
+        event = {'process_pid': 12, 'name': 'stdout', 'data': 'a\nb\n'}
+        self.assertEqual(cmd.console_event(msg, event),
+                         '12 stdout | a\n12 stdout | b')
+
+        # only the output of the process asked for
+        event['process_pid'] = 13
+        self.assertEqual(cmd.console_event(msg, event), None)
+
+    def test_execute(self):
+        cmd = Tail()
+        arbiter = FakeArbiter()
+        res = cmd.execute(arbiter, {'name': 'one', 'lines': 1})
+        self.assertEqual(res['lines'], _LINES[-1:])
+        self.assertEqual(res['pubsub_endpoint'], arbiter.pubsub_endpoint)
+
+        # the output can't be followed
+        FakeWatcher.follow_output = False
+        self.addCleanup(setattr, FakeWatcher, 'follow_output', True)
+        res = cmd.execute(arbiter, {'name': 'one'})
+        self.assertFalse('pubsub_endpoint' in res)
+
+        for pid in ('meh', 'nope'):
+            props = {'name': 'one', 'process': pid}
+            self.assertRaises(MessageError, cmd.execute, arbiter, props)
+
+test_suite = EasyTestSuite(__name__)
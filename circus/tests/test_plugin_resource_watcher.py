@@ -1,5 +1,7 @@
 import warnings
 
+import mock
+
 from tornado.testing import gen_test
 
 from circus.tests.support import TestCircus, async_poll_for, Process
@@ -58,6 +60,26 @@ class TestResourceWatcher(TestCircus):
         self.assertRaises(NotImplementedError, self.make_plugin,
                           ResourceWatcher)
 
+    def test_mem_accounting(self):
+        plugin = self.make_plugin(ResourceWatcher, watcher='test',
+                                  mem_accounting='pss')
+        plugin.memory = mock.Mock()
+        plugin.memory.get_bytes = lambda pid: 1024 if pid == 1 else None
+        plugin.memory.get_percent = lambda value: 1.
+        plugin.call = lambda *args, **kw: {
+            'status': 'ok',
+            'info': {'1': {'cpu': 1., 'mem': 20., 'mem_info1': '2M'},
+                     '2': {'cpu': 1., 'mem': 10., 'mem_info1': '1M'}}}
+
+        stats = plugin.collect_stats()
+        self.assertEqual(stats['1']['mem_abs'], 1024)
+        self.assertEqual(stats['1']['mem'], 1.)
+        self.assertEqual(stats['2']['mem_abs'], 1024 * 1024)
+        self.assertEqual(stats['test']['mem'], 11.)
+
+        self.assertRaises(ValueError, self.make_plugin, ResourceWatcher,
+                          watcher='test', mem_accounting='vms')
+
     @gen_test
     def test_resource_watcher_max_mem(self):
         yield self.start_arbiter(fqn)
@@ -176,4 +176,26 @@ class TestProcess(TestCircus):
         finally:
             process.stop()
 
+    @skipIf(DEBUG, 'Py_DEBUG=1')
+    def test_streams_to_fd(self):
+        script_file = self.get_tmpfile(VERBOSE)
+        output_file = self.get_tmpfile()
+        stdout_file = self.get_tmpfile()
+
+        cmd = sys.executable
+        args = [script_file, output_file]
+
+        with open(stdout_file, 'a') as f:
+            process = Process('test', cmd, args=args, stdout_fd=f.fileno())
+        try:
+            poll_for(output_file, 'END')
+
+            # stdout went to the file, stderr still has its pipe
+            self.assertTrue(process.stdout is None)
+            self.assertEqual(len(process.stderr.read()), 2890)
+            with open(stdout_file) as f:
+                self.assertEqual(len(f.read()), 2890)
+        finally:
+            process.stop()
+
 test_suite = EasyTestSuite(__name__)
@@ -2,9 +2,11 @@ import time
 import tempfile
 import os
 import sys
+import mock
 import tornado
+import zmq.utils.jsonapi as json
 
-from circus.tests.support import TestCircus, EasyTestSuite
+from circus.tests.support import TestCircus, TestCase, EasyTestSuite
 from circus.client import AsyncCircusClient
 from circus.stream import FileStream
 from circus.py3compat import get_next
@@ -84,4 +86,57 @@ class TestStatsClient(TestCircus):
                             watcher)
         yield self.stop_arbiter()
 
+
+class TestStatsClientBatches(TestCase):
+
+    def test_batches(self):
+        from circus.stats.client import StatsClient
+        messages = [
+            [b'stat.foo.1', json.dumps({'cpu': 1})],
+            [b'stats.foo', json.dumps([{'subtopic': 2, 'cpu': 2},
+                                       {'cpu': 2}])],
+            [b'stats', json.dumps({'bar': [{'subtopic': 3, 'cpu': 3}]})]]
+
+        client = StatsClient()
+        client.poller = mock.MagicMock()
+        client.poller.poll.return_value = [(client.pubsub_socket, 1)]
+        client.pubsub_socket = mock.MagicMock()
+        client.pubsub_socket.recv_multipart.side_effect = messages
+        next = get_next(client.iter_messages())
+
+        self.assertEqual(next(), ('foo', '1', {'cpu': 1}))
+        self.assertEqual(next(), ('foo', '2', {'subtopic': 2, 'cpu': 2}))
+        self.assertEqual(next(), ('foo', None, {'cpu': 2}))
+        self.assertEqual(next(), ('bar', '3', {'subtopic': 3, 'cpu': 3}))
+
+    def test_deltas(self):
+        from circus.stats.client import StatsClient
+        messages = [
+            # a delta without a keyframe yet
+            [b'stat.foo.1', json.dumps({'cpu': 2, 'delta': []})],
+            [b'stat.foo.1', json.dumps({'cpu': 1, 'mem': 1, 'name': 'x'})],
+            [b'stat.foo.2', json.dumps({'cpu': 1})],
+            [b'stat.foo', json.dumps({'cpu': 1, 'pid': [1, 2]})],
+            [b'stats.foo', json.dumps([
+                {'subtopic': 1, 'cpu': 2, 'delta': ['name']},
+                {'pid': [1], 'delta': []}])]]
+
+        client = StatsClient()
+        client.poller = mock.MagicMock()
+        client.poller.poll.return_value = [(client.pubsub_socket, 1)]
+        client.pubsub_socket = mock.MagicMock()
+        client.pubsub_socket.recv_multipart.side_effect = messages
+        next = get_next(client.iter_messages())
+
+        self.assertEqual(next(), ('foo', '1', {'cpu': 1, 'mem': 1,
+                                               'name': 'x'}))
+        self.assertEqual(next(), ('foo', '2', {'cpu': 1}))
+        self.assertEqual(next(), ('foo', None, {'cpu': 1, 'pid': [1, 2]}))
+        self.assertEqual(next(), ('foo', '1', {'subtopic': 1, 'cpu': 2,
+                                               'mem': 1}))
+        self.assertEqual(next(), ('foo', None, {'cpu': 1, 'pid': [1]}))
+
+        # the process 2 is gone, so is its stat
+        self.assertEqual(set(client._state['foo']), set([None, '1']))
+
 test_suite = EasyTestSuite(__name__)
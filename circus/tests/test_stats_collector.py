@@ -1,4 +1,6 @@
+import os
 import socket
+import tempfile
 import time
 from collections import defaultdict
 from circus.fixed_threading import Thread
@@ -6,7 +8,9 @@ from circus.fixed_threading import Thread
 from zmq.eventloop import ioloop
 
 from circus.stats import collector as collector_module
-from circus.stats.collector import SocketStatsCollector, WatcherStatsCollector
+from circus.stats.collector import (SocketStatsCollector,
+                                    WatcherStatsCollector,
+                                    WatchersStatsCollector)
 from circus.tests.support import TestCase, EasyTestSuite
 
 
@@ -32,6 +36,7 @@ class TestCollector(TestCase):
 
         class FakeStreamer(object):
             stats = []
+            suppressed = {2354: 12}
 
             def __init__(this):
                 this.sockets = self.socks
@@ -41,7 +46,10 @@ class TestCollector(TestCase):
                 return self.circus_pids
 
             def get_pids(this, name):
-                return self.pids[name]
+                return self.pids.get(name, [])
+
+            def get_watchers(this):
+                return [name for name in self.pids if name != 'circus']
 
             @property
             def publisher(this):
@@ -50,6 +58,10 @@ class TestCollector(TestCase):
             def publish(this, name, stat):
                 this.stats.append(stat)
 
+            def publish_many(this, stats):
+                for name, stat in stats:
+                    this.publish(name, stat)
+
         self.streamer = FakeStreamer()
         return self.streamer
 
@@ -112,6 +124,9 @@ class TestCollector(TestCase):
 
             stats = list(collector.collect_stats())
             self.assertEqual(len(stats), 3)
+            # the output dropped by the rate limits
+            self.assertEqual([stat.get('suppressed') for stat in stats],
+                             [None, 12, 12])
 
             stats = list(collector.collect_stats())
             self.assertEqual(len(stats), 3)
@@ -128,6 +143,116 @@ class TestCollector(TestCase):
         finally:
             collector_module.util.get_info = old_info
 
+    def test_watchersstats(self):
+        def _get_info(pid):
+            if pid == 2355:
+                raise collector_module.util.NoSuchProcess(pid)
+            return {'age': 10., 'cpu': 1., 'mem': 2., 'pid': pid}
+
+        old_info = collector_module.util.get_info
+        try:
+            collector_module.util.get_info = _get_info
+
+            self.pids['firefox'] = [2353, 2354]
+            self.pids['chrome'] = [2355]
+            self.pids['opera'] = []
+            self.pids['circus'] = [1234]
+            self.circus_pids = {1234: 'circusd'}
+            collector = WatchersStatsCollector(self._get_streamer())
+            stats = list(collector.collect_stats())
+        finally:
+            collector_module.util.get_info = old_info
+
+        # all the watchers in one pass, the ones without processes skipped
+        names = [name for name, stat in stats]
+        self.assertEqual(sorted(set(names)), ['chrome', 'circus', 'firefox'])
+        self.assertEqual(names.count('firefox'), 3)
+
+        firefox = [stat for name, stat in stats if name == 'firefox']
+        self.assertEqual([stat.get('subtopic') for stat in firefox],
+                         [2353, 2354, None])
+        self.assertEqual(firefox[1]['suppressed'], 12)
+        self.assertEqual(sorted(firefox[2]['pid']), [2353, 2354])
+        self.assertEqual(firefox[2]['mem'], 4.)
+
+        # the processes of chrome are gone
+        self.assertEqual([stat for name, stat in stats if name == 'chrome'],
+                         [{'pid': [], 'cpu': 0., 'mem': 0, 'age': 'N/A',
+                           'suppressed': 0}])
+
+        circus = [stat for name, stat in stats if name == 'circus']
+        self.assertEqual(circus[0]['name'], 'circusd')
+
+    def test_watchersstats_process_tree(self):
+        class FakeTree(object):
+            total_mem = 1000
+            scans = 0
+
+            def scan(this):
+                this.scans += 1
+                return True
+
+            def get_stats(this, pids, memory=None):
+                return {'cpu': 30., 'mem': 250, 'processes': 6}
+
+        old_info = collector_module.util.get_info
+        try:
+            collector_module.util.get_info = lambda pid: {
+                'age': 10., 'cpu': 1., 'mem': 2., 'pid': pid}
+            self.pids['uwsgi'] = [2353, 2354]
+            self.pids['circus'] = [1234]
+            self.circus_pids = {1234: 'circusd'}
+            streamer = self._get_streamer()
+            streamer.process_tree = tree = FakeTree()
+            stats = list(WatchersStatsCollector(streamer).collect_stats())
+        finally:
+            collector_module.util.get_info = old_info
+
+        self.assertEqual(tree.scans, 1)
+        uwsgi = [stat for name, stat in stats if name == 'uwsgi']
+        # the processes are unchanged, the aggregate covers the trees
+        self.assertEqual(uwsgi[0]['cpu'], 1.)
+        self.assertEqual(uwsgi[2]['cpu'], 15.)
+        self.assertEqual(uwsgi[2]['mem'], 25.)
+        self.assertEqual(uwsgi[2]['processes'], 6)
+
+        circus = [stat for name, stat in stats if name == 'circus']
+        self.assertFalse('processes' in circus[-1])
+
+    def test_watchersstats_memory(self):
+        class FakeMemory(object):
+            mode = 'pss'
+
+            def get(this, pid):
+                if pid == 2354:
+                    return None
+                return {'rss': 300, 'pss': 100, 'uss': 50}
+
+            def get_percent(this, value):
+                return value / 10.
+
+        old_info = collector_module.util.get_info
+        try:
+            collector_module.util.get_info = lambda pid: {
+                'age': 10., 'cpu': 1., 'mem': 30., 'pid': pid}
+            self.pids['uwsgi'] = [2353, 2355, 2354]
+            streamer = self._get_streamer()
+            streamer.memory = FakeMemory()
+            stats = list(WatchersStatsCollector(streamer).collect_stats())
+        finally:
+            collector_module.util.get_info = old_info
+
+        self.assertEqual(stats[0][1]['mem'], 10.)
+        self.assertEqual(stats[0][1]['pss'], 100)
+        # smaps_rollup can't be read, the RSS stays
+        self.assertEqual(stats[2][1]['mem'], 30.)
+        self.assertFalse('pss' in stats[2][1])
+
+        aggregate = stats[3][1]
+        self.assertEqual(aggregate['mem'], 50.)
+        self.assertEqual(aggregate['pss'], 200)
+        self.assertEqual(aggregate['uss'], 100)
+
     def test_collector_aggregation(self):
         collector = WatcherStatsCollector(self._get_streamer(), 'firefox')
         aggregate = {}
@@ -168,12 +293,6 @@ class TestCollector(TestCase):
         collector.start()
         time.sleep(1.)
 
-        # doing some socket things as a client
-        for i in range(10):
-            for client in self.clients:
-                client.send(b'ok')
-                #client.recv(2)
-
         # stopping
         collector.stop()
         for s, _, _ in self.socks:
@@ -184,6 +303,71 @@ class TestCollector(TestCase):
 
         stat = self.streamer.stats[0]
         self.assertTrue(stat['fd'] in self.fds)
-        self.assertTrue(stat['reads'] > 1)
+        # the connection of each client waits to be accepted
+        self.assertEqual(stat['queued'], 1)
+        total = self.streamer.stats[10]
+        self.assertEqual(total['queued'], 10)
+        self.assertEqual(len(total['addresses']), 10)
+        self.assertTrue('host_passive_opens' in total)
+        self.assertTrue('host_listen_overflows' in total)
+        self.assertFalse('reads' in total)
+
+    def test_get_queue(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('localhost', 0))
+        sock.listen(5)
+        clients = []
+        try:
+            self.assertEqual(collector_module.get_queue(sock)[0], 0)
+            for i in range(3):
+                client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                client.connect(sock.getsockname())
+                clients.append(client)
+            time.sleep(.1)
+            queued, backlog = collector_module.get_queue(sock)
+            if backlog is None:
+                # no TCP_INFO
+                self.assertEqual(queued, 1)
+            else:
+                self.assertEqual(queued, 3)
+                self.assertEqual(backlog, 5)
+
+            sock.accept()[0].close()
+            if backlog is not None:
+                self.assertEqual(collector_module.get_queue(sock)[0], 2)
+        finally:
+            for client in clients:
+                client.close()
+            sock.close()
+
+    def test_read_counters(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            with open(path, 'w') as f:
+                f.write('Ip: Forwarding DefaultTTL\n'
+                        'Ip: 1 64\n'
+                        'Tcp: RtoAlgorithm PassiveOpens\n'
+                        'Tcp: 1 42\n')
+            self.assertEqual(collector_module._read_counters(path, 'Tcp:'),
+                             {'RtoAlgorithm': 1, 'PassiveOpens': 42})
+            self.assertEqual(collector_module._read_counters(path, 'Udp:'),
+                             {})
+        finally:
+            os.remove(path)
+        self.assertEqual(collector_module._read_counters(path, 'Tcp:'), {})
+
+    def test_socketstats_deltas(self):
+        counters = [(10, 1), (15, 1), None]
+        old = collector_module.get_tcp_counters
+        collector_module.get_tcp_counters = lambda: counters.pop(0)
+        try:
+            collector = SocketStatsCollector(self._get_streamer(), 'sockets')
+            self.assertEqual(collector._get_deltas(), (5, 0))
+            self.assertEqual(collector._get_deltas(), ('N/A', 'N/A'))
+        finally:
+            collector_module.get_tcp_counters = old
+            for s, _, _ in self.socks:
+                s.close()
 
 test_suite = EasyTestSuite(__name__)
@@ -0,0 +1,120 @@
+import mock
+import zmq.utils.jsonapi as json
+
+from circus.tests.support import TestCase, EasyTestSuite
+from circus.stats.history import Ring, StatsHistory
+from circus.stats.streamer import StatsStreamer
+
+
+class TestRing(TestCase):
+
+    def test_average(self):
+        ring = Ring(10, 3, fields=('cpu', 'mem'))
+        ring.add({'cpu': 1., 'mem': 'N/A'}, 100)
+        ring.add({'cpu': 2., 'mem': 4.}, 105)
+        ring.add({'cpu': 6.}, 112)
+        res = ring.get_range(100, 120, ['cpu', 'mem'])
+        self.assertEqual(res, {'step': 10, 'times': [100., 110.],
+                               'cpu': [1.5, 6.], 'mem': [4., None]})
+
+    def test_wrap(self):
+        ring = Ring(1, 3, fields=('cpu',))
+        for when in range(100, 105):
+            ring.add({'cpu': when}, when)
+        # only the last 3 seconds are kept
+        res = ring.get_range(0, 104, ['cpu'])
+        self.assertEqual(res['times'], [102., 103., 104.])
+        self.assertEqual(res['cpu'], [102., 103., 104.])
+
+        res = ring.get_range(103, 110, ['cpu'])
+        self.assertEqual(res['times'], [103., 104.])
+
+
+class TestStatsHistory(TestCase):
+
+    def _get_history(self, now):
+        history = StatsHistory(tiers=((1, 60), (10, 60)))
+        for when in range(now - 100, now):
+            history.add_many([('foo', {'subtopic': 1, 'cpu': 1.}),
+                              ('foo', {'cpu': 2., 'pid': [1]})], when)
+        return history
+
+    @mock.patch('time.time', lambda: 10000.)
+    def test_query(self):
+        history = self._get_history(10000)
+
+        res = history.query('foo', start=9990, end=9995)
+        self.assertEqual(res['step'], 1)
+        self.assertEqual(res['times'], [9990., 9991., 9992., 9993., 9994.,
+                                        9995.])
+        self.assertEqual(set(res['cpu']), set([2.]))
+
+        # too old for the first tier
+        res = history.query('foo', start=9900, end=9920)
+        self.assertEqual(res['step'], 10)
+        self.assertEqual(res['times'], [9900., 9910., 9920.])
+
+        res = history.query('foo', start=9990, end=9995, step=5,
+                            fields=['cpu'])
+        self.assertEqual(res['step'], 10)
+        self.assertEqual(sorted(res), ['cpu', 'step', 'times'])
+
+        # the processes only get the first tier
+        res = history.query('foo', subtopic='1', start=9900, end=9920)
+        self.assertEqual(res['step'], 1)
+        self.assertEqual(res['times'], [])
+
+        self.assertRaises(KeyError, history.query, 'bar')
+        self.assertRaises(ValueError, history.query, 'foo', fields=['age'])
+
+    @mock.patch('time.time', lambda: 10000.)
+    def test_forget(self):
+        history = self._get_history(10000)
+        history.forget('foo', 1)
+        self.assertRaises(KeyError, history.query, 'foo', subtopic=1)
+        history.query('foo')
+        history.forget('foo')
+        self.assertRaises(KeyError, history.query, 'foo')
+
+
+class FakeStreamer(StatsStreamer):
+    def __init__(self, *args, **kwargs):
+        self._initialize()
+        self.history = StatsHistory()
+        self.history_stream = mock.MagicMock()
+
+
+class TestHistoryQueries(TestCase):
+
+    def _query(self, streamer, props):
+        msg = json.dumps({'id': 'abc', 'command': 'history',
+                          'properties': props})
+        streamer.handle_history([b'client', msg])
+        cid, resp = streamer.history_stream.send_multipart.call_args[0][0]
+        self.assertEqual(cid, b'client')
+        resp = json.loads(resp)
+        self.assertEqual(resp['id'], 'abc')
+        return resp
+
+    def test_handle_history(self):
+        streamer = FakeStreamer()
+        streamer.history.add_many([('foo', {'cpu': 2., 'pid': [1]})])
+
+        resp = self._query(streamer, {'name': 'foo', 'fields': ['cpu']})
+        self.assertEqual(resp['status'], 'ok')
+        self.assertEqual(resp['cpu'], [2.])
+
+        resp = self._query(streamer, {'name': 'bar'})
+        self.assertEqual(resp['status'], 'error')
+
+        resp = self._query(streamer, {'name': 'foo', 'start': 'yesterday'})
+        self.assertEqual(resp['status'], 'error')
+
+    def test_remove_pid(self):
+        streamer = FakeStreamer()
+        streamer._pids['foo'] = [1]
+        streamer.history.add_many([('foo', {'subtopic': 1, 'cpu': 2.})])
+        streamer.remove_pid('foo', 1)
+        self.assertRaises(KeyError, streamer.history.query, 'foo', 1)
+
+test_suite = EasyTestSuite(__name__)
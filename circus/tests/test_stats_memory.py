@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+import mock
+
+from circus.tests.support import TestCase, EasyTestSuite
+from circus.stats.memory import (MemoryAccounting, read_smaps,
+                                 get_total_mem)
+
+
+_ROLLUP = """\
+00400000-7ffc2b5f6000 ---p 00000000 00:00 0                  [rollup]
+Rss:                 400 kB
+Pss:                 150 kB
+Shared_Clean:        300 kB
+Shared_Dirty:          0 kB
+Private_Clean:        40 kB
+Private_Dirty:        60 kB
+Referenced:          400 kB
+Swap:                  0 kB
+SwapPss:               0 kB
+"""
+
+_SMAPS = """\
+00400000-00452000 r-xp 00000000 08:02 173521      /usr/bin/dbus-daemon
+Size:                328 kB
+Rss:                 300 kB
+Pss:                 100 kB
+Private_Clean:        10 kB
+Private_Dirty:         0 kB
+VmFlags: rd ex mr mw me dw
+00651000-00652000 rw-p 00051000 08:02 173521      /usr/bin/dbus-daemon
+Size:                  4 kB
+Rss:                 100 kB
+Pss:                  50 kB
+Private_Clean:         0 kB
+Private_Dirty:        90 kB
+VmFlags: rd wr mr mw me dw ac
+"""
+
+
+class TestMemoryAccounting(TestCase):
+
+    def setUp(self):
+        super(TestMemoryAccounting, self).setUp()
+        self.proc = tempfile.mkdtemp()
+        with open(os.path.join(self.proc, 'meminfo'), 'w') as f:
+            f.write('MemTotal:        1000 kB\nMemFree:         500 kB\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+        super(TestMemoryAccounting, self).tearDown()
+
+    def _add(self, pid, name, data):
+        path = os.path.join(self.proc, str(pid))
+        if not os.path.exists(path):
+            os.mkdir(path)
+        with open(os.path.join(path, name), 'w') as f:
+            f.write(data)
+
+    def test_read_smaps(self):
+        self._add(1, 'smaps_rollup', _ROLLUP)
+        self.assertEqual(read_smaps(1, self.proc),
+                         {'rss': 400 * 1024, 'pss': 150 * 1024,
+                          'uss': 100 * 1024})
+
+        # older kernels
+        self._add(2, 'smaps', _SMAPS)
+        self.assertEqual(read_smaps(2, self.proc),
+                         {'rss': 400 * 1024, 'pss': 150 * 1024,
+                          'uss': 100 * 1024})
+
+        self.assertRaises(IOError, read_smaps, 3, self.proc)
+        self.assertEqual(get_total_mem(self.proc), 1024000)
+
+    def test_cache(self):
+        self._add(1, 'smaps_rollup', _ROLLUP)
+        memory = MemoryAccounting('uss', interval=10, proc=self.proc)
+        self.assertEqual(memory.get_bytes(1), 100 * 1024)
+        self.assertEqual(memory.get_percent(100 * 1024), 10.)
+        self.assertEqual(memory.get_bytes(2), None)
+        self.assertEqual(memory.get_percent(None), 'N/A')
+
+        # the values are kept during the interval
+        self._add(1, 'smaps_rollup', _ROLLUP.replace(' 60 kB', '160 kB'))
+        self.assertEqual(memory.get_bytes(1), 100 * 1024)
+
+        now = memory._cache[1][0]
+        with mock.patch('time.time', lambda: now + 11):
+            self.assertEqual(memory.get_bytes(1), 200 * 1024)
+
+        # the processes not asked for are dropped
+        with mock.patch('time.time', lambda: now + 40):
+            memory.get(2)
+        self.assertEqual(memory._cache, {})
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, MemoryAccounting, 'vms')
+
+
+test_suite = EasyTestSuite(__name__)
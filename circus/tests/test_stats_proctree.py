@@ -0,0 +1,81 @@
+import os
+import shutil
+import tempfile
+
+from circus.tests.support import TestCase, EasyTestSuite
+from circus.stats import proctree
+from circus.stats.proctree import ProcessTree
+
+
+_STAT = ('%(pid)d (%(name)s) S %(ppid)d 1 1 0 -1 4194560 0 0 0 0 '
+         '%(utime)d %(stime)d 0 0 20 0 1 0 100 0 0\n')
+
+
+class TestProcessTree(TestCase):
+
+    def setUp(self):
+        super(TestProcessTree, self).setUp()
+        self.proc = tempfile.mkdtemp()
+        with open(os.path.join(self.proc, 'meminfo'), 'w') as f:
+            f.write('MemTotal:        1000 kB\nMemFree:         500 kB\n')
+        os.mkdir(os.path.join(self.proc, 'self'))
+
+    def tearDown(self):
+        shutil.rmtree(self.proc)
+        super(TestProcessTree, self).tearDown()
+
+    def _add(self, pid, ppid, ticks=0, resident=0, shared=0,
+             name='worker'):
+        path = os.path.join(self.proc, str(pid))
+        if not os.path.exists(path):
+            os.mkdir(path)
+        with open(os.path.join(path, 'stat'), 'w') as f:
+            f.write(_STAT % {'pid': pid, 'name': name, 'ppid': ppid,
+                             'utime': ticks, 'stime': 0})
+        with open(os.path.join(path, 'statm'), 'w') as f:
+            f.write('100 %d %d 1 0 10 0\n' % (resident, shared))
+
+    def test_descendants(self):
+        self._add(1, 0)
+        self._add(10, 1, name='uwsgi (master)')
+        self._add(11, 10)
+        self._add(12, 10)
+        self._add(13, 12)
+        self._add(20, 1)
+        tree = ProcessTree(self.proc)
+        self.assertEqual(tree.total_mem, 1024000)
+        self.assertTrue(tree.scan())
+        self.assertEqual(sorted(tree.get_descendants(10)), [11, 12, 13])
+        self.assertEqual(tree.get_descendants(20), [])
+
+    def test_stats(self):
+        page = proctree._PAGE_SIZE
+        self._add(10, 1, ticks=100, resident=50, shared=40)
+        self._add(11, 10, ticks=100, resident=30, shared=20)
+        self._add(12, 10, ticks=100, resident=45, shared=40)
+        tree = ProcessTree(self.proc)
+        tree.scan()
+        stats = tree.get_stats([10])
+        # no cpu until the second scan
+        self.assertEqual(stats['cpu'], 0.)
+        self.assertEqual(stats['processes'], 3)
+        # the shared pages are counted once
+        self.assertEqual(stats['mem'], (10 + 10 + 5 + 40) * page)
+
+        tree._last -= 1
+        self._add(11, 10, ticks=100 + proctree._CLK_TCK // 2)
+        tree.scan()
+        stats = tree.get_stats([10, 11])
+        self.assertTrue(45. < stats['cpu'] < 55.)
+        self.assertEqual(stats['processes'], 3)
+
+        # the gone processes are skipped
+        self.assertEqual(tree.get_stats([99])['processes'], 0)
+
+    def test_no_proc(self):
+        tree = ProcessTree(os.path.join(self.proc, 'nothing'))
+        self.assertEqual(tree.total_mem, None)
+        self.assertFalse(tree.scan())
+
+
+test_suite = EasyTestSuite(__name__)
@@ -3,8 +3,9 @@ import mock
 import zmq
 import zmq.utils.jsonapi as json
 
-from circus.tests.support import TestCase, EasyTestSuite
+from circus.tests.support import TestCase, EasyTestSuite, skipIf
 from circus.stats.publisher import StatsPublisher
+from circus.stats import encoding
 
 
 class TestStatsPublisher(TestCase):
@@ -17,6 +18,70 @@ class TestStatsPublisher(TestCase):
         publisher.socket.send_multipart.assert_called_with(
             [b'stat.foobar.1', json.dumps(stat)])
 
+    def test_publish_many(self):
+        publisher = StatsPublisher()
+        publisher.socket = mock.MagicMock()
+        stats = [{'subtopic': 1, 'foo': 'bar'}, {'foo': 'baz'}]
+        publisher.publish_many([('foobar', stat) for stat in stats])
+        publisher.socket.send_multipart.assert_has_calls([
+            mock.call([b'stat.foobar.1', json.dumps(stats[0])]),
+            mock.call([b'stat.foobar', json.dumps(stats[1])])])
+
+    def test_publish_many_by_watcher(self):
+        publisher = StatsPublisher(batch='watcher')
+        publisher.socket = mock.MagicMock()
+        foo = [{'subtopic': 1, 'cpu': 1}, {'subtopic': 2, 'cpu': 2},
+               {'cpu': 1.5}]
+        bar = [{'cpu': 0}]
+        publisher.publish_many([('foo', stat) for stat in foo] +
+                               [('bar', stat) for stat in bar])
+        self.assertEqual(publisher.socket.send_multipart.call_args_list, [
+            mock.call([b'stats.foo', json.dumps(foo)]),
+            mock.call([b'stats.bar', json.dumps(bar)])])
+
+    def test_publish_many_by_cycle(self):
+        publisher = StatsPublisher(batch='cycle')
+        publisher.socket = mock.MagicMock()
+        publisher.publish_many([('foo', {'cpu': 1}), ('bar', {'cpu': 2})])
+        self.assertEqual(publisher.socket.send_multipart.call_count, 1)
+        topic, data = publisher.socket.send_multipart.call_args[0][0]
+        self.assertEqual(topic, b'stats')
+        self.assertEqual(json.loads(data),
+                         {'foo': [{'cpu': 1}], 'bar': [{'cpu': 2}]})
+
+        # nothing to send
+        publisher.publish_many([])
+        self.assertEqual(publisher.socket.send_multipart.call_count, 1)
+
+    def test_publish_deltas(self):
+        publisher = StatsPublisher(batch='watcher', keyframe_interval=3)
+        publisher.socket = mock.MagicMock()
+
+        def _cycle(*stats):
+            publisher.publish_many([('foo', stat) for stat in stats])
+            topic, data = publisher.socket.send_multipart.call_args[0][0]
+            return json.loads(data)
+
+        first = {'subtopic': 1, 'cpu': 1, 'cmdline': 'foo', 'suppressed': 2}
+        total = {'cpu': 1, 'pid': [1]}
+        self.assertEqual(_cycle(first, total), [first, total])
+
+        # only the changes
+        second = {'subtopic': 1, 'cpu': 2, 'cmdline': 'foo'}
+        new = {'subtopic': 2, 'cpu': 0, 'cmdline': 'bar'}
+        self.assertEqual(_cycle(second, new, total), [
+            {'subtopic': 1, 'cpu': 2, 'delta': ['suppressed']}, new,
+            {'delta': []}])
+
+        self.assertEqual(_cycle(second, total)[0],
+                         {'subtopic': 1, 'delta': []})
+
+        # keyframe
+        self.assertEqual(_cycle(second, total), [second, total])
+
+    def test_unknown_batch_mode(self):
+        self.assertRaises(ValueError, StatsPublisher, batch='pid')
+
     def test_publish_reraise_zmq_errors(self):
         publisher = StatsPublisher()
         publisher.socket = mock.MagicMock()
@@ -35,4 +100,87 @@ class TestStatsPublisher(TestCase):
         stat = {'subtopic': 1, 'foo': 'bar'}
         publisher.publish('foobar', stat)
 
+
+class TestStatsEncoding(TestCase):
+
+    stats = [{'pid': 1234, 'subtopic': 1234, 'cpu': 0.5, 'mem': 'N/A',
+              'name': None, 'children': [{'pid': 1235, 'cpu': 0.}],
+              'new_key': 'value'},
+             {'pid': [1234], 'cpu': 0.5, 'age': 10.}]
+
+    def test_json(self):
+        message = encoding.encode(self.stats)
+        self.assertEqual(json.loads(message), self.stats)
+        self.assertEqual(encoding.decode(message), self.stats)
+
+    def test_unknown_encoding(self):
+        self.assertRaises(ValueError, encoding.check_encoding, 'xml')
+        self.assertRaises(ValueError, StatsPublisher, encoding='xml')
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack(self):
+        message = encoding.encode(self.stats, 'msgpack')
+        self.assertEqual(message[:2], b'\x00\x01')
+        self.assertTrue(len(message) < len(encoding.encode(self.stats)))
+        self.assertEqual(encoding.decode(message), self.stats)
+
+        # a stats mapping by watcher
+        stats = {'foo': self.stats, 'cpu': []}
+        message = encoding.encode(stats, 'msgpack')
+        self.assertEqual(encoding.decode(message), stats)
+
+    @skipIf(encoding.msgpack is None or encoding.msgpack.version < (1, 0),
+            'msgpack 1.0 is not installed')
+    def test_msgpack_strict_map_key(self):
+        message = encoding.encode(self.stats, 'msgpack')
+        # the keys are integers, refused by default since msgpack 1.0
+        self.assertRaises(ValueError, encoding.msgpack.unpackb, message[2:])
+        self.assertEqual(encoding.decode(message), self.stats)
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_unknown_version(self):
+        message = b'\x00\x02' + encoding.encode(self.stats, 'msgpack')[2:]
+        self.assertRaises(ValueError, encoding.decode, message)
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_collected_keys(self):
+        # every key published by the collectors and the publisher
+        process = {'pid': 1234, 'subtopic': 1234, 'name': 'foo', 'cpu': 0.5,
+                   'mem': 1.2, 'mem_info1': '10M', 'mem_info2': '20M',
+                   'ctime': '0:00.01', 'username': 'bob', 'nice': 0,
+                   'cmdline': 'foo', 'create_time': 1.5, 'age': 10.,
+                   'children': [], 'suppressed': 0, 'pss': 1024,
+                   'uss': 512, 'rss': 2048}
+        watcher = {'cpu': 0.5, 'mem': 1.2, 'age': 10., 'suppressed': 0,
+                   'pss': 1024, 'processes': 2, 'delta': ['uss']}
+        socket = {'fd': 3, 'subtopic': 3, 'address': '127.0.0.1:80',
+                  'queued': 1, 'backlog': 128}
+        sockets = {'addresses': ['127.0.0.1:80'], 'queued': 1,
+                   'host_passive_opens': 5, 'host_listen_overflows': 0}
+        stats = [process, watcher, socket, sockets]
+
+        compacted = encoding._compact(stats)
+        for stat in compacted:
+            for key in stat:
+                self.assertTrue(isinstance(key, int), key)
+        message = encoding.encode(stats, 'msgpack')
+        self.assertEqual(encoding.decode(message), stats)
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_unknown_index(self):
+        # a key added by a newer publisher
+        message = encoding._HEADER.pack(b'\x00', encoding.VERSION)
+        message += encoding.msgpack.packb({0: 1234, 100: 5})
+        self.assertEqual(encoding.decode(message), {'pid': 1234, 100: 5})
+
+    @skipIf(encoding.msgpack is None, 'msgpack is not installed')
+    def test_publish_msgpack(self):
+        publisher = StatsPublisher(encoding='msgpack')
+        publisher.socket = mock.MagicMock()
+        stat = {'subtopic': 1, 'foo': 'bar'}
+        publisher.publish('foobar', stat)
+        topic, message = publisher.socket.send_multipart.call_args[0][0]
+        self.assertEqual(topic, b'stat.foobar.1')
+        self.assertEqual(encoding.decode(message), stat)
+
 test_suite = EasyTestSuite(__name__)
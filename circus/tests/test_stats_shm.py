@@ -0,0 +1,117 @@
+import math
+import os
+import shutil
+import tempfile
+
+from circus.tests.support import TestCase, EasyTestSuite
+from circus.stats import shm
+from circus.stats.shm import StatsSegment, StatsSegmentReader
+
+
+class TestStatsSegment(TestCase):
+
+    def setUp(self):
+        super(TestStatsSegment, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'stats')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super(TestStatsSegment, self).tearDown()
+
+    def test_roundtrip(self):
+        segment = StatsSegment(self.path, capacity=10)
+        reader = StatsSegmentReader(self.path)
+        try:
+            self.assertEqual(reader.read(), (0., []))
+
+            segment.update([
+                ('foo', {'pid': 1234, 'subtopic': 1234, 'cpu': 1.5,
+                         'mem': 2., 'age': 3., 'suppressed': 10}),
+                ('foo', {'pid': [1234], 'cpu': 1.5, 'mem': 'N/A',
+                         'age': 3., 'queued': 5})])
+            when, records = reader.read()
+            self.assertTrue(when > 0)
+            self.assertEqual(len(records), 2)
+            self.assertEqual(records[0], {'name': 'foo', 'subtopic': 1234,
+                                          'cpu': 1.5, 'mem': 2., 'age': 3.,
+                                          'suppressed': 10, 'queued': 0})
+            self.assertEqual(records[1]['subtopic'], None)
+            self.assertTrue(math.isnan(records[1]['mem']))
+            self.assertEqual(records[1]['queued'], 5)
+        finally:
+            reader.close()
+            segment.close()
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_long_name(self):
+        segment = StatsSegment(self.path, capacity=10)
+        reader = StatsSegmentReader(self.path)
+        try:
+            # the 64th byte is in the middle of a character
+            name = u'w' + u'\xe9' * 40
+            segment.update([(name, {'subtopic': 1, 'cpu': 1.})])
+            records = reader.read()[1]
+            self.assertEqual(records[0]['name'], name[:32])
+        finally:
+            reader.close()
+            segment.close()
+
+    def test_update_and_forget(self):
+        segment = StatsSegment(self.path, capacity=10)
+        reader = StatsSegmentReader(self.path)
+        try:
+            segment.update([('foo', {'subtopic': 1, 'cpu': 1.}),
+                            ('foo', {'subtopic': 2, 'cpu': 2.})])
+            segment.update([('bar', {'subtopic': 3, 'cpu': 3.})])
+            names = [(r['name'], r['subtopic']) for r in reader.read()[1]]
+            self.assertEqual(sorted(names),
+                             [('bar', 3), ('foo', 1), ('foo', 2)])
+
+            # the records of a watcher are replaced
+            segment.update([('foo', {'subtopic': 2, 'cpu': 4.})])
+            records = reader.read()[1]
+            self.assertEqual(sorted((r['subtopic'], r['cpu'])
+                                    for r in records), [(2, 4.), (3, 3.)])
+
+            segment.forget('foo')
+            records = reader.read()[1]
+            self.assertEqual([r['name'] for r in records], ['bar'])
+        finally:
+            reader.close()
+            segment.close()
+
+    def test_capacity(self):
+        segment = StatsSegment(self.path, capacity=2)
+        reader = StatsSegmentReader(self.path)
+        try:
+            segment.update([('foo', {'subtopic': pid}) for pid in (1, 2, 3)])
+            self.assertEqual(len(reader.read()[1]), 2)
+        finally:
+            reader.close()
+            segment.close()
+
+    def test_not_a_segment(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\x00' * 1024)
+        self.assertRaises(ValueError, StatsSegmentReader, self.path)
+
+    def test_writing(self):
+        segment = StatsSegment(self.path, capacity=2)
+        reader = StatsSegmentReader(self.path)
+        try:
+            # a writer in the middle of an update
+            segment._seq = 1
+            segment._write_seq()
+            self.assertRaises(RuntimeError, reader.read, retries=3)
+        finally:
+            reader.close()
+            segment.close()
+
+    # the layout is read by other programs, it must not change
+    def test_layout(self):
+        self.assertEqual(shm._HEADER.size, 36)
+        self.assertEqual(shm._RECORD.size, 112)
+
+
+test_suite = EasyTestSuite(__name__)
@@ -3,12 +3,13 @@ import tempfile
 import time
 
 import mock
+import zmq
 from zmq.eventloop import ioloop
 import zmq.utils.jsonapi as json
 
 from circus.stats.collector import SocketStatsCollector
 from circus.tests.support import TestCircus, EasyTestSuite
-from circus.stats.streamer import StatsStreamer
+from circus.stats.streamer import StatsStreamer, ArbiterStatsStreamer
 from circus import util
 from circus import client
 
@@ -122,7 +123,10 @@ class TestStatsStreamer(TestCircus):
             if message == 'list':
                 if name == 'circushttpd':
                     return {'pids': [3333]}
-                return {'watchers': ['circushttpd']}
+                if name == 'circusd-logger':
+                    return {'pids': [4444]}
+                return {'watchers': ['circushttpd', 'circusd-logger',
+                                     'foo']}
 
             if message == 'dstats':
                 return {'info': {'pid': 1111}}
@@ -134,16 +138,110 @@ class TestStatsStreamer(TestCircus):
         self.assertEqual(
             streamer.get_circus_pids(),
             {1111: 'circusd', 2222: 'circusd-stats',
-             3333: 'circushttpd'})
+             3333: 'circushttpd', 4444: 'circusd-logger'})
+
+    def test_circus_watcher_events(self):
+        streamer = FakeStreamer()
+        streamer.circus_pids = {1111: 'circusd', 3333: 'circusd-logger'}
+        msg = json.dumps({'process_pid': 4444})
+        streamer.handle_recv([b'watcher.circusd-logger.spawn', msg])
+
+        # the new process of circusd-logger is not a watcher of the user
+        self.assertEqual(list(streamer.get_pids()), [])
+        self.assertEqual(streamer.circus_pids,
+                         {1111: 'circusd', 4444: 'circusd-logger'})
 
     def test_remove_pid(self):
         streamer = FakeStreamer()
-        streamer._callbacks['foobar'] = mock.MagicMock()
-        streamer._pids = {'foobar': [1234, 1235]}
+        streamer._pids['foobar'] = [1234, 1235]
         streamer.remove_pid('foobar', 1234)
-        self.assertFalse(streamer._callbacks['foobar'].stop.called)
+        self.assertEqual(streamer.get_pids('foobar'), [1235])
 
+        streamer.stop_watcher('foobar')
+        self.assertEqual(streamer.get_pids('foobar'), [])
+
+    def test_remove_pid_segment(self):
+        streamer = FakeStreamer()
+        streamer.segment = mock.Mock()
+        streamer._pids['foobar'] = [1234, 1235]
+        streamer.remove_pid('foobar', 1234)
+        self.assertFalse(streamer.segment.forget.called)
         streamer.remove_pid('foobar', 1235)
-        self.assertTrue(streamer._callbacks['foobar'].stop.called)
+        streamer.segment.forget.assert_called_once_with('foobar')
+
+    def test_suppressed(self):
+        streamer = FakeStreamer()
+        msg = json.dumps({'process_pid': 1234, 'name': 'stdout',
+                          'bytes': 10})
+        streamer.handle_recv([b'watcher.foobar.suppressed', msg])
+        streamer.handle_recv([b'watcher.foobar.suppressed', msg])
+        self.assertEqual(streamer.suppressed[1234], 20)
+
+
+class FakeWatcher(object):
+    def __init__(self, name, pids):
+        self.name = name
+        self.processes = dict((pid, None) for pid in pids)
+
+
+class TestArbiterStatsStreamer(TestCircus):
+
+    def setUp(self):
+        super(TestArbiterStatsStreamer, self).setUp()
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(path)
+        self.endpoint = 'ipc://' + path
+        self.arbiter = mock.Mock()
+        self.arbiter.watchers = [FakeWatcher('one', [1, 2]),
+                                 FakeWatcher('circushttpd', [3]),
+                                 FakeWatcher('circusd-stats', []),
+                                 FakeWatcher('circusd-logger', [6])]
+        self.arbiter.sockets = {}
+
+    @mock.patch('os.getpid', lambda: 2222)
+    def test_refresh(self):
+        streamer = ArbiterStatsStreamer(self.arbiter, self.endpoint)
+        try:
+            self.assertEqual(streamer.get_watchers(), ['one'])
+            self.assertEqual(streamer.get_pids('one'), [1, 2])
+            self.assertEqual(streamer.circus_pids,
+                             {2222: 'circusd', 3: 'circushttpd',
+                              6: 'circusd-logger'})
+
+            streamer.suppressed[1] = 10
+            self.arbiter.watchers[0].processes = {2: None, 4: None}
+            self.arbiter.watchers.append(FakeWatcher('two', [5]))
+            self.assertEqual(sorted(streamer.get_watchers()), ['one', 'two'])
+            self.assertEqual(streamer.get_pids('one'), [2, 4])
+            self.assertEqual(streamer.get_pids('two'), [5])
+            self.assertFalse(1 in streamer.suppressed)
+
+            del self.arbiter.watchers[-1]
+            self.assertEqual(streamer.get_watchers(), ['one'])
+            self.assertFalse('two' in streamer._pids)
+        finally:
+            streamer.stop()
+
+    def test_thread(self):
+        self.arbiter.watchers[0].processes = {os.getpid(): None}
+        streamer = ArbiterStatsStreamer(self.arbiter, self.endpoint,
+                                        delay=.1, batch='cycle')
+        ctx = zmq.Context()
+        sub = ctx.socket(zmq.SUB)
+        sub.setsockopt(zmq.SUBSCRIBE, b'stats')
+        sub.connect(self.endpoint)
+        try:
+            streamer.start_thread()
+            self.assertTrue(sub.poll(5000))
+            topic, msg = sub.recv_multipart()
+            stats = json.loads(msg)
+            self.assertEqual([stat.get('subtopic') for stat in stats['one']],
+                             [os.getpid(), None])
+        finally:
+            streamer.stop_thread()
+            ctx.destroy(0)
+        self.assertTrue(streamer.stopped)
+
 
 test_suite = EasyTestSuite(__name__)
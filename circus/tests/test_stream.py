@@ -1,17 +1,29 @@
 import time
 import sys
 import os
+import gzip
+import shutil
 import tempfile
+import socket
 import tornado
+import mock
 
-from datetime import datetime
+import zmq.utils.jsonapi as json
+from zmq.eventloop import ioloop
+from datetime import datetime, timedelta
 from circus.py3compat import StringIO
 
 from circus.client import make_message
 from circus.tests.support import TestCircus, async_poll_for, truncate_file
-from circus.tests.support import TestCase, EasyTestSuite
+from circus.tests.support import TestCase, EasyTestSuite, skipIf
 from circus.stream import FileStream, WatchedFileStream
-from circus.stream import FancyStdoutStream
+from circus.stream import FancyStdoutStream, QueueStream
+from circus.stream import get_stream, get_pipe_redirector
+from circus.stream.redirector import splice
+from circus.stream import shipper
+from circus.stream.ring import OutputRing
+from circus.stream.scheduler import OutputScheduler
+from circus.stream.json_stream import JsonLinesStream
 
 
 def run_process(testfile, *args, **kw):
@@ -305,5 +317,724 @@ class TestWatchedFileStream(TestFileStream):
         os.unlink(test_filename)
         os.unlink(file1)
 
+    def test_splice_fileno_follows_moved_file(self):
+        _test_fd, test_filename = tempfile.mkstemp()
+        stream = self.get_real_stream(filename=test_filename)
+
+        os.write(stream.splice_fileno(), b'line 1')
+        os.rename(test_filename, test_filename + '.1')
+        os.write(stream.splice_fileno(), b'line 2')
+        stream.close()
+
+        with open(test_filename) as f:
+            self.assertEqual(f.read(), 'line 2')
+        with open(test_filename + '.1') as f:
+            self.assertEqual(f.read(), 'line 1')
+
+        os.unlink(test_filename)
+        os.unlink(test_filename + '.1')
+
+
+class TestFileStreamRotation(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'app.log')
+        self.now = datetime(2014, 1, 30, 10, 30)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def get_stream(self, **kw):
+        stream = FileStream(self.filename, **kw)
+        stream.now = lambda: self.now
+        stream._rollover_at = stream._next_rollover()
+        self.addCleanup(stream.close)
+        return stream
+
+    def write(self, stream, *lines):
+        for line in lines:
+            stream({'data': line, 'pid': 333})
+            self.now += timedelta(seconds=1)
+
+    def read(self, filename):
+        opener = gzip.open if filename.endswith('.gz') else open
+        f = opener(os.path.join(self.dir, filename), 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def test_compressed_backups(self):
+        stream = self.get_stream(max_bytes=10, backup_count=2,
+                                 compress='gzip')
+        self.write(stream, 'a' * 10, 'b' * 10, 'c' * 10, 'd' * 10)
+        # waits for the rotator
+        stream.close()
+
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['app.log', 'app.log.1.gz', 'app.log.2.gz'])
+        self.assertEqual(self.read('app.log.1.gz'), b'c' * 10)
+        self.assertEqual(self.read('app.log.2.gz'), b'b' * 10)
+
+    def test_timestamped_segments(self):
+        stream = self.get_stream(max_bytes=10, backup_count=2,
+                                 timestamped=True)
+        self.write(stream, 'a' * 10, 'b' * 10, 'c' * 10, 'd' * 10)
+        stream.close()
+
+        # the oldest segment was deleted
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['app.log', 'app.log.20140130-103002',
+                          'app.log.20140130-103003'])
+        self.assertEqual(self.read('app.log.20140130-103003'), b'c' * 10)
+
+        # the segments left are found again
+        stream = self.get_stream(timestamped=True)
+        self.assertEqual(len(stream._segments), 2)
+
+    def test_split_at_max_bytes(self):
+        stream = self.get_stream(max_bytes=10, backup_count=3)
+        self.write(stream, 'a' * 4, 'b' * 20)
+        stream.close()
+
+        self.assertEqual(self.read('app.log.2'), b'aaaabbbbbb')
+        self.assertEqual(self.read('app.log.1'), b'b' * 10)
+        self.assertEqual(self.read('app.log'), b'bbbb')
+
+    def test_size_follows_truncation(self):
+        stream = self.get_stream(max_bytes=10, backup_count=1)
+        self.write(stream, 'a' * 8)
+        truncate_file(self.filename)
+        self.write(stream, 'b' * 8)
+        stream.close()
+
+        # the size was read again instead of rolling over
+        self.assertFalse(os.path.exists(self.filename + '.1'))
+        self.assertEqual(self.read('app.log'), b'b' * 8)
+
+    def test_rotate_when(self):
+        stream = self.get_stream(rotate_when='hourly', backup_count=1)
+        self.write(stream, 'foo')
+        self.now = datetime(2014, 1, 30, 10, 59)
+        self.write(stream, 'bar')
+        self.now = datetime(2014, 1, 30, 11, 0)
+        self.write(stream, 'baz')
+        stream.close()
+
+        self.assertEqual(self.read('app.log.1'), b'foobar')
+        self.assertEqual(self.read('app.log'), b'baz')
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, FileStream, self.filename,
+                          rotate_when='weekly')
+        self.assertRaises(ValueError, FileStream, self.filename,
+                          compress='bzip2')
+
+
+class FakeLoop(object):
+    def __init__(self):
+        self.handlers = set()
+        self.timeouts = []
+
+    def add_handler(self, fd, handler, events):
+        self.handlers.add(fd)
+
+    def remove_handler(self, fd):
+        self.handlers.discard(fd)
+
+    def add_timeout(self, deadline, callback):
+        self.timeouts.append((deadline, callback))
+
+    def update_handler(self, fd, events):
+        if events & ioloop.IOLoop.READ:
+            self.handlers.add(fd)
+        else:
+            self.handlers.discard(fd)
+
+    def add_callback(self, callback):
+        self.timeouts.append((None, callback))
+
+    def stop(self):
+        pass
+
+
+class FakeProcess(object):
+    pid = 333
+    wid = 1
+
+
+class TestRedirector(TestCase):
+
+    def get_redirector(self, **conf):
+        stream = QueueStream()
+        conf['stream'] = stream
+        redirector = get_pipe_redirector(get_stream(conf), loop=FakeLoop())
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, wfd)
+        pipe = os.fdopen(rfd, 'rb')
+        self.addCleanup(pipe.close)
+        redirector.add_redirection('stdout', FakeProcess(), pipe)
+        redirector.start()
+        return redirector, stream, wfd, redirector._active[rfd]
+
+    def read(self, handler, wfd, data):
+        os.write(wfd, data)
+        handler(handler.pipe.fileno(), ioloop.IOLoop.READ)
+
+    def get_data(self, stream):
+        res = []
+        while not stream.empty():
+            res.append(stream.get()['data'])
+        return res
+
+    def test_raw_chunks(self):
+        redirector, stream, wfd, handler = self.get_redirector()
+        self.read(handler, wfd, b'foo\nba')
+        self.read(handler, wfd, b'r\n')
+        self.assertEqual(self.get_data(stream), [b'foo\nba', b'r\n'])
+
+    def test_line_buffered(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            line_buffered='true')
+        self.read(handler, wfd, b'foo\nbar\nba')
+        self.read(handler, wfd, b'z')
+        self.read(handler, wfd, b'\nqux')
+        self.assertEqual(self.get_data(stream),
+                         [b'foo\nbar\n', b'baz\n'])
+
+        # the pending partial line is sent when the redirection stops
+        redirector.stop()
+        self.assertEqual(self.get_data(stream), [b'qux'])
+
+    def test_drain_pipe(self):
+        redirector, stream, wfd, handler = self.get_redirector()
+        redirector.buffer = handler.read_size = 4
+        redirector.max_buffer = 16
+        self.read(handler, wfd, b'x' * 100)
+
+        # all the data available was read at once, with growing reads
+        self.assertEqual(self.get_data(stream), [b'x' * 100])
+        self.assertEqual(handler.read_size, 16)
+
+        # small reads bring the read size back down
+        self.read(handler, wfd, b'x')
+        self.assertEqual(handler.read_size, 8)
+
+    def test_read_budget(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            read_budget=10)
+        redirector.buffer = handler.read_size = 4
+        self.read(handler, wfd, b'x' * 20)
+        self.assertEqual(self.get_data(stream), [b'x' * 12])
+
+        # the rest is read on the next event
+        handler(handler.pipe.fileno(), ioloop.IOLoop.READ)
+        self.assertEqual(self.get_data(stream), [b'x' * 8])
+
+    def _get_file(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        return filename
+
+    @skipIf(splice is None, 'os.splice() is not available')
+    def test_splice_to_file_stream(self):
+        filename = self._get_file()
+        file_stream = FileStream(filename)
+        self.addCleanup(file_stream.close)
+        redirector, stream, wfd, handler = self.get_redirector()
+        redirector.redirect = file_stream
+
+        self.read(handler, wfd, b'foo\n')
+        file_stream({'data': 'bar\n', 'pid': 333})
+        self.read(handler, wfd, b'baz\n')
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'foo\nbar\nbaz\n')
+
+    @skipIf(splice is None, 'os.splice() is not available')
+    def test_splice_rollover(self):
+        filename = self._get_file()
+        self.addCleanup(os.remove, filename + '.1')
+        file_stream = FileStream(filename, max_bytes=10, backup_count=1)
+        self.addCleanup(file_stream.close)
+        redirector, stream, wfd, handler = self.get_redirector()
+        redirector.redirect = file_stream
+
+        # split at max_bytes like the data written
+        self.read(handler, wfd, b'0123456789abcdefghijK')
+        # waits for the backups to be renamed
+        file_stream.close()
+        with open(filename + '.1') as f:
+            self.assertEqual(f.read(), 'abcdefghij')
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'K')
+
+    def test_direct_rollover(self):
+        filename = self._get_file()
+        self.addCleanup(os.remove, filename + '.1')
+        stream = FileStream(filename, max_bytes=10, backup_count=1)
+        self.addCleanup(stream.close)
+        fd = stream.direct_fileno()
+        os.write(fd, b'x' * 20)
+        stream.rollover_if_needed()
+        # waits for the copy
+        stream._rotator.stop()
+
+        # the file was copied then emptied, and stays the one written to
+        os.write(fd, b'foo')
+        # waits for the backups to be renamed
+        stream.close()
+        with open(filename + '.1') as f:
+            self.assertEqual(f.read(), 'x' * 20)
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'foo')
+
+    def test_no_splice_with_time_format(self):
+        filename = self._get_file()
+        stream = FileStream(filename, time_format='%Y-%m-%d')
+        self.addCleanup(stream.close)
+        self.assertEqual(stream.splice_fileno(), None)
+
+    def test_recorder(self):
+        redirector, stream, wfd, handler = self.get_redirector()
+        recorded = []
+        redirector.recorder = recorded.append
+        # the data has to be read to be recorded
+        redirector.redirect = FileStream(self._get_file())
+        self.addCleanup(redirector.redirect.close)
+        self.assertEqual(handler._get_splice_fd(), None)
+
+        self.read(handler, wfd, b'foo')
+        self.assertEqual(recorded, [{'data': b'foo', 'pid': 333,
+                                     'wid': 1, 'name': 'stdout'}])
+
+    def test_drop_rate_limit(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            line_buffered='true', max_lines_per_sec='2')
+        suppressed = []
+        redirector.on_suppress = lambda *args: suppressed.append(args)
+
+        self.read(handler, wfd, b'a\nb\nc\nd\n')
+        # the excess is dropped and a marker tells how much
+        self.assertEqual(self.get_data(stream),
+                         [b'[circus] 4 bytes of output suppressed\n',
+                          b'a\nb\n'])
+        self.assertEqual(suppressed, [(handler.process, 'stdout', 4)])
+
+        # the next marker waits for a second
+        self.read(handler, wfd, b'e\n')
+        self.assertEqual(self.get_data(stream), [])
+        self.assertEqual(handler.suppressed, 2)
+        redirector.stop()
+        self.assertEqual(self.get_data(stream),
+                         [b'[circus] 2 bytes of output suppressed\n'])
+
+    def test_drop_bytes_rate_limit(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            line_buffered='true', max_bytes_per_sec='6')
+        self.read(handler, wfd, b'foo\nbar\n')
+        # only whole lines go through
+        self.assertEqual(self.get_data(stream)[1:], [b'foo\n'])
+        self.assertEqual(handler.bytes_bucket.tokens, 2)
+
+    def test_throttle(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            max_bytes_per_sec='10', rate_limit='throttle')
+        fd = handler.pipe.fileno()
+        self.read(handler, wfd, b'x' * 8)
+        self.assertTrue(fd in redirector.loop.handlers)
+
+        # past the limit, the reads are paused instead of dropping
+        self.read(handler, wfd, b'x' * 12)
+        self.assertEqual(self.get_data(stream), [b'x' * 8, b'x' * 12])
+        self.assertTrue(handler.paused)
+        self.assertFalse(fd in redirector.loop.handlers)
+        deadline, resume = redirector.loop.timeouts[0]
+        self.assertTrue(0 < deadline - time.time() <= 1.)
+
+        resume()
+        self.assertTrue(fd in redirector.loop.handlers)
+        self.assertRaises(ValueError, get_pipe_redirector,
+                          get_stream({'stream': stream,
+                                      'rate_limit': 'block'}))
+
+    def test_max_line_length(self):
+        redirector, stream, wfd, handler = self.get_redirector(
+            line_buffered=True, max_line_length='5')
+        self.read(handler, wfd, b'foo')
+        self.read(handler, wfd, b'barbaz')
+        self.read(handler, wfd, b'\n')
+        self.assertEqual(self.get_data(stream), [b'foobarbaz', b'\n'])
+
+
+class TestOutputScheduler(TestCase):
+
+    def setUp(self):
+        self.loop = FakeLoop()
+        self.scheduler = OutputScheduler(loop=self.loop, quantum=10)
+
+    def get_redirector(self, group, weight=1):
+        stream = QueueStream()
+        # reads of 4 bytes
+        redirector = get_pipe_redirector({'stream': stream, 'max_buffer': 4},
+                                         buffer=4, loop=self.loop,
+                                         scheduler=self.scheduler,
+                                         group=group, weight=weight)
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, wfd)
+        pipe = os.fdopen(rfd, 'rb')
+        self.addCleanup(pipe.close)
+        redirector.add_redirection('stdout', FakeProcess(), pipe)
+        redirector.start()
+        return stream, wfd, redirector._active[rfd]
+
+    def run_round(self):
+        deadline, callback = self.loop.timeouts.pop()
+        self.assertEqual(self.loop.timeouts, [])
+        callback()
+
+    def get_size(self, stream):
+        size = 0
+        while not stream.empty():
+            size += len(stream.get()['data'])
+        return size
+
+    def test_rounds(self):
+        noisy, noisy_wfd, noisy_handler = self.get_redirector('noisy')
+        quiet, quiet_wfd, quiet_handler = self.get_redirector('quiet',
+                                                              weight=2)
+        os.write(noisy_wfd, b'x' * 100)
+        os.write(quiet_wfd, b'y' * 30)
+        noisy_handler(noisy_handler.fd, ioloop.IOLoop.READ)
+        quiet_handler(quiet_handler.fd, ioloop.IOLoop.READ)
+
+        # the pipes are not polled until they are read
+        self.assertFalse(noisy_handler.fd in self.loop.handlers)
+        self.assertFalse(quiet_handler.fd in self.loop.handlers)
+
+        # each group reads its quantum times its weight in a round, the last
+        # read may go a bit over
+        self.run_round()
+        self.assertEqual(self.get_size(noisy), 12)
+        self.assertEqual(self.get_size(quiet), 20)
+        self.run_round()
+        self.assertEqual(self.get_size(noisy), 12)
+        self.assertEqual(self.get_size(quiet), 10)
+        self.assertFalse(noisy_handler.fd in self.loop.handlers)
+
+        # the drained pipe is polled again
+        self.assertTrue(quiet_handler.fd in self.loop.handlers)
+        for i in range(10):
+            self.run_round()
+            if not self.loop.timeouts:
+                break
+        self.assertEqual(self.get_size(noisy), 76)
+        self.assertTrue(noisy_handler.fd in self.loop.handlers)
+
+    def test_stopped_redirection(self):
+        stream, wfd, handler = self.get_redirector('test')
+        os.write(wfd, b'foo')
+        handler(handler.fd, ioloop.IOLoop.READ)
+        handler.redirector.stop()
+        self.run_round()
+        self.assertEqual(self.get_size(stream), 0)
+
+
+class FakeWatcher(object):
+    def __init__(self, name='test', is_internal=False):
+        self.name = name
+        self.is_internal = is_internal
+
+
+class TestShipper(TestCase):
+
+    def test_accepts(self):
+        output_shipper = shipper.OutputShipper('/tmp/test.sock',
+                                               loop=FakeLoop())
+        watcher = FakeWatcher()
+        self.assertTrue(output_shipper.accepts(watcher,
+                                               {'filename': 'test.log'}))
+        self.assertTrue(output_shipper.accepts(watcher,
+                                               {'class': 'StdoutStream'}))
+        self.assertFalse(output_shipper.accepts(watcher,
+                                                {'class': 'QueueStream'}))
+        self.assertFalse(output_shipper.accepts(watcher,
+                                                {'stream': QueueStream()}))
+        self.assertFalse(output_shipper.accepts(watcher, None))
+        self.assertFalse(output_shipper.accepts(
+            FakeWatcher('circusd-logger', True), {'filename': 'test.log'}))
+        self.assertFalse(output_shipper.accepts(
+            FakeWatcher('circusd-stats', True), {'filename': 'test.log'}))
+
+    @skipIf(not shipper.is_supported(), 'fd passing needs Python 3.3+')
+    def test_send_message(self):
+        import socket
+        left, right = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(left.close)
+        self.addCleanup(right.close)
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+
+        shipper.send_message(left, {'name': 'stdout'}, rfd)
+        shipper.send_message(left, {'name': 'stderr'})
+        # a read stops after the data that came with the fd
+        reader = shipper.MessageReader(right)
+        messages = []
+        while len(messages) < 2:
+            messages.extend(reader.read())
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[1], {'name': 'stderr'})
+
+        # the received fd is another end of the same pipe
+        fd = messages[0]['fd']
+        self.addCleanup(os.close, fd)
+        self.assertNotEqual(fd, rfd)
+        os.write(wfd, b'foo')
+        self.assertEqual(os.read(fd, 3), b'foo')
+
+    @skipIf(not shipper.is_supported(), 'fd passing needs Python 3.3+')
+    def test_pending_sends(self):
+        left, right = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(right.close)
+        right.settimeout(5.)
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+        output_shipper = shipper.OutputShipper('/tmp/test.sock',
+                                               loop=FakeLoop())
+        left.setblocking(0)
+        output_shipper.conn = left
+        self.addCleanup(output_shipper.stop)
+        watcher = FakeWatcher()
+        watcher.stdout_stream_conf = {'filename': 'x' * 100000}
+        redirector = output_shipper.get_redirector(watcher, 'stdout')
+
+        # more than the socket holds, the rest waits for the loop
+        for i in range(10):
+            output_shipper.update(redirector)
+        output_shipper.add_pipe(redirector, FakeProcess(), shipper._Pipe(rfd))
+        self.assertTrue(len(output_shipper._outgoing) > 1)
+
+        reader = shipper.MessageReader(right)
+        messages = []
+        while len(messages) < 11:
+            output_shipper._handle_conn(left.fileno(), ioloop.IOLoop.WRITE)
+            messages.extend(reader.read())
+        self.assertEqual(len(output_shipper._outgoing), 0)
+        self.assertEqual(messages[0]['conf'], watcher.stdout_stream_conf)
+
+        fd = messages[10]['fd']
+        self.addCleanup(os.close, fd)
+        os.write(wfd, b'foo')
+        self.assertEqual(os.read(fd, 3), b'foo')
+
+    def test_logger_streams(self):
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        self.addCleanup(os.remove, filename)
+        circus_logger = shipper.CircusLogger('/tmp/test.sock',
+                                             loop=FakeLoop())
+        rfd, wfd = os.pipe()
+        self.addCleanup(os.close, rfd)
+        self.addCleanup(os.close, wfd)
+
+        msg = {'watcher': 'test', 'name': 'stdout', 'pid': 333, 'wid': 1,
+               'conf': {'filename': filename}, 'fd': rfd}
+        circus_logger.add_pipe(msg)
+        redirector = circus_logger.redirectors['test', 'stdout'][1]
+        handler = redirector._active[rfd]
+        os.write(wfd, b'foo\n')
+        handler(rfd, ioloop.IOLoop.READ)
+
+        # the same configuration reuses the redirector
+        del msg['fd']
+        circus_logger.add_pipe(msg)
+        self.assertTrue(circus_logger.redirectors['test', 'stdout'][1]
+                        is redirector)
+
+        circus_logger.stop()
+        with open(filename) as f:
+            self.assertEqual(f.read(), 'foo\n')
+
+
+class TestOutputRing(TestCase):
+
+    def record(self, ring, pid, data, name='stdout'):
+        ring({'data': data, 'pid': pid, 'name': name})
+
+    def test_max_bytes(self):
+        ring = OutputRing(10)
+        self.record(ring, 1, b'aaaa\n')
+        self.record(ring, 1, b'bbbb\n')
+        self.record(ring, 1, b'cc\n')
+        self.assertEqual(ring.size, 10)
+        self.assertEqual(ring.lines(), [(1, 'stdout', b'a'),
+                                        (1, 'stdout', b'bbbb'),
+                                        (1, 'stdout', b'cc')])
+
+        # a chunk bigger than the ring keeps its end
+        self.record(ring, 1, b'x' * 20)
+        self.assertEqual(ring.lines(), [(1, 'stdout', b'x' * 10)])
+
+    def test_lines(self):
+        ring = OutputRing(1024)
+        self.record(ring, 1, b'foo\nba')
+        self.record(ring, 2, b'baz\n', name='stderr')
+        self.record(ring, 1, b'r\nqux')
+
+        # the lines of each process are joined back
+        self.assertEqual(ring.lines(), [(1, 'stdout', b'foo'),
+                                        (2, 'stderr', b'baz'),
+                                        (1, 'stdout', b'bar'),
+                                        (1, 'stdout', b'qux')])
+        self.assertEqual(ring.lines(2), [(1, 'stdout', b'bar'),
+                                         (1, 'stdout', b'qux')])
+        self.assertEqual(ring.lines(pid=2), [(2, 'stderr', b'baz')])
+
+
+class TestJsonLinesStream(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def get_stream(self, **kwargs):
+        stream = JsonLinesStream(loop=FakeLoop(), **kwargs)
+        stream.now = lambda: 1391095200.5
+        self.addCleanup(stream.close)
+        return stream
+
+    def call(self, stream, data, pid=333):
+        stream({'data': data, 'pid': pid, 'wid': 1, 'name': 'stdout',
+                'watcher': 'test'})
+
+    def test_lines(self):
+        filename = os.path.join(self.dir, 'out.json')
+        stream = self.get_stream(filename=filename)
+        self.call(stream, b'foo\n"bar"\n')
+        self.call(stream, u'\xe9t\xe9\n'.encode('utf-8'), pid=334)
+        stream.flush()
+
+        with open(filename) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual([line['message'] for line in lines],
+                         ['foo', '"bar"', u'\xe9t\xe9'])
+        self.assertEqual(lines[0], {'time': 1391095200.5, 'watcher': 'test',
+                                    'pid': 333, 'wid': 1, 'stream': 'stdout',
+                                    'message': 'foo'})
+        self.assertEqual(lines[2]['pid'], 334)
+
+    def test_invalid_utf8(self):
+        filename = os.path.join(self.dir, 'out.json')
+        stream = self.get_stream(filename=filename)
+        self.call(stream, b'caf\xe9\n')
+        stream.flush()
+
+        with open(filename) as f:
+            self.assertEqual(json.loads(f.read())['message'], u'caf\ufffd')
+
+    def test_batches(self):
+        filename = os.path.join(self.dir, 'out.json')
+        stream = self.get_stream(filename=filename, batch_size=3)
+        self.call(stream, b'a\nb\n')
+        self.assertEqual(os.path.getsize(filename), 0)
+
+        # the batch is written once full
+        self.call(stream, b'c\n')
+        with open(filename) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_time_format(self):
+        filename = os.path.join(self.dir, 'out.json')
+        stream = self.get_stream(filename=filename, time_format='%Y')
+        self.call(stream, b'foo\n')
+        stream.flush()
+        with open(filename) as f:
+            self.assertEqual(json.loads(f.read())['time'], '2014')
+
+    @skipIf(not hasattr(socket, 'AF_UNIX'), 'Needs unix sockets')
+    def test_unix_datagrams(self):
+        path = os.path.join(self.dir, 'collector.sock')
+        collector = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.addCleanup(collector.close)
+        collector.bind(path)
+
+        stream = self.get_stream(address='unix://' + path)
+        stream.max_datagram = 250
+        for i in range(5):
+            self.call(stream, ('line %d\n' % i).encode('ascii'))
+        stream.flush()
+
+        # the lines are packed in the datagrams
+        collector.settimeout(1)
+        lines = collector.recv(4096).decode('utf-8').splitlines()
+        self.assertTrue(1 < len(lines) < 5)
+        while len(lines) < 5:
+            lines += collector.recv(4096).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['message'] for line in lines],
+                         ['line %d' % i for i in range(5)])
+
+    def test_tcp_connect(self):
+        collector = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.addCleanup(collector.close)
+        collector.bind(('127.0.0.1', 0))
+        collector.listen(1)
+        port = collector.getsockname()[1]
+
+        stream = self.get_stream(address='tcp://127.0.0.1:%d' % port)
+        self.call(stream, b'foo\n')
+        stream.flush()
+        # the lines wait for the connection
+        self.assertTrue(stream._connecting)
+        self.assertEqual(stream._pending.count(b'\n'), 1)
+        fd = stream._sock.fileno()
+        self.assertTrue(fd in stream.loop.handlers)
+
+        collector.settimeout(1)
+        conn, addr = collector.accept()
+        self.addCleanup(conn.close)
+        stream._handle_write(fd, ioloop.IOLoop.WRITE)
+        self.assertFalse(stream._connecting)
+        self.assertEqual(stream._pending, b'')
+        self.assertFalse(fd in stream.loop.handlers)
+
+        conn.settimeout(1)
+        line = json.loads(conn.recv(4096).decode('utf-8'))
+        self.assertEqual(line['message'], 'foo')
+
+    def test_resolved_once(self):
+        with mock.patch('socket.getaddrinfo',
+                        side_effect=socket.getaddrinfo) as getaddrinfo:
+            stream = self.get_stream(address='tcp://127.0.0.1:1',
+                                     retry_delay=0)
+            for i in range(3):
+                self.call(stream, b'foo\n')
+                stream.flush()
+                stream._disconnect()
+        self.assertEqual(getaddrinfo.call_count, 1)
+
+        with mock.patch('socket.getaddrinfo',
+                        side_effect=socket.gaierror(-2, 'unknown')):
+            self.assertRaises(ValueError, JsonLinesStream,
+                              address='tcp://collector:5000')
+
+    def test_collector_down(self):
+        stream = self.get_stream(address='tcp://127.0.0.1:1',
+                                 max_pending=100)
+        for i in range(10):
+            self.call(stream, b'foo\n')
+            stream.flush()
+
+        # the oldest lines are dropped
+        self.assertTrue(len(stream._pending) <= 100)
+        self.assertEqual(stream.dropped, 10 - stream._pending.count(b'\n'))
+
+    def test_invalid_options(self):
+        self.assertRaises(ValueError, JsonLinesStream)
+        self.assertRaises(ValueError, JsonLinesStream,
+                          address='udp://127.0.0.1:5000')
+
 
 test_suite = EasyTestSuite(__name__)
@@ -9,13 +9,13 @@ import sys
 from psutil import Popen
 import mock
 
-from circus.tests.support import TestCase, EasyTestSuite
+from circus.tests.support import TestCase, EasyTestSuite, skipIf
 
 from circus import util
 from circus.util import (
     get_info, bytes2human, human2bytes, to_bool, parse_env_str, env_to_str,
     to_uid, to_gid, replace_gnu_args, get_python_version, load_virtualenv,
-    get_working_dir
+    get_working_dir, set_pipe_size, to_size, TokenBucket
 )
 
 
@@ -93,6 +93,28 @@ class TestUtil(TestCase):
         self.assertRaises(ValueError, human2bytes, '23V')
         self.assertRaises(TypeError, human2bytes, 234)
 
+    def test_to_size(self):
+        self.assertEqual(to_size(1024), 1024)
+        self.assertEqual(to_size('1024'), 1024)
+        self.assertEqual(to_size('64K'), 65536)
+        self.assertRaises(ValueError, to_size, '64KB')
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(100)
+        self.assertTrue(bucket.consume(60))
+        self.assertFalse(bucket.consume(60))
+
+        # the tokens come back with time
+        bucket.updated -= .5
+        self.assertTrue(bucket.consume(60))
+        self.assertFalse(bucket.consume(200))
+
+        bucket = TokenBucket(100)
+        self.assertEqual(bucket.take(150), 100)
+        self.assertEqual(bucket.take(10), 0)
+        # spending more than available gives the time to pay it back
+        self.assertAlmostEqual(bucket.spend(50), .5, places=2)
+
     def test_tobool(self):
         for value in ('True ', '1', 'true'):
             self.assertTrue(to_bool(value))
@@ -231,6 +253,15 @@ class TestUtil(TestCase):
         self.assertGreaterEqual(py_version[1], 0)
         self.assertGreaterEqual(py_version[2], 0)
 
+    @skipIf(not sys.platform.startswith('linux'), 'Linux only')
+    def test_set_pipe_size(self):
+        rfd, wfd = os.pipe()
+        try:
+            self.assertTrue(set_pipe_size(rfd, 131072) >= 131072)
+        finally:
+            os.close(rfd)
+            os.close(wfd)
+
     def _create_dir(self):
         dir = tempfile.mkdtemp()
         self.dirs.append(dir)
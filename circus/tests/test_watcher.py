@@ -17,11 +17,14 @@ except ImportError:
 
 import tornado
 import mock
+import zmq
+import zmq.utils.jsonapi as json
 
 from circus import logger
 from circus.process import RUNNING, UNEXISTING
 
 from circus.stream import QueueStream
+from circus.stream.ring import OutputRing
 from circus.tests.support import TestCircus, truncate_file
 from circus.tests.support import async_poll_for, EasyTestSuite
 from circus.tests.support import MagicMockFuture
@@ -284,6 +287,115 @@ class TestWatcherInitialization(TestCircus):
         self.assertTrue(wanted in ppath.split(os.pathsep))
 
 
+class TestWatcherOutputWeight(TestCircus):
+
+    def test_output_weight(self):
+        watcher = Watcher('test', 'foo', output_weight='3')
+        self.assertEqual(watcher.output_weight, 3)
+        # the pipes of the watcher would never be read
+        for weight in (0, -1):
+            self.assertRaises(ValueError, Watcher, 'test', 'foo',
+                              output_weight=weight)
+
+
+class TestWatcherOutputRing(TestCircus):
+
+    def test_tail(self):
+        watcher = Watcher('test', 'foo', output_ring_size='1K')
+        self.assertEqual(watcher.output_ring_size, 1024)
+        process = FakeProcess(12, RUNNING)
+        process.output_ring = OutputRing(1024)
+        watcher.processes[12] = process
+
+        watcher.record_output({'pid': 12, 'name': 'stdout',
+                               'data': b'foo\nbar\n'})
+        watcher.record_output({'pid': 13, 'name': 'stderr',
+                               'data': b'baz\n'})
+
+        self.assertEqual(watcher.tail(2),
+                         [{'pid': 12, 'name': 'stdout', 'line': 'bar'},
+                          {'pid': 13, 'name': 'stderr', 'line': 'baz'}])
+        self.assertEqual([line['line'] for line in watcher.tail(pid=12)],
+                         ['foo', 'bar'])
+        self.assertRaises(KeyError, watcher.tail, pid=14)
+
+    def test_follow_output(self):
+        watcher = Watcher('test', 'foo', output_ring_size='1K')
+        watcher.notify_event = mock.Mock()
+        data = {'pid': 12, 'name': 'stdout', 'data': b'foo\n'}
+        watcher.record_output(data)
+        self.assertFalse(watcher.notify_event.called)
+
+        watcher = Watcher('test', 'foo', output_ring_size='1K',
+                          follow_output=True)
+        watcher.notify_event = mock.Mock()
+        watcher.record_output(data)
+        topic, event = watcher.notify_event.call_args[0]
+        self.assertEqual(topic, 'output')
+        self.assertEqual(event['data'], 'foo\n')
+
+    def test_tail_disabled(self):
+        watcher = Watcher('test', 'foo')
+        self.assertTrue(watcher.output_ring is None)
+        self.assertRaises(ValueError, watcher.tail)
+
+
+class TestWatcherPublishOutput(TestCircus):
+
+    def get_watcher(self, **kwargs):
+        context = zmq.Context.instance()
+        arbiter = mock.MagicMock()
+        arbiter.output_socket = context.socket(zmq.PUB)
+        self.addCleanup(arbiter.output_socket.close)
+        port = arbiter.output_socket.bind_to_random_port('tcp://127.0.0.1')
+
+        sub = context.socket(zmq.SUB)
+        self.addCleanup(sub.close)
+        sub.linger = 0
+        sub.setsockopt(zmq.SUBSCRIBE, b'output.test.')
+        sub.connect('tcp://127.0.0.1:%d' % port)
+        # let the subscription reach the publisher
+        time.sleep(.2)
+
+        watcher = Watcher('test', 'foo', publish_output=True, **kwargs)
+        watcher.arbiter = arbiter
+        return watcher, sub
+
+    def receive(self, sub):
+        if not sub.poll(1000):
+            return None
+        topic, msg = sub.recv_multipart()
+        return topic, json.loads(msg.decode('utf-8'))
+
+    def test_publish(self):
+        watcher, sub = self.get_watcher()
+        self.assertTrue(watcher.output_ring is None)
+        watcher.record_output({'pid': 12, 'wid': 1, 'name': 'stdout',
+                               'data': b'foo\n'})
+
+        topic, msg = self.receive(sub)
+        self.assertEqual(topic, b'output.test.12')
+        self.assertEqual((msg['pid'], msg['wid'], msg['name'], msg['data']),
+                         (12, 1, 'stdout', 'foo\n'))
+
+    def test_max_rate(self):
+        watcher, sub = self.get_watcher(publish_max_rate='1K')
+        for i in range(3):
+            watcher.record_output({'pid': 12, 'name': 'stdout',
+                                   'data': b'x' * 400})
+
+        # the third one goes over the limit
+        self.assertEqual(watcher.publish_dropped, 400)
+        self.assertNotEqual(self.receive(sub), None)
+        self.assertNotEqual(self.receive(sub), None)
+        self.assertEqual(self.receive(sub), None)
+
+    def test_sample(self):
+        watcher, sub = self.get_watcher(publish_sample=0)
+        watcher.record_output({'pid': 12, 'name': 'stdout', 'data': b'foo'})
+        self.assertEqual(watcher.publish_dropped, 3)
+
+
 class SomeWatcher(object):
 
     def __init__(self, loop=None, **kw):
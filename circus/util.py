@@ -150,6 +150,57 @@ def human2bytes(s):
 
     return int(n) << symbols.index(symbol)*10
 
+
+def to_size(s):
+    """Converts a number of bytes, or its human representation like
+    "64K", to an int."""
+    if isinstance(s, int):
+        return s
+    s = s.strip()
+    if s.isdigit():
+        return int(s)
+    return human2bytes(s)
+
+
+class TokenBucket(object):
+    """Lets through **rate** units per second on average, with bursts of up
+    to **burst** units (default: a second worth of them)."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated = time.time()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, amount=1):
+        """Takes *amount* tokens and returns True if there are enough of
+        them, or returns False."""
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def take(self, amount):
+        """Takes up to *amount* tokens and returns how many were taken."""
+        self._refill()
+        taken = max(0, min(amount, int(self.tokens)))
+        self.tokens -= taken
+        return taken
+
+    def spend(self, amount):
+        """Takes *amount* tokens even if it puts the bucket in debt, and
+        returns the number of seconds until the debt is paid back."""
+        self._refill()
+        self.tokens -= amount
+        return max(0., -self.tokens / self.rate)
+
 # XXX weak dict ?
 _PROCS = {}
 
@@ -384,12 +435,20 @@ def env_to_str(env):
                      sorted(env.items(), key=lambda i: i[0])])
 
 
+# Linux only, not exposed by the fcntl module before Python 3.10
+F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031)
+
+
 if fcntl is None:
 
     def close_on_exec(fd):
         raise RuntimeError(
             "'close_on_exec' not available on this operating system")
 
+    def set_nonblocking(fd):
+        raise RuntimeError(
+            "'set_nonblocking' not available on this operating system")
+
 else:
 
     def close_on_exec(fd):  # NOQA
@@ -397,6 +456,25 @@ else:
         flags |= fcntl.FD_CLOEXEC
         fcntl.fcntl(fd, fcntl.F_SETFD, flags)
 
+    def set_nonblocking(fd):  # NOQA
+        flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+        flags |= os.O_NONBLOCK
+        fcntl.fcntl(fd, fcntl.F_SETFL, flags)
+
+
+def set_pipe_size(fd, size):
+    """Sets the capacity of the pipe *fd* to *size* bytes.
+
+    Returns the new capacity, or None when the system can't change it.
+    """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        return None
+    try:
+        return fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+    except (IOError, OSError) as e:
+        logger.warning('Could not set the pipe size to %d: %s', size, e)
+        return None
+
 
 def get_python_version():
     """Get a 3 element tuple with the python version"""
@@ -4,7 +4,7 @@ import os
 import signal
 import time
 import sys
-from random import randint
+from random import randint, random
 try:
     from itertools import zip_longest as izip_longest
 except ImportError:
@@ -13,6 +13,7 @@ import site
 from tornado import gen
 
 from psutil import NoSuchProcess
+import zmq
 import zmq.utils.jsonapi as json
 from zmq.eventloop import ioloop
 
@@ -20,6 +21,7 @@ from circus.process import Process, DEAD_OR_ZOMBIE, UNEXISTING
 from circus import logger
 from circus import util
 from circus.stream import get_pipe_redirector, get_stream
+from circus.stream.ring import OutputRing
 from circus.util import parse_env_dict, resolve_name, tornado_sleep
 from circus.py3compat import bytestring, is_callable, b
 
@@ -85,6 +87,18 @@ class Watcher(object):
       - **backup_count**: how many backups to retain when rotating files
         according to the max_bytes parameter. defaults to 0 which means
         no backups are made (only applicable with FileStream)
+      - **rotate_when**, **timestamped** and **compress**: time-based
+        rotation, naming and compression of the backups, see
+        :class:`circus.stream.FileStream`.
+      - **line_buffered**: if True, the stream only receives complete
+        lines, batched in a single call. defaults to False.
+      - **max_line_length**: in line_buffered mode, the length after which
+        a line without end of line is sent anyway. defaults to 65536.
+      - **max_buffer**, **read_budget** and **pipe_size**: control how
+        the pipes are read, see :func:`circus.stream.get_pipe_redirector`.
+      - **direct**: if True and the stream is a FileStream or a
+        WatchedFileStream without time_format, the processes write to the
+        file themselves instead of a pipe read by circus. defaults to False.
 
       This mapping will be used to create a stream callable of the specified
       class.
@@ -107,6 +121,18 @@ class Watcher(object):
       - **backup_count**: how many backups to retain when rotating files
         according to the max_bytes parameter. defaults to 0 which means
         no backups are made (only applicable with FileStream).
+      - **rotate_when**, **timestamped** and **compress**: time-based
+        rotation, naming and compression of the backups, see
+        :class:`circus.stream.FileStream`.
+      - **line_buffered**: if True, the stream only receives complete
+        lines, batched in a single call. defaults to False.
+      - **max_line_length**: in line_buffered mode, the length after which
+        a line without end of line is sent anyway. defaults to 65536.
+      - **max_buffer**, **read_budget** and **pipe_size**: control how
+        the pipes are read, see :func:`circus.stream.get_pipe_redirector`.
+      - **direct**: if True and the stream is a FileStream or a
+        WatchedFileStream without time_format, the processes write to the
+        file themselves instead of a pipe read by circus. defaults to False.
 
       This mapping will be used to create a stream callable of the specified
       class.
@@ -173,6 +199,30 @@ class Watcher(object):
 
     - **close_child_stderr**: If True, closes the stderr after the fork.
       default: False.
+
+    - **output_ring_size**: If set, the last bytes of output read from the
+      streams are kept in memory, up to that size (e.g. 65536 or 64K) for
+      the watcher and the same size for each process. They are returned
+      by the *tail* command. default: 0, nothing is kept.
+
+    - **follow_output**: If True, the output kept with *output_ring_size*
+      is also published as *output* events, so it can be followed with
+      `circusctl tail --follow`. default: False.
+
+    - **publish_output**: If True, the output read from the streams is
+      published on the *output_endpoint* of the arbiter, with the
+      *output.<watcher>.<pid>* topic. default: False.
+
+    - **publish_max_rate**: If set, at most this many bytes per second
+      (e.g. 65536 or 64K) of output are published, the rest is dropped.
+      default: 0, no limit.
+
+    - **publish_sample**: The fraction of the reads that are published,
+      between 0 and 1. default: 1, all of them.
+
+    - **output_weight**: When the arbiter reads the pipes of the watchers
+      in turns (*fair_output*), the share of the reads the pipes of this
+      watcher get, 1 or more. default: 1.
     """
 
     def __init__(self, name, cmd, args=None, numprocesses=1, warmup_delay=0.,
@@ -186,6 +236,9 @@ class Watcher(object):
                  max_age_variance=30, hooks=None, respawn=True,
                  autostart=True, on_demand=False, virtualenv=None,
                  close_child_stdout=False, close_child_stderr=False,
+                 output_ring_size=0, follow_output=False,
+                 publish_output=False,
+                 publish_max_rate=0, publish_sample=1., output_weight=1,
                  **options):
         self.name = name
         self.use_sockets = use_sockets
@@ -221,6 +274,26 @@ class Watcher(object):
         self.autostart = autostart
         self.close_child_stdout = close_child_stdout
         self.close_child_stderr = close_child_stderr
+        self.output_ring_size = util.to_size(output_ring_size)
+        self.output_ring = None
+        if self.output_ring_size:
+            self.output_ring = OutputRing(self.output_ring_size)
+        self.follow_output = util.to_bool(follow_output)
+        self.publish_output = util.to_bool(publish_output)
+        self.publish_max_rate = util.to_size(publish_max_rate)
+        self.publish_sample = float(publish_sample)
+        self._publish_bucket = None
+        if self.publish_max_rate:
+            self._publish_bucket = util.TokenBucket(self.publish_max_rate)
+        # the bytes of output not published because of the limits
+        self.publish_dropped = 0
+        self.output_weight = int(output_weight)
+        if self.output_weight < 1:
+            raise ValueError('output_weight should be 1 or more, not %d'
+                             % self.output_weight)
+        # True for the watchers the arbiter runs itself: circusd-stats,
+        # circusd-logger, circushttpd and the plugins
+        self.is_internal = False
         self.loop = loop or ioloop.IOLoop.instance()
 
         if singleton and self.numprocesses not in (0, 1):
@@ -235,7 +308,10 @@ class Watcher(object):
                           "priority", "copy_env", "singleton",
                           "stdout_stream_conf", "on_demand",
                           "stderr_stream_conf", "max_age", "max_age_variance",
-                          "close_child_stdout", "close_child_stderr")
+                          "close_child_stdout", "close_child_stderr",
+                          "output_ring_size", "follow_output",
+                          "publish_output", "publish_max_rate",
+                          "publish_sample", "output_weight")
                          + tuple(options.keys()))
 
         if not working_dir:
@@ -298,8 +374,7 @@ class Watcher(object):
             if self.stdout_redirector:
                 self.stdout_redirector.redirect = self.stdout_stream['stream']
             else:
-                self.stdout_redirector = get_pipe_redirector(
-                    self.stdout_stream, loop=self.loop)
+                self.stdout_redirector = self._get_redirector('stdout')
                 self.stdout_redirector.start()
                 action = 1
 
@@ -313,8 +388,7 @@ class Watcher(object):
             if self.stderr_redirector:
                 self.stderr_redirector.redirect = self.stderr_stream['stream']
             else:
-                self.stderr_redirector = get_pipe_redirector(
-                    self.stderr_stream, loop=self.loop)
+                self.stderr_redirector = self._get_redirector('stderr')
                 self.stderr_redirector.start()
                 action = 1
 
@@ -323,20 +397,119 @@ class Watcher(object):
 
         return action
 
+    def _get_redirector(self, name):
+        # the output goes through circusd-logger when the arbiter runs one
+        shipper = getattr(self.arbiter, 'shipper', None)
+        conf = getattr(self, '%s_stream_conf' % name)
+        if shipper is not None and shipper.accepts(self, conf):
+            return shipper.get_redirector(self, name)
+        redirector = get_pipe_redirector(
+            getattr(self, '%s_stream' % name),
+            extra_info={'watcher': self.name}, loop=self.loop,
+            scheduler=getattr(self.arbiter, 'output_scheduler', None),
+            group=self.name, weight=self.output_weight)
+        if self.output_ring is not None or self.publish_output:
+            redirector.recorder = self.record_output
+        redirector.on_suppress = self.output_suppressed
+        return redirector
+
+    def output_suppressed(self, process, name, size):
+        """Called when output of *process* was dropped by the rate limits of
+        its stream."""
+        streamer = getattr(self.arbiter, 'stats_streamer', None)
+        if streamer is not None:
+            streamer.suppressed[process.pid] += size
+        self.notify_event('suppressed', {'process_pid': process.pid,
+                                         'name': name, 'bytes': size,
+                                         'time': time.time()})
+
+    def record_output(self, data):
+        """Keeps the output in the rings and publishes it."""
+        if self.output_ring is not None:
+            self.output_ring(data)
+            process = self.processes.get(data['pid'])
+            if process is not None and process.output_ring is not None:
+                process.output_ring(data)
+            if self.follow_output:
+                self.notify_event('output', {
+                    'process_pid': data['pid'], 'name': data['name'],
+                    'data': data['data'].decode('utf-8', 'replace'),
+                    'time': time.time()})
+        if self.publish_output:
+            self.publish_output_data(data)
+
+    def publish_output_data(self, data):
+        """Publishes the output on the output endpoint of the arbiter,
+        within the sampling and rate limits of the watcher."""
+        socket = getattr(self.arbiter, 'output_socket', None)
+        if socket is None or socket.closed:
+            return
+        size = len(data['data'])
+        if self.publish_sample < 1 and random() >= self.publish_sample:
+            self.publish_dropped += size
+            return
+        if (self._publish_bucket is not None and
+                not self._publish_bucket.consume(size)):
+            self.publish_dropped += size
+            return
+
+        topic = b("output.%s.%s" % (self.res_name, data['pid']))
+        msg = json.dumps({'pid': data['pid'], 'wid': data.get('wid'),
+                          'name': data['name'],
+                          'data': data['data'].decode('utf-8', 'replace'),
+                          'time': time.time()})
+        try:
+            # the socket drops the messages past its hwm instead of
+            # blocking
+            socket.send_multipart([topic, msg], zmq.NOBLOCK)
+        except zmq.Again:
+            self.publish_dropped += size
+
+    def tail(self, count=10, pid=None):
+        """Returns the last *count* lines of output kept for the watcher,
+        or for the process *pid* if given."""
+        if self.output_ring is None:
+            raise ValueError('no output is kept for %r, set its '
+                             'output_ring_size' % self.name)
+        if pid is None:
+            ring = self.output_ring
+        else:
+            ring = self.processes[int(pid)].output_ring
+        return [{'pid': line_pid, 'name': name,
+                 'line': line.decode('utf-8', 'replace')}
+                for line_pid, name, line in ring.lines(count)]
+
+    def _get_direct_fileno(self, name):
+        stream = getattr(self, '%s_stream' % name)
+        if not stream or not stream.get('direct'):
+            return None
+        get_fd = getattr(stream['stream'], 'direct_fileno', None)
+        if get_fd is None:
+            return None
+        return get_fd()
+
+    def _rollover_direct_streams(self):
+        # nobody else sees the output written directly to the files
+        for name in ('stdout', 'stderr'):
+            stream = getattr(self, '%s_stream' % name)
+            if stream and stream.get('direct'):
+                rollover = getattr(stream['stream'], 'rollover_if_needed',
+                                   None)
+                if rollover is not None:
+                    rollover()
+
     def _create_redirectors(self):
         if self.stdout_stream:
             if self.stdout_redirector is not None:
                 self.stdout_redirector.stop()
-            self.stdout_redirector = get_pipe_redirector(
-                self.stdout_stream, loop=self.loop)
+            self.stdout_redirector = self._get_redirector('stdout')
         else:
             self.stdout_redirector = None
 
         if self.stderr_stream:
             if self.stderr_redirector is not None:
                 self.stderr_redirector.stop()
-            self.stderr_redirector = get_pipe_redirector(
-                self.stderr_stream, loop=self.loop)
+            self.stderr_redirector = self._get_redirector('stderr')
         else:
             self.stderr_redirector = None
 
@@ -483,6 +656,8 @@ class Watcher(object):
         if self.max_age:
             yield self.remove_expired_processes()
 
+        self._rollover_direct_streams()
+
         # adding fresh processes
         if len(self.processes) < self.numprocesses and not self.is_stopping():
             if self.respawn:
@@ -569,8 +744,13 @@ class Watcher(object):
 
         while nb_tries < self.max_retry or self.max_retry == -1:
             process = None
-            pipe_stdout = self.stdout_redirector is not None
-            pipe_stderr = self.stderr_redirector is not None
+            # the processes write straight to the file when possible
+            stdout_fd = self._get_direct_fileno('stdout')
+            stderr_fd = self._get_direct_fileno('stderr')
+            pipe_stdout = (self.stdout_redirector is not None and
+                           stdout_fd is None)
+            pipe_stderr = (self.stderr_redirector is not None and
+                           stderr_fd is None)
 
             try:
                 process = Process(self._nextwid, cmd,
@@ -582,7 +762,10 @@ class Watcher(object):
                                   pipe_stdout=pipe_stdout,
                                   pipe_stderr=pipe_stderr,
                                   close_child_stdout=self.close_child_stdout,
-                                  close_child_stderr=self.close_child_stderr)
+                                  close_child_stderr=self.close_child_stderr,
+                                  stdout_fd=stdout_fd, stderr_fd=stderr_fd)
+                if self.output_ring is not None:
+                    process.output_ring = OutputRing(self.output_ring_size)
 
                 # stream stderr/stdout if configured
                 if pipe_stdout and self.stdout_redirector is not None:
@@ -620,6 +803,7 @@ class Watcher(object):
 
         The signal is sent to the process itself then to all the children
         """
+        children = []
         try:
             # getting the process children
             children = process.children()
@@ -41,12 +41,14 @@ setup(name='circus',
           "License :: OSI Approved :: Apache Software License"
       ],
       install_requires=install_requires,
+      extras_require={'msgpack': ['msgpack']},
       tests_require=tests_require,
       test_suite='circus.tests',
       entry_points="""
       [console_scripts]
       circusd = circus.circusd:main
       circusd-stats = circus.stats:main
+      circusd-logger = circus.stream.shipper:main
       circusctl = circus.circusctl:main
       circus-top = circus.stats.client:main
       circus-plugin = circus.plugins:main